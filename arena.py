@@ -0,0 +1,287 @@
+from array import array
+import marshal
+import struct
+import zlib
+
+from nodetypes import *
+from tokentypes import Token, TOKEN_CODES, TOKEN_TYPES
+
+# how a node field is stored in one of the a/b/c columns
+F_NODE = 0 # id of another arena row, -1 for None
+F_VALUE = 1 # index into the interned value table
+F_TOKEN = 2 # id of a token row
+
+# the fields of every node class, in column order
+NODE_FIELDS = {
+    IntLitNode: (("value", F_VALUE),),
+    CharLitNode: (("value", F_VALUE),),
+    IdentifierNode: (("value", F_TOKEN),),
+    UnaryOperationNode: (("sign", F_VALUE), ("right_node", F_NODE)),
+    BinaryOperationNode: (("left_node", F_NODE), ("sign", F_VALUE), ("right_node", F_NODE)),
+    PrintNode: (("expr", F_NODE),),
+    GlobalVarDeclarationNode: (("type", F_TOKEN), ("name", F_TOKEN)),
+    LocalVarDeclarationNode: (("type", F_TOKEN), ("name", F_TOKEN), ("initial", F_NODE)),
+    VarAssignNode: (("name", F_NODE), ("expr", F_NODE)),
+    IfNode: (("expr", F_NODE), ("if_stmts", F_NODE), ("else_stmts", F_NODE)),
+    # functions take no arguments yet, so args is not stored
+    FunctionDeclarationNode: (("type", F_TOKEN), ("name", F_TOKEN), ("stmts", F_NODE)),
+}
+
+SEQUENCE_TYPES = (GlobalStatements, FunctionStatements)
+
+# kind codes: one per node class, then the statement lists, then tokens
+NODE_TYPES = list(NODE_FIELDS) + list(SEQUENCE_TYPES)
+NODE_KINDS = {cls: kind for kind, cls in enumerate(NODE_TYPES)}
+K_TOKEN = len(NODE_TYPES)
+
+
+class NodeArena(object):
+    """
+    Flat form of a syntax tree. Every node is a row in a set of parallel
+    typed arrays and refers to its children by row id. Statement lists keep
+    their items in a separate children array (a = offset, b = count), and
+    tokens are rows of their own (a = type code, b = value index).
+    """
+    HEADER = struct.Struct("<4siIIiI")
+    MAGIC = b"OAST"
+
+    def __init__(self, source=None):
+        self.source = source
+
+        self.kinds = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+        self.a = array('i')
+        self.b = array('i')
+        self.c = array('i')
+
+        self.children = array('i')
+
+        self.values = []
+        self.value_index = {}
+
+        self.root = -1
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def intern(self, value):
+        idx = self.value_index.get(value)
+        if idx is None:
+            idx = self.value_index[value] = len(self.values)
+            self.values.append(value)
+        return idx
+
+    def add_row(self, kind, start, end, a=-1, b=-1, c=-1):
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.a.append(a)
+        self.b.append(b)
+        self.c.append(c)
+        return len(self.kinds) - 1
+
+    def add_token(self, tok):
+        return self.add_row(K_TOKEN, tok.start, tok.end, TOKEN_CODES[tok.type], self.intern(tok.value))
+
+    def add_tree(self, tree):
+        """
+        Flattens a tree of node objects, e.g. one statement of a file, and
+        returns the id of its root. Children are added before their
+        parents, using an explicit stack instead of recursion.
+        """
+        ids = {}
+
+        stack = [(tree, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if node is None or id(node) in ids:
+                continue
+
+            if not expanded:
+                stack.append((node, True))
+                if isinstance(node, SEQUENCE_TYPES):
+                    stack.extend((child, False) for child in node)
+                else:
+                    for name, how in NODE_FIELDS[type(node)]:
+                        if how == F_NODE:
+                            stack.append((getattr(node, name), False))
+                continue
+
+            ids[id(node)] = self.add_node(node, ids)
+
+        return ids[id(tree)]
+
+    def add_node(self, node, ids):
+        kind = NODE_KINDS[type(node)]
+
+        if isinstance(node, SEQUENCE_TYPES):
+            return self.add_sequence(type(node), [-1 if child is None else ids[id(child)] for child in node])
+
+        if type(node) is FunctionDeclarationNode and node.args:
+            raise ValueError("Function arguments can't be stored in an arena")
+
+        columns = []
+        for name, how in NODE_FIELDS[type(node)]:
+            value = getattr(node, name)
+            if how == F_NODE:
+                columns.append(-1 if value is None else ids[id(value)])
+            elif how == F_VALUE:
+                columns.append(self.intern(value))
+            else:
+                columns.append(self.add_token(value))
+
+        return self.add_row(kind, node.pos_start.idx, node.pos_end.idx, *columns)
+
+    def add_sequence(self, cls, child_ids):
+        """
+        Adds a statement list of rows already in the arena.
+        """
+        offset = len(self.children)
+        self.children.extend(child_ids)
+        present = [child for child in child_ids if child >= 0]
+        start = self.starts[present[0]] if present else 0
+        end = self.ends[present[-1]] if present else 0
+        return self.add_row(NODE_KINDS[cls], start, end, offset, len(child_ids))
+
+    def columns(self):
+        return (self.kinds, self.starts, self.ends, self.a, self.b, self.c)
+
+    def to_bytes(self):
+        """
+        Tagged binary encoding: a header with a CRC-32 of the rest, the
+        raw column arrays and the marshalled value table.
+        """
+        values = marshal.dumps(self.values)
+        body = b"".join([column.tobytes() for column in self.columns()] + [self.children.tobytes(), values])
+        header = self.HEADER.pack(self.MAGIC, self.root, len(self.kinds), len(self.children), len(values),
+                                  zlib.crc32(body))
+        return header + body
+
+    @classmethod
+    def from_bytes(cls, data, source=None):
+        """
+        Decodes to_bytes(). Anything truncated or damaged raises
+        ValueError before it is decoded.
+        """
+        if len(data) < cls.HEADER.size:
+            raise ValueError("Truncated node arena")
+        magic, root, count, children, values_len, crc = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError("Not a node arena")
+
+        arena = cls(source)
+        arena.root = root
+
+        row_size = sum(column.itemsize for column in arena.columns())
+        if values_len < 0 or len(data) != (cls.HEADER.size + count * row_size
+                                           + children * arena.children.itemsize + values_len):
+            raise ValueError("Node arena size doesn't match its header")
+        if zlib.crc32(memoryview(data)[cls.HEADER.size:]) != crc:
+            raise ValueError("Node arena is damaged")
+        if not 0 <= root < count:
+            raise ValueError("Bad node arena root")
+
+        offset = cls.HEADER.size
+        for column, n in [(column, count) for column in arena.columns()] + [(arena.children, children)]:
+            size = n * column.itemsize
+            column.frombytes(data[offset:offset + size])
+            offset += size
+
+        arena.values = marshal.loads(data[offset:offset + values_len])
+        arena.value_index = {v: i for i, v in enumerate(arena.values)}
+
+        return arena
+
+    def node(self, node_id):
+        """
+        Returns a view of row node_id, None for -1.
+        """
+        if node_id < 0:
+            return None
+        return VIEW_TYPES[self.kinds[node_id]](self, node_id)
+
+    @property
+    def tree(self):
+        return self.node(self.root)
+
+
+class ArenaNode(object):
+    """
+    Base of the read-only views onto arena rows. Each view class carries the
+    name of the node class it stands for, so passes that dispatch on the
+    class name (Compiler.visit) walk arenas and object trees alike.
+    """
+    __slots__ = ("arena", "id")
+
+    def __init__(self, arena, node_id):
+        self.arena = arena
+        self.id = node_id
+
+    @property
+    def pos_start(self):
+        return self.arena.source.position(self.arena.starts[self.id])
+
+    @property
+    def pos_end(self):
+        return self.arena.source.position(self.arena.ends[self.id])
+
+    def __eq__(self, other):
+        return type(other) is type(self) and other.arena is self.arena and other.id == self.id
+
+    def __hash__(self):
+        return hash((id(self.arena), self.id))
+
+
+class ArenaStatements(ArenaNode):
+    __slots__ = ()
+
+    def __len__(self):
+        return self.arena.b[self.id]
+
+    def __iter__(self):
+        arena = self.arena
+        offset = arena.a[self.id]
+        for i in range(offset, offset + arena.b[self.id]):
+            yield arena.node(arena.children[i])
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("statement index out of range")
+        return self.arena.node(self.arena.children[self.arena.a[self.id] + i])
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def make_field(column, how):
+    def get_node(self):
+        return self.arena.node(getattr(self.arena, column)[self.id])
+
+    def get_value(self):
+        return self.arena.values[getattr(self.arena, column)[self.id]]
+
+    def get_token(self):
+        arena = self.arena
+        tok = getattr(arena, column)[self.id]
+        return Token(TOKEN_TYPES[arena.a[tok]], arena.values[arena.b[tok]], arena.starts[tok], arena.ends[tok], arena.source)
+
+    return property((get_node, get_value, get_token)[how])
+
+
+def make_view_type(cls):
+    if cls in SEQUENCE_TYPES:
+        return type(cls.__name__, (ArenaStatements,), {"__slots__": ()})
+
+    namespace = {"__slots__": (), "__repr__": cls.__repr__, "_children": cls._children}
+    for column, (name, how) in zip("abc", NODE_FIELDS[cls]):
+        namespace[name] = make_field(column, how)
+    if cls is FunctionDeclarationNode:
+        namespace["args"] = ()
+
+    return type(cls.__name__, (ArenaNode,), namespace)
+
+
+VIEW_TYPES = [make_view_type(cls) for cls in NODE_TYPES]
@@ -0,0 +1,90 @@
+import os
+
+# Structured assembly: the CodeGenerator emits these instead of text, so
+# later passes (peephole.py) can look at instructions and operands.
+
+WRITE_BUFFER_SIZE = 1 << 16
+
+
+class AsmInstr(object):
+    __slots__ = ("op", "operands")
+
+    def __init__(self, op, *operands):
+        self.op = op
+        self.operands = tuple(map(str, operands))
+
+    def __repr__(self):
+        if self.operands:
+            return "\t{}\t{}".format(self.op, ", ".join(self.operands))
+        return "\t" + self.op
+
+
+class Label(object):
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name + ":"
+
+
+class Directive(object):
+    """
+    Anything else that goes into the output verbatim: sections, data,
+    global and extern declarations, empty lines.
+    """
+    __slots__ = ("text",)
+
+    def __init__(self, text=""):
+        self.text = text
+
+    def __repr__(self):
+        return self.text
+
+
+class Reserve(object):
+    """
+    size uninitialized bytes in .bss.
+    """
+    __slots__ = ("size",)
+
+    def __init__(self, size):
+        self.size = size
+
+    def __repr__(self):
+        return "\tresb\t{}".format(self.size)
+
+
+class AsmWriter(object):
+    """
+    Writes items as assembly text to out, a file name or any text file
+    object (an io.StringIO keeps it in memory). Every write() goes out
+    right away through the file's buffer, so the caller decides what is
+    kept until the end, like .bss.
+    """
+    def __init__(self, out):
+        self.owned = isinstance(out, str)
+        self.out = open(out, "w", buffering=WRITE_BUFFER_SIZE) if self.owned else out
+
+    def write(self, items):
+        self.out.write(render(items))
+
+    def close(self):
+        if self.owned:
+            self.out.close()
+        else:
+            self.out.flush()
+
+    def discard(self):
+        if self.owned:
+            self.out.close()
+            os.remove(self.out.name)
+
+
+def is_memory(operand):
+    return operand.endswith("]")
+
+
+def render(items):
+    return "".join(repr(item) + "\n" for item in items)
@@ -0,0 +1,102 @@
+import hashlib
+import os
+import struct
+
+from arena import NodeArena
+
+# bump whenever the parser output or the arena encoding changes, stale
+# entries are then simply never looked up again
+COMPILER_VERSION = b"oasis-ast-2"
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "oasis")
+
+
+class AstCache(object):
+    """
+    On-disk cache of parsed files. Entries are serialized NodeArenas keyed
+    by a hash of the source text and COMPILER_VERSION. Hits bump the
+    entry's mtime, and storing a new entry evicts the least recently used
+    ones once max_entries or max_bytes is exceeded.
+    """
+    SUFFIX = ".ast"
+
+    def __init__(self, directory=None, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.directory = directory or os.environ.get("OASIS_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(source):
+        h = hashlib.sha256(COMPILER_VERSION)
+        h.update(b"\0")
+        text = source.text
+        h.update(text.encode() if isinstance(text, str) else text)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def load(self, source):
+        """
+        Returns the cached arena for source, or None on a miss. An entry
+        that can't be decoded is a miss too and is deleted.
+        """
+        path = self.path(self.key(source))
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        try:
+            arena = NodeArena.from_bytes(data, source)
+        except (ValueError, EOFError, TypeError, struct.error):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return arena
+
+    def store(self, source, arena):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+
+            path = self.path(self.key(source))
+            tmp = "{}.{}.tmp".format(path, os.getpid())
+            with open(tmp, "wb") as f:
+                f.write(arena.to_bytes())
+            os.replace(tmp, path)
+
+            self.evict()
+        except OSError:
+            # a cache we can't write to just means recompiling next time
+            pass
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.SUFFIX):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+
+        while entries and (len(entries) > self.max_entries or total > self.max_bytes):
+            _, size, name = entries.pop(0)
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
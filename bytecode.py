@@ -0,0 +1,418 @@
+from array import array
+
+from sym import *
+from tokentypes import *
+from error import *
+from visitor import Visitor
+from fold import wrap
+
+# Stack machine code for vm.py, as a flat array of 32 bit words: every
+# instruction is its opcode followed by its operands. Locals and globals
+# are slot numbers into arrays, jump targets are positions in the code.
+# Values are ints; a char is only cut to its low byte where the native
+# backend reads one (stores, compares, tests, prints), see B_CHAR.
+OPCODE_NAMES = []
+OPERAND_COUNTS = []
+
+
+def opcode(name, operands=0):
+    OPCODE_NAMES.append(name)
+    OPERAND_COUNTS.append(operands)
+    return len(OPCODE_NAMES) - 1
+
+
+B_CONST = opcode("const", 1) # push k
+B_LOAD = opcode("load", 1) # push frame[s]
+B_STORE = opcode("store", 1) # frame[s] = pop
+B_GLOAD = opcode("gload", 1) # push globals[g]
+B_GSTORE = opcode("gstore", 1) # globals[g] = pop
+B_DUP = opcode("dup")
+B_POP = opcode("pop")
+B_ADD = opcode("add")
+B_SUB = opcode("sub")
+B_MUL = opcode("mul")
+B_DIV = opcode("div")
+B_NEG = opcode("neg")
+B_CHAR = opcode("char") # the low byte of the top, sign extended
+B_EQ = opcode("eq") # push a == b, 0 or 1
+B_NE = opcode("ne")
+B_LT = opcode("lt")
+B_LE = opcode("le")
+B_GT = opcode("gt")
+B_GE = opcode("ge")
+B_JMP = opcode("jmp", 1) # goto t
+B_JZ = opcode("jz", 1) # goto t if pop == 0
+B_PRINT_INT = opcode("print_int")
+B_PRINT_CHAR = opcode("print_char")
+B_RET = opcode("ret")
+
+# superinstructions, fused from the sequences in FUSIONS
+B_ADD_CONST = opcode("add_const", 1) # top += k
+B_CONST_STORE = opcode("const_store", 2) # frame[s] = k
+B_LOAD_STORE = opcode("load_store", 2) # frame[d] = frame[s]
+B_LOAD_LOAD = opcode("load_load", 2)
+B_LOAD_ADD_STORE = opcode("load_add_store", 3) # frame[d] = frame[a] + frame[b]
+B_LOAD_CONST_ADD_STORE = opcode("load_const_add_store", 3) # frame[d] = frame[a] + k
+B_LOAD_PRINT_INT = opcode("load_print_int", 1)
+B_JNEQ = opcode("jneq", 1) # goto t unless a == b
+B_JNNE = opcode("jnne", 1)
+B_JNLT = opcode("jnlt", 1)
+B_JNLE = opcode("jnle", 1)
+B_JNGT = opcode("jngt", 1)
+B_JNGE = opcode("jnge", 1)
+
+BINARY_OPCODES = {
+    T_PLUS: B_ADD,
+    T_MINUS: B_SUB,
+    T_ASTERISK: B_MUL,
+    T_SLASH: B_DIV
+}
+
+COMPARISON_OPCODES = {
+    T_DEQ: B_EQ,
+    T_NEQ: B_NE,
+    T_LT: B_LT,
+    T_LTE: B_LE,
+    T_GT: B_GT,
+    T_GTE: B_GE
+}
+
+JUMPS = {B_JMP, B_JZ, B_JNEQ, B_JNNE, B_JNLT, B_JNLE, B_JNGT, B_JNGE}
+
+# (sequence, fused opcode, operands of the fused instruction picked from
+# the operands of the sequence), longest sequences first
+FUSIONS = [
+    ((B_LOAD, B_LOAD, B_ADD, B_STORE), B_LOAD_ADD_STORE, lambda a, b, d: (a, b, d)),
+    ((B_LOAD, B_CONST, B_ADD, B_STORE), B_LOAD_CONST_ADD_STORE, lambda a, k, d: (a, k, d)),
+    ((B_CONST, B_ADD), B_ADD_CONST, lambda k: (k,)),
+    ((B_CONST, B_SUB), B_ADD_CONST, lambda k: (-k,)),
+    ((B_CONST, B_STORE), B_CONST_STORE, lambda k, s: (k, s)),
+    ((B_LOAD, B_STORE), B_LOAD_STORE, lambda s, d: (s, d)),
+    ((B_LOAD, B_PRINT_INT), B_LOAD_PRINT_INT, lambda s: (s,)),
+    ((B_EQ, B_JZ), B_JNEQ, lambda t: (t,)),
+    ((B_NE, B_JZ), B_JNNE, lambda t: (t,)),
+    ((B_LT, B_JZ), B_JNLT, lambda t: (t,)),
+    ((B_LE, B_JZ), B_JNLE, lambda t: (t,)),
+    ((B_GT, B_JZ), B_JNGT, lambda t: (t,)),
+    ((B_GE, B_JZ), B_JNGE, lambda t: (t,)),
+    ((B_LOAD, B_LOAD), B_LOAD_LOAD, lambda a, b: (a, b)),
+]
+
+
+class BytecodeLabel(object):
+    __slots__ = ("position",)
+
+    def __init__(self):
+        self.position = None
+
+
+def fuse(instrs):
+    """
+    Replaces the sequences of FUSIONS in a list of (opcode, operands...)
+    tuples and labels by superinstructions. Nothing is fused across a
+    label, something may jump there.
+    """
+    out = []
+    i = 0
+    while i < len(instrs):
+        for sequence, fused, pick in FUSIONS:
+            window = instrs[i:i + len(sequence)]
+            if len(window) == len(sequence) and all(type(instr) is tuple and instr[0] == op
+                                                    for instr, op in zip(window, sequence)):
+                operands = [operand for instr in window for operand in instr[1:]]
+                out.append((fused,) + pick(*operands))
+                i += len(sequence)
+                break
+        else:
+            out.append(instrs[i])
+            i += 1
+    return out
+
+
+def flatten(instrs):
+    """
+    The code array of a list of instructions and labels, with the labels
+    resolved to positions.
+    """
+    position = 0
+    for instr in instrs:
+        if type(instr) is BytecodeLabel:
+            instr.position = position
+        else:
+            position += len(instr)
+
+    code = array("i")
+    for instr in instrs:
+        if type(instr) is tuple:
+            code.append(instr[0])
+            if instr[0] in JUMPS:
+                code.append(instr[1].position)
+            else:
+                code.extend(wrap(operand, D_INT) for operand in instr[1:])
+    return code
+
+
+class BytecodeFunction(object):
+    def __init__(self, name, code, frame_size):
+        self.name = name
+        self.code = code
+        self.frame_size = frame_size
+
+    def __repr__(self):
+        lines = ["function {} (frame {}):".format(self.name, self.frame_size)]
+        code = self.code
+        pc = 0
+        while pc < len(code):
+            count = OPERAND_COUNTS[code[pc]]
+            operands = ", ".join(map(str, code[pc + 1:pc + 1 + count]))
+            lines.append("\t{}\t{} {}".format(pc, OPCODE_NAMES[code[pc]], operands).rstrip())
+            pc += 1 + count
+        return "\n".join(lines) + "\n"
+
+
+class BytecodeProgram(object):
+    def __init__(self):
+        self.functions = {}
+        self.global_count = 0
+
+    def __repr__(self):
+        return "".join(map(repr, self.functions.values()))
+
+
+class BytecodeCompiler(Visitor):
+    """
+    Type checks the tree like the Compiler and translates it to bytecode
+    for the VM, evaluating everything left to right. Every local gets a
+    slot in the array of its function's frame; locals of sibling blocks
+    share slots.
+    """
+    def __init__(self):
+        super().__init__()
+
+        self.error = 0
+
+        self.program = BytecodeProgram()
+        self.instrs = None
+        self.slot_count = 0
+        self.frame_size = 0
+
+    def compile(self, stmts):
+        """
+        stmts are the global statements: a tree, or any iterable of them.
+        """
+        context = GlobalContext()
+        for stmt in stmts:
+            self.visit(stmt, context)
+            if self.error:
+                return None
+        return self.program
+
+    def show_error(self, msg, node):
+        self.error = 1
+        err = Error(msg, node.pos_start, node.pos_end)
+        print(err.as_string())
+        return D_NULL
+
+    def emit(self, op, *operands):
+        self.instrs.append((op,) + operands)
+
+    def emit_char(self):
+        last = self.instrs[-1]
+        if type(last) is tuple and last[0] == B_CONST:
+            self.instrs[-1] = (B_CONST, wrap(last[1], D_CHAR))
+        else:
+            self.emit(B_CHAR)
+
+    def visit_FunctionDeclarationNode(self, node, context):
+        s = Symbol(node.name.value, A_FUNCTION, get_data_type(node.type.value))
+        context.add_symbol(s)
+
+        if node.stmts is None: # just a declaration
+            return D_NULL
+
+        new_context = FunctionContext(node.name.value, context)
+        self.instrs = []
+        self.slot_count = self.frame_size = 0
+
+        self.visit(node.stmts, new_context)
+        if self.error:
+            return D_NULL
+        self.emit(B_RET)
+
+        code = flatten(fuse(self.instrs))
+        self.program.functions[s.name] = BytecodeFunction(s.name, code, self.frame_size)
+        self.instrs = None
+        new_context.close_context()
+        return D_NULL
+
+    def visit_GlobalVarDeclarationNode(self, node, context):
+        s = Symbol(node.name.value, A_VARIABLE, get_data_type(node.type.value))
+        context.add_symbol(s)
+        s.slot = self.program.global_count
+        self.program.global_count += 1
+
+    def visit_LocalVarDeclarationNode(self, node, context):
+        s = Symbol(node.name.value, A_VARIABLE, get_data_type(node.type.value))
+        s.slot = self.slot_count
+        self.slot_count += 1
+        self.frame_size = max(self.frame_size, self.slot_count)
+        context.add_symbol(s)
+
+        if node.initial:
+            t = self.visit(node.initial, context)
+            if self.error:
+                return D_NULL
+            if not self.are_compatible(t, s.data_type):
+                return self.show_error("Types are not compatible ({} vs {})".format(v_names[s.data_type], v_names[t]), node)
+            self.store(s, t, keep=False)
+        return D_NULL
+
+    def visit_VarAssignNode(self, node, context, keep=True):
+        s = context.get_symbol(node.name.value.value)
+
+        if not s:
+            return self.show_error("Variable {} is not defined.".format(node.name.value.value), node)
+
+        t = self.visit(node.expr, context)
+        if self.error:
+            return D_NULL
+        if not self.are_compatible(t, s.data_type):
+            return self.show_error("Types are not compatible ({} vs {})".format(v_names[s.data_type], v_names[t]), node)
+
+        # the value of an assignment is the assigned value
+        self.store(s, t, keep)
+        return s.data_type
+
+    def store(self, s, t, keep):
+        if t == D_CHAR and s.data_type == D_INT:
+            self.emit_char()
+        if keep:
+            self.emit(B_DUP)
+        if s.data_type == D_CHAR:
+            self.emit_char()
+        self.emit(B_GSTORE if s.is_global else B_STORE, s.slot)
+
+    def visit_IntLitNode(self, node, context):
+        self.emit(B_CONST, node.value)
+        return D_INT
+
+    def visit_CharLitNode(self, node, context):
+        self.emit(B_CONST, node.value)
+        return D_CHAR
+
+    def visit_IdentifierNode(self, node, context):
+        s = context.get_symbol(node.value.value)
+
+        if not s:
+            return self.show_error("Variable {} is not defined.".format(node.value.value), node)
+
+        self.emit(B_GLOAD if s.is_global else B_LOAD, s.slot)
+        return s.data_type
+
+    # operations are emitted once their operands are, see visit_expression
+    def visit_UnaryOperationNode(self, node, context):
+        return self.visit_expression(node, context)
+
+    def visit_BinaryOperationNode(self, node, context):
+        return self.visit_expression(node, context)
+
+    def exit_UnaryOperationNode(self, node, context, t):
+        if node.sign == T_MINUS and t in (D_INT, D_CHAR):
+            self.emit(B_NEG)
+            return t
+
+        return self.show_error("Type {} does not support unary operations".format(v_names.get(t, t)), node)
+
+    def after_operand(self, node, name, t, context):
+        if name == "left_node" and t == D_CHAR and (node.sign in COMPARISON_OPCODES or node.sign == T_SLASH):
+            # chars compare and divide by their low bytes
+            self.emit_char()
+
+    def exit_BinaryOperationNode(self, node, context, t1, t2):
+        if not self.are_compatible(t1, t2):
+            return self.show_error("You can't execute a binary operation between {} and {}".format(v_names[t1], v_names[t2]), node)
+
+        if t1 not in (D_INT, D_CHAR):
+            return self.show_error("Type {} does not support binary operations".format(v_names[t1]), node)
+
+        # the right operand is converted to the type of the left one
+        if t2 == D_CHAR and (t1 == D_INT or node.sign == T_SLASH) or node.sign in COMPARISON_OPCODES and t1 == D_CHAR:
+            self.emit_char()
+
+        if node.sign in BINARY_OPCODES:
+            self.emit(BINARY_OPCODES[node.sign])
+        else:
+            self.emit(COMPARISON_OPCODES[node.sign])
+        return t1
+
+    def visit_PrintNode(self, node, context):
+        t = self.visit(node.expr, context)
+        if self.error:
+            return D_NULL
+
+        if t == D_INT:
+            self.emit(B_PRINT_INT)
+        elif t == D_CHAR:
+            self.emit(B_PRINT_CHAR)
+        else:
+            self.emit(B_POP)
+        return D_NULL
+
+    def visit_FunctionStatements(self, stmts, context):
+        for stmt in stmts:
+            self.visit_statement(stmt, context)
+            if self.error:
+                return
+
+    def visit_statement(self, stmt, context):
+        """
+        Visits a statement, leaving nothing on the stack.
+        """
+        if type(stmt).__name__ == "VarAssignNode":
+            self.visit_VarAssignNode(stmt, context, keep=False)
+        elif self.visit(stmt, context) in (D_INT, D_CHAR):
+            self.emit(B_POP)
+
+    def visit_IfNode(self, node, context):
+        else_label = BytecodeLabel()
+        end_label = BytecodeLabel()
+
+        t = self.visit(node.expr, context)
+        if self.error:
+            return D_NULL
+        if t == D_CHAR and not self.is_comparison(node.expr):
+            # chars are tested by their low byte
+            self.emit_char()
+        self.emit(B_JZ, else_label if node.else_stmts else end_label)
+
+        self.visit_block(node.if_stmts, context)
+        if self.error:
+            return D_NULL
+
+        if node.else_stmts:
+            self.emit(B_JMP, end_label)
+            self.instrs.append(else_label)
+            self.visit_block(node.else_stmts, context)
+            if self.error:
+                return D_NULL
+
+        self.instrs.append(end_label)
+        return D_NULL
+
+    def visit_block(self, stmts, context):
+        block_context = BlockContext(context)
+        slot_count = self.slot_count
+        self.visit_statement(stmts, block_context)
+        self.slot_count = slot_count
+        block_context.close_context()
+
+    @staticmethod
+    def is_comparison(node):
+        return type(node).__name__ == "BinaryOperationNode" and node.sign in COMPARISON_OPCODES
+
+    @staticmethod
+    def are_compatible(t1, t2):
+        return t1 == t2 or t1 in (D_INT, D_CHAR) and t2 in (D_INT, D_CHAR)
+
+    def generic_visit(self, node, context):
+        raise Exception("No visit method defined for {}".format(type(node).__name__))
@@ -1,22 +1,57 @@
 from gen import *
+from ir import *
 from tokentypes import *
 from sym import *
 from error import *
+from visitor import Visitor, EXPRESSION_OPERANDS
+from runtime import RUNTIMES
+from order import right_first
+
+BINARY_OPS = {
+    T_PLUS: I_ADD,
+    T_MINUS: I_SUB,
+    T_ASTERISK: I_MUL,
+    T_SLASH: I_DIV
+}
+
+COMPARISONS = (T_DEQ, T_NEQ, T_LT, T_LTE, T_GT, T_GTE)
+
+
+class Compiler(Visitor):
+    """
+    Type checks the tree and lowers it to three-address IR (ir.py), one
+    IRFunction per function. Global statements can be visited one at a
+    time: flush() has the CodeGenerator turn what was compiled since the
+    last flush into assembly and drops its IR.
+    """
+    def __init__(self, out, target=None, runtime=None, assembler=None):
+        super().__init__()
 
-
-class Compiler(object):
-    def __init__(self, outfn):
         self.error = 0
 
-        self.codegen = CodeGenerator(outfn)
-        self.codegen.generate_beginning()
+        self.codegen = CodeGenerator(out, target, RUNTIMES[runtime]() if runtime else None, assembler)
+        self.codegen.begin()
+        self.module = IRModule()
+        self.builder = None
+        self.frame_scope = None
+        # Sethi-Ullman labels of the expressions in the current function
+        self.labels = {}
+
+    def flush(self):
+        module = self.module
+        self.module = IRModule(module.label_count)
+        self.codegen.gen_module(module)
 
     def close_output_file(self):
-        self.codegen.close_file()
+        self.flush()
+        self.codegen.close()
+        return self.codegen
 
-    def visit(self, node, context):
-        func = getattr(self, "visit_{}".format(type(node).__name__), self.no_visit_method)
-        return func(node, context)
+    def show_error(self, msg, node):
+        self.error = 1
+        err = Error(msg, node.pos_start, node.pos_end)
+        print(err.as_string())
+        return None, D_NULL
 
     def visit_GlobalStatements(self, stmts, context):
         for stmt in stmts:
@@ -28,162 +63,230 @@ class Compiler(object):
         s = Symbol(node.name.value, A_FUNCTION, self.get_data_type(node.type.value))
         context.add_symbol(s)
 
+        if node.stmts is None: # just a declaration
+            return None, D_NULL
+
         new_context = FunctionContext(node.name.value, context)
 
-        self.codegen.gen_function_beginning(node.name.value)
+        function = IRFunction(node.name.value)
+        self.builder = IRBuilder(self.module, function)
+        self.frame_scope = function.frame
 
         for stmt in node.stmts:
             self.visit(stmt, new_context)
             if self.error:
-                return
+                return None, D_NULL
 
-        self.codegen.gen_function_end()
+        self.builder.emit_effect(I_RET)
+        self.module.functions.append(function)
+        self.builder = None
+        self.frame_scope = None
+        self.labels = {}
 
         context = new_context.close_context()
 
-        return NO_REG, D_NULL
+        return None, D_NULL
 
     def visit_GlobalVarDeclarationNode(self, node, context):
         s = Symbol(node.name.value, A_VARIABLE, self.get_data_type(node.type.value))
         context.add_symbol(s)
 
-        self.codegen.gen_decl_global_var(s.data_type, s.name)
+        self.module.globals.append((s.name, s.data_type))
     
     def visit_LocalVarDeclarationNode(self, node, context):
         s = Symbol(node.name.value, A_VARIABLE, self.get_data_type(node.type.value))
-
-        if context.add_symbol(s):
-            self.codegen.gen_align_stack()
+        s.local = Local(s.name, s.data_type) # data types have the value of their size
+        self.frame_scope.locals.append(s.local)
+        context.add_symbol(s)
         
         if node.initial:
             r, t = self.visit(node.initial, context)
+            if self.error:
+                return None, D_NULL
             if not self.are_compatible(t, s.data_type):
-                self.error = 1
-                err = Error("Types are not compatible ({} vs {})".format(v_names[s.data_type], v_names[t]), node.pos_start, node.pos_end)
-                print(err.as_string())
-                return NO_REG, D_NULL
-                
-            self.codegen.gen_assign_local_var(s.data_type, s.offset, r)
+                return self.show_error("Types are not compatible ({} vs {})".format(v_names[s.data_type], v_names[t]), node)
+
+            self.store(s, r, t)
+
+        return None, D_NULL
     
     def visit_VarAssignNode(self, node, context):
         s = context.get_symbol(node.name.value.value)
         
         if not s:
-            self.error = 1
-            err = Error("Variable {} is not defined.".format(s.name), node.pos_start, node.pos_end)
-            print(err.as_string())
-            return NO_REG, D_NULL
+            return self.show_error("Variable {} is not defined.".format(node.name.value.value), node)
 
         r, t = self.visit(node.expr, context)
+        if self.error:
+            return None, D_NULL
         if not self.are_compatible(t, s.data_type):
-            self.error = 1
-            err = Error("Types are not compatible ({} vs {})".format(v_names[s.data_type], v_names[t]), node.pos_start, node.pos_end)
-            print(err.as_string())
-            return NO_REG, D_NULL
+            return self.show_error("Types are not compatible ({} vs {})".format(v_names[s.data_type], v_names[t]), node)
 
-        if (s.is_global):
-            self.codegen.gen_assign_global_var(s.data_type, s.name, r)
-        else:
-            self.codegen.gen_assign_local_var(s.data_type, s.offset, r)
+        # the value of an assignment is the assigned value
+        return self.store(s, r, t), s.data_type
+
+    def store(self, s, r, t):
+        r = self.convert(r, t, s.data_type)
+        self.builder.emit_effect(I_STORE, (self.variable(s), r), s.data_type)
+        return r
+
+    @staticmethod
+    def variable(s):
+        if s.is_global:
+            return Global(s.name)
+        return s.local
+
+    def convert(self, r, from_type, to_type):
+        """
+        chars are widened when used as ints, ints narrowed to chars just
+        use their low byte
+        """
+        if from_type == D_CHAR and to_type == D_INT:
+            return self.builder.emit_value(I_SEXT, (r,), D_INT)
+        return r
         
     def visit_IntLitNode(self, node, context):
-        return self.codegen.load_int(node.value), D_INT
+        return self.builder.emit_value(I_CONST, (Imm(node.value),), D_INT), D_INT
     
     def visit_CharLitNode(self, node, context):
-        return self.codegen.load_char(node.value), D_CHAR
+        return self.builder.emit_value(I_CONST, (Imm(node.value),), D_CHAR), D_CHAR
 
     def visit_IdentifierNode(self, node, context):
         s = context.get_symbol(node.value.value)
         
         if not s:
-            self.error = 1
-            err = Error("Variable {} is not defined.".format(node.value.value), node.pos_start, node.pos_end)
-            print(err.as_string())
-            return NO_REG, D_NULL
-        
-        if s.is_global:
-            return self.codegen.gen_load_global_var(s.data_type, s.name), s.data_type
-        return self.codegen.gen_load_local_var(s.data_type, s.offset), s.data_type
+            return self.show_error("Variable {} is not defined.".format(node.value.value), node)
 
-    def visit_UnaryOperationNode(self, node, context):
-        if node.sign == T_MINUS:
-            r1 = self.codegen.load_int(0)
-            r2, t = self.visit(node.right_node, context)
+        return self.builder.emit_value(I_LOAD, (self.variable(s),), s.data_type), s.data_type
 
-            if (t == D_INT): # or other types that support '-'
-                return self.codegen.sub_int(r1, r2), t
-            elif (t == D_CHAR):
-                return self.codegen.sub_char(r1, r2), t
+    # operations are lowered once their operands are, see visit_expression
+    def visit_UnaryOperationNode(self, node, context):
+        return self.visit_expression(node, context)
 
     def visit_BinaryOperationNode(self, node, context):
-        r1, t1 = self.visit(node.left_node, context)
-        r2, t2 = self.visit(node.right_node, context)
-
+        return self.visit_expression(node, context)
+
+    def operand_order(self, node):
+        """
+        The operand needing more registers goes first when that can't
+        change the result.
+        """
+        if type(node).__name__ == "BinaryOperationNode" and right_first(node, self.labels):
+            return ("right_node", "left_node")
+        return EXPRESSION_OPERANDS[type(node).__name__]
+
+    def exit_UnaryOperationNode(self, node, context, right):
+        r, t = right
+        if node.sign == T_MINUS and t in (D_INT, D_CHAR): # or other types that support '-'
+            return self.builder.emit_value(I_NEG, (r,), t), t
+
+        return self.show_error("Type {} does not support unary operations".format(v_names.get(t, t)), node)
+
+    def exit_BinaryOperationNode(self, node, context, left, right):
+        r1, r2, t = self.check_operands(node, *left, *right)
+        if self.error:
+            return None, D_NULL
+
+        if node.sign == T_SLASH and t == D_CHAR:
+            # chars are kept unwrapped, idiv needs their real value
+            r1 = self.convert(r1, D_CHAR, D_INT)
+            r2 = self.convert(r2, right[1], D_INT)
+            return self.builder.emit_value(I_DIV, (r1, r2), D_INT), t
+        if node.sign in BINARY_OPS:
+            return self.builder.emit_value(BINARY_OPS[node.sign], (r1, r2), t), t
+        return self.builder.emit_value(I_CMP, (r1, r2), t, node.sign), t
+
+    def visit_operands(self, node, context):
+        """
+        Evaluates both operands of a binary operation, in operand_order().
+        """
+        results = {}
+        for name in self.operand_order(node):
+            results[name] = self.visit(getattr(node, name), context)
+            if self.error:
+                return None, None, D_NULL
+        return self.check_operands(node, *results["left_node"], *results["right_node"])
+
+    def check_operands(self, node, r1, t1, r2, t2):
+        """
+        The operands of a binary operation, the right one converted to the
+        type of the left one, which is also the type of the operation.
+        """
         if not (self.are_compatible(t1, t2)):
-            self.error = 1
-            err = Error("You can't execute a binary operation between {} and {}".format(v_names[t1], v_names[t2]), node.pos_start, node.pos_end)
-            print(err.as_string())
-            return NO_REG, D_NULL
-
-        if t1 == D_INT:
-            if node.sign == T_PLUS:
-                return self.codegen.add_int(r1, r2), t1
-            elif node.sign == T_MINUS:
-                return self.codegen.sub_int(r1, r2), t1
-            elif node.sign == T_ASTERISK:
-                return self.codegen.mul_int(r1, r2), t1
-            elif node.sign == T_SLASH:
-                return self.codegen.div_int(r1, r2), t1
-            elif node.sign in (T_DEQ, T_NEQ, T_LT, T_LTE, T_GT, T_GTE):
-                return self.codegen.cmp_int(r1, r2, node.sign), t1
-        elif t1 == D_CHAR:
-            if node.sign == T_PLUS:
-                return self.codegen.add_char(r1, r2), t1
-            elif node.sign == T_MINUS:
-                return self.codegen.sub_char(r1, r2), t1
-            elif node.sign == T_ASTERISK:
-                return self.codegen.mul_char(r1, r2), t1
-            elif node.sign == T_SLASH:
-                return self.codegen.div_char(r1, r2), t1
-            elif node.sign in (T_DEQ, T_NEQ, T_LT, T_LTE, T_GT, T_GTE):
-                return self.codegen.cmp_char(r1, r2, node.sign), t1
-        
-        self.error = 1
-        err = Error("Type {} does not support binary operations".format(v_names[t1]), node.pos_start, node.pos_end)
-        print(err.as_string())
-        return NO_REG, D_NULL
+            self.show_error("You can't execute a binary operation between {} and {}".format(v_names[t1], v_names[t2]), node)
+            return None, None, D_NULL
+
+        if t1 not in (D_INT, D_CHAR):
+            self.show_error("Type {} does not support binary operations".format(v_names[t1]), node)
+            return None, None, D_NULL
+
+        return r1, self.convert(r2, t2, t1), t1
 
     def visit_PrintNode(self, node, context):
-        r1, t = self.visit(node.expr, context)
+        r, t = self.visit(node.expr, context)
+        if self.error:
+            return None, D_NULL
         
-        if t == D_INT:
-            self.codegen.print_int(r1)
-        elif t == D_CHAR:
-            self.codegen.print_char(r1)
-        return NO_REG, None
+        if t in (D_INT, D_CHAR):
+            self.builder.emit_effect(I_PRINT, (r,), t)
+        return None, D_NULL
     
-    def visit_IfNode(self, node, context):
-        else_label_name = self.codegen.gen_next_label()
-        
-        if node.else_stmts:
-            end_label_name = self.codegen.gen_next_label()
-        else:
-            end_label_name = else_label_name
-
-        r, t = self.visit(node.expr, context)
+    def visit_FunctionStatements(self, stmts, context):
+        for stmt in stmts:
+            self.visit(stmt, context)
+            if self.error:
+                return
 
-        self.codegen.gen_jmp_if_false(r, t, else_label_name)
+    def visit_IfNode(self, node, context):
+        builder = self.builder
 
-        self.visit(node.if_stmts, context)
+        then_block = builder.new_block()
+        else_block = builder.new_block() if node.else_stmts else None
+        end_block = builder.new_block()
+        if not else_block:
+            else_block = end_block
 
-        self.codegen.gen_jmp_to_label(end_label_name)
+        self.visit_condition(node.expr, context, then_block, else_block)
+        if self.error:
+            return None, D_NULL
 
-        self.codegen.gen_label(else_label_name)
+        builder.set_block(then_block)
+        self.visit_block(node.if_stmts, context)
+        if self.error:
+            return None, D_NULL
+        builder.emit_effect(I_JMP, targets=(end_block,))
 
         if node.else_stmts:
-            self.visit(node.else_stmts, context)
-
-            self.codegen.gen_label(end_label_name)
+            builder.set_block(else_block)
+            self.visit_block(node.else_stmts, context)
+            if self.error:
+                return None, D_NULL
+            builder.emit_effect(I_JMP, targets=(end_block,))
+
+        builder.set_block(end_block)
+        return None, D_NULL
+
+    def visit_condition(self, expr, context, then_block, else_block):
+        """
+        Branches on expr. Comparisons branch on their flags directly
+        instead of materializing a 0/1 value first.
+        """
+        if type(expr).__name__ == "BinaryOperationNode" and expr.sign in COMPARISONS:
+            r1, r2, t = self.visit_operands(expr, context)
+            if not self.error:
+                self.builder.emit_branch(I_CBR, (r1, r2), t, (then_block, else_block), expr.sign)
+            return
+
+        r, t = self.visit(expr, context)
+        if not self.error:
+            self.builder.emit_branch(I_BR, (r,), t, (then_block, else_block))
+
+    def visit_block(self, stmts, context):
+        block_context = BlockContext(context)
+        self.frame_scope = FrameScope(self.frame_scope)
+        self.visit(stmts, block_context)
+        self.frame_scope = self.frame_scope.parent
+        block_context.close_context()
 
     @staticmethod
     def get_data_type_by_node(node):
@@ -195,12 +298,7 @@ class Compiler(object):
             return -1
         
     def get_data_type(self, n):
-        if n == 'int':
-            return D_INT
-        elif n == 'char':
-            return D_CHAR
-        else:
-            return -1
+        return get_data_type(n)
     
     @staticmethod
     def are_compatible(t1, t2):
@@ -211,5 +309,5 @@ class Compiler(object):
         
         return False
 
-    def no_visit_method(self, node, context):
+    def generic_visit(self, node, context):
         raise Exception("No visit method defined for {}".format(type(node).__name__))
@@ -0,0 +1,204 @@
+import os, struct
+
+from frame import align_up
+from x86 import AssemblerError
+
+# Writes the output of the x86.Assembler as ELF64 files: relocatable
+# objects for an external linker, and static executables that need no
+# linker at all.
+
+ET_REL, ET_EXEC = 1, 2
+EM_X86_64 = 62
+
+SHT_PROGBITS, SHT_SYMTAB, SHT_STRTAB, SHT_RELA, SHT_NOBITS = 1, 2, 3, 4, 8
+SHF_WRITE, SHF_ALLOC, SHF_EXECINSTR, SHF_INFO_LINK = 0x1, 0x2, 0x4, 0x40
+
+STB_LOCAL, STB_GLOBAL = 0, 1
+STT_NOTYPE, STT_SECTION = 0, 3
+
+PT_LOAD = 1
+PF_X, PF_W, PF_R = 1, 2, 4
+
+R_X86_64_PC32 = 2
+
+EHDR = struct.Struct("<16sHHIQQQIHHHHHH")
+PHDR = struct.Struct("<IIQQQQQQ")
+SHDR = struct.Struct("<IIQQQQIIQQ")
+SYM = struct.Struct("<IBBHQQ")
+RELA = struct.Struct("<QQq")
+
+# where static executables are loaded, like ld does
+BASE_ADDRESS = 0x400000
+PAGE_SIZE = 0x1000
+TEXT_ALIGNMENT = 16
+
+
+class StringTable(object):
+    def __init__(self):
+        self.data = bytearray(b"\0")
+        self.offsets = {"": 0}
+
+    def add(self, name):
+        if name not in self.offsets:
+            self.offsets[name] = len(self.data)
+            self.data += name.encode() + b"\0"
+        return self.offsets[name]
+
+
+class Section(object):
+    __slots__ = ("name", "type", "flags", "addr", "data", "size", "link", "info", "align", "entsize", "offset")
+
+    def __init__(self, name, type_, data=b"", flags=0, addr=0, size=None,
+                 link=0, info=0, align=1, entsize=0):
+        self.name = name
+        self.type = type_
+        self.flags = flags
+        self.addr = addr
+        self.data = data
+        self.size = len(data) if size is None else size
+        self.link = link
+        self.info = info
+        self.align = align
+        self.entsize = entsize
+        self.offset = 0
+
+
+class ElfFile(object):
+    """
+    An ELF64 file: the header, program headers, the contents of the
+    sections in the order they were added, and the section headers.
+    """
+    def __init__(self, type_, segment_count=0):
+        self.type = type_
+        self.entry = 0
+        self.segment_count = segment_count
+        self.segments = []
+        self.sections = [Section("", 0)]
+        self.names = StringTable()
+
+    def data_start(self):
+        return align_up(EHDR.size + PHDR.size * self.segment_count, TEXT_ALIGNMENT)
+
+    def add_section(self, name, type_, **fields):
+        self.sections.append(Section(name, type_, **fields))
+        return len(self.sections) - 1
+
+    def add_segment(self, flags, offset, addr, filesz, memsz):
+        self.segments.append(PHDR.pack(PT_LOAD, flags, offset, addr, addr, filesz, memsz, PAGE_SIZE))
+
+    def write(self, fn):
+        shstrndx = self.add_section(".shstrtab", SHT_STRTAB)
+        for section in self.sections:
+            self.names.add(section.name)
+        self.sections[shstrndx].data = self.names.data
+        self.sections[shstrndx].size = len(self.names.data)
+
+        out = bytearray(self.data_start())
+        for section in self.sections[1:]:
+            if section.type == SHT_NOBITS:
+                section.offset = len(out)
+                continue
+            out += bytes(align_up(len(out), section.align) - len(out))
+            section.offset = len(out)
+            out += section.data
+
+        out += bytes(align_up(len(out), 8) - len(out))
+        shoff = len(out)
+        for section in self.sections:
+            out += SHDR.pack(self.names.add(section.name), section.type, section.flags, section.addr,
+                             section.offset, section.size, section.link, section.info,
+                             section.align, section.entsize)
+
+        ident = b"\x7fELF" + bytes([2, 1, 1]) # 64 bit, little endian, version 1
+        out[:EHDR.size] = EHDR.pack(ident, self.type, EM_X86_64, 1, self.entry,
+                                    EHDR.size if self.segments else 0, shoff, 0, EHDR.size,
+                                    PHDR.size, len(self.segments), SHDR.size,
+                                    len(self.sections), shstrndx)
+        out[EHDR.size:EHDR.size + PHDR.size * len(self.segments)] = b"".join(self.segments)
+
+        with open(fn, "wb") as f:
+            f.write(out)
+
+
+def add_symbols(elf, code, sections, address):
+    """
+    Adds .symtab and .strtab with the section symbols and every label of
+    code, globals last like ELF requires. address(section, offset) is the
+    value of a symbol. Returns the symbol index of each section.
+    """
+    strings = StringTable()
+    entries = [SYM.pack(0, 0, 0, 0, 0, 0)]
+    section_symbols = {}
+    for name, index in sections.items():
+        section_symbols[name] = len(entries)
+        entries.append(SYM.pack(0, STB_LOCAL << 4 | STT_SECTION, 0, index, address(name, 0), 0))
+
+    globals_ = set(code.globals)
+    labels = sorted(code.symbols.items(), key=lambda item: item[0] in globals_)
+    first_global = len(entries) + sum(name not in globals_ for name in code.symbols)
+    for name, (section, offset) in labels:
+        bind = STB_GLOBAL if name in globals_ else STB_LOCAL
+        entries.append(SYM.pack(strings.add(name), bind << 4 | STT_NOTYPE, 0,
+                                sections[section], address(section, offset), 0))
+
+    symtab = len(elf.sections)
+    elf.add_section(".symtab", SHT_SYMTAB, data=b"".join(entries), link=symtab + 1,
+                    info=first_global, align=8, entsize=SYM.size)
+    elf.add_section(".strtab", SHT_STRTAB, data=strings.data)
+    return symtab, section_symbols
+
+
+def write_object(fn, code):
+    """
+    A relocatable object with .text and .bss, for linking with ld.
+    """
+    elf = ElfFile(ET_REL)
+    sections = {
+        ".text": elf.add_section(".text", SHT_PROGBITS, data=bytes(code.text),
+                                 flags=SHF_ALLOC | SHF_EXECINSTR, align=TEXT_ALIGNMENT),
+        ".bss": elf.add_section(".bss", SHT_NOBITS, size=code.bss_size,
+                                flags=SHF_ALLOC | SHF_WRITE, align=TEXT_ALIGNMENT)
+    }
+    symtab, section_symbols = add_symbols(elf, code, sections, lambda section, offset: offset)
+
+    relocations = []
+    for field, name, addend in code.relocations:
+        section, offset = code.symbols[name]
+        info = section_symbols[section] << 32 | R_X86_64_PC32
+        relocations.append(RELA.pack(field, info, offset + addend))
+    elf.add_section(".rela.text", SHT_RELA, data=b"".join(relocations), flags=SHF_INFO_LINK,
+                    link=symtab, info=sections[".text"], align=8, entsize=RELA.size)
+    elf.write(fn)
+
+
+def write_executable(fn, code, entry):
+    """
+    A static executable: .text in a read only segment with the headers
+    before it, .bss in a writable one after it.
+    """
+    elf = ElfFile(ET_EXEC, segment_count=2)
+    text_offset = elf.data_start()
+    text_addr = BASE_ADDRESS + text_offset
+    bss_addr = align_up(text_addr + len(code.text), PAGE_SIZE)
+    addresses = {".text": text_addr, ".bss": bss_addr}
+
+    def address(section, offset):
+        return addresses[section] + offset
+
+    text = code.link(addresses)
+
+    sections = {
+        ".text": elf.add_section(".text", SHT_PROGBITS, data=bytes(text), addr=text_addr,
+                                 flags=SHF_ALLOC | SHF_EXECINSTR, align=TEXT_ALIGNMENT),
+        ".bss": elf.add_section(".bss", SHT_NOBITS, size=code.bss_size, addr=bss_addr,
+                                flags=SHF_ALLOC | SHF_WRITE, align=TEXT_ALIGNMENT)
+    }
+    add_symbols(elf, code, sections, address)
+
+    if entry not in code.symbols:
+        raise AssemblerError("entry point {} is not defined".format(entry))
+    elf.entry = address(*code.symbols[entry])
+    elf.add_segment(PF_R | PF_X, 0, BASE_ADDRESS, text_offset + len(text), text_offset + len(text))
+    elf.add_segment(PF_R | PF_W, 0, bss_addr, 0, code.bss_size)
+    elf.write(fn)
+    os.chmod(fn, 0o755)
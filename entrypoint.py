@@ -1,42 +1,265 @@
-import sys, subprocess
+import os, sys, subprocess, argparse, tempfile
 from lexer import *
 from parser import Parser
+from nodetypes import GlobalStatements
 from compiler import Compiler
 from sym import *
+from arena import NodeArena
+from astcache import AstCache
+from fold import ConstantFolder
+from log import Log
+from runtime import RUNTIMES
+from target import TARGETS, JitTarget, host_target
+from x86 import Assembler, AssemblerError
+from elf import write_object, write_executable
+from jit import JitProgram, jit_supported
+from bytecode import BytecodeCompiler
+from vm import VM, VMError
+
+
+def add_compile_arguments(argparser):
+    argparser.add_argument("input", help="source file")
+    argparser.add_argument("--no-cache", action="store_true", help="always lex and parse, don't use the AST cache")
+    argparser.add_argument("--dump-ir", action="store_true", help="print the intermediate representation")
+    argparser.add_argument("--runtime", choices=sorted(RUNTIMES),
+                           help="print through printf, or buffer output and write it with syscalls "
+                                "(default: printf where there is a C library)")
+    argparser.add_argument("--peephole-stats", action="store_true", help="print how often each peephole rule fired")
+
+
+def parse_args(argv):
+    argparser = argparse.ArgumentParser(prog="oasis", epilog="oasis run INPUT compiles a program and runs it")
+    add_compile_arguments(argparser)
+    argparser.add_argument("output", help="executable to create")
+    argparser.add_argument("--target", choices=sorted(TARGETS), default=host_target(),
+                           help="operating system to build for (default: this one)")
+    argparser.add_argument("--assembler", choices=["builtin", "nasm"],
+                           help="encode machine code in process, or run nasm and ld "
+                                "(default: builtin for ELF64 targets)")
+    argparser.add_argument("--emit-asm", action="store_true",
+                           help="also write the assembly text to OUTPUT.asm (always done with nasm)")
+    argparser.add_argument("-c", "--object", action="store_true",
+                           help="write a relocatable object OUTPUT.o instead of an executable")
+    return argparser.parse_args(argv)
+
+
+def parse_run_args(argv):
+    argparser = argparse.ArgumentParser(prog="oasis run", description="compile a program and run it")
+    add_compile_arguments(argparser)
+    mode = argparser.add_mutually_exclusive_group()
+    mode.add_argument("--jit", action="store_true",
+                      help="load the machine code into this process and call it, without any files")
+    mode.add_argument("--vm", action="store_true",
+                      help="compile to bytecode and interpret it, without any native code")
+    return argparser.parse_args(argv)
+
+
+def build(commands):
+    for command in commands:
+        try:
+            result = subprocess.run(command, capture_output=True, text=True)
+        except FileNotFoundError:
+            Log.log_error("{} is not installed".format(command[0]))
+            return False
+        if result.returncode:
+            Log.log_error("{} failed:\n{}".format(command[0], result.stderr))
+            return False
+    return True
+
+
+def build_builtin(code, target, objfn, outfn, object_only):
+    try:
+        if object_only:
+            write_object(objfn, code)
+        else:
+            write_executable(outfn, code, target.entry)
+    except AssemblerError as e:
+        Log.log_error("assembler: {}".format(e))
+        return False
+    return True
+
+
+def check_runtime(target, runtime):
+    if runtime == "printf" and not target.has_libc:
+        Log.log_error("the {} target links without a C library, use --runtime buffered".format(target.name))
+        return False
+    return True
+
+
+class StatementStream(object):
+    """
+    The constant folded global statements of a source file, parsed while
+    they are iterated, so only one of them is a tree at a time. Iteration
+    stops at the first lexer or parser error and sets error. A file read
+    to the end goes into the AST cache, built up one statement at a time
+    in the compact arena form.
+    """
+    def __init__(self, inputfn, use_cache):
+        self.inputfn = inputfn
+        self.cache = AstCache() if use_cache else None
+        self.error = False
+
+    def __iter__(self):
+        source = SourceFile.open(self.inputfn, use_mmap=True)
+        arena = self.cache.load(source) if self.cache else None
+        stmts = arena.tree if arena is not None else self.parse(source)
+
+        folder = ConstantFolder()
+        scope = Scope(None)
+        for stmt in stmts:
+            yield folder.fold_statement(stmt, scope)
+        scope.close_context()
+
+    def parse(self, source):
+        # tokens are streamed straight from the mapped file into the parser
+        lexer = Lexer(self.inputfn, source=source)
+        parser = Parser(lexer.iter_tokens(), lexer)
+        arena = NodeArena(source) if self.cache else None
+        ids = []
+
+        for stmt in parser.iter_global_statements():
+            if lexer.error:
+                break
+            if arena is not None:
+                ids.append(arena.add_tree(stmt))
+            yield stmt
+
+        if lexer.error or parser.error:
+            self.error = True
+        elif arena is not None:
+            arena.root = arena.add_sequence(GlobalStatements, ids)
+            self.cache.store(source, arena)
+
+
+def compile_program(args, stmts, target, runtime, asmfn, assembler=None):
+    """
+    Compiles a StatementStream, generating the code of every statement
+    before the next one is parsed. Returns the finished CodeGenerator, or
+    None after an error. The assembly text is written to asmfn unless it
+    is None, the machine code goes into assembler unless it is None.
+    """
+    context = GlobalContext()
+
+    compiler = Compiler(asmfn, target, runtime, assembler)
+    try:
+        for stmt in stmts:
+            compiler.visit(stmt, context)
+            if compiler.error:
+                break
+            if args.dump_ir and (compiler.module.globals or compiler.module.functions):
+                print(compiler.module)
+            compiler.flush()
+
+        if compiler.error or stmts.error:
+            compiler.codegen.discard()
+            return None
+
+        codegen = compiler.close_output_file()
+    except AssemblerError as e:
+        compiler.codegen.discard()
+        Log.log_error("assembler: {}".format(e))
+        return None
+
+    if args.peephole_stats:
+        for name, hits in codegen.peephole.hits.items():
+            Log.log_info("peephole {}: {}".format(name, hits))
+    return codegen
+
 
 def main():
-    if len(sys.argv) < 3:
+    if sys.argv[1:2] == ["run"]:
+        run(parse_run_args(sys.argv[2:]))
+        return
+
+    args = parse_args(sys.argv[1:])
+
+    target = TARGETS[args.target]()
+    runtime = args.runtime or target.default_runtime
+    if not check_runtime(target, runtime):
+        return
+    assembler = args.assembler or target.default_assembler
+    if assembler == "builtin" and target.object_format != "elf64":
+        Log.log_error("the built-in assembler only writes ELF64, use --assembler nasm for {}".format(target.name))
         return
 
-    inputfn = sys.argv[1]
-    outfn = sys.argv[2]
+    outfn = args.output
     asmfn = outfn + '.asm'
     objfn = outfn + '.o'
 
-    lexer = Lexer(inputfn)
-    tokens = lexer.make_tokens()
-    if lexer.error:
+    stmts = StatementStream(args.input, not args.no_cache)
+    code = Assembler() if assembler == "builtin" else None
+    codegen = compile_program(args, stmts, target, runtime,
+                              asmfn if assembler == "nasm" or args.emit_asm else None, code)
+    if codegen is None:
         return
 
-    parser = Parser(tokens)
-    tree = parser.parse_file()
+    if code is not None:
+        build_builtin(code, target, objfn, outfn, args.object)
+    else:
+        commands = target.build_commands(asmfn, objfn, outfn)
+        build(commands[:1] if args.object else commands)
 
-    if parser.error:
+
+def run(args):
+    """
+    oasis run: builds an executable in a temporary directory and runs
+    it, with --jit runs the machine code inside this process, and with
+    --vm interprets bytecode.
+    """
+    if args.vm:
+        run_vm(args)
+        return
+    if args.jit and not jit_supported():
+        Log.log_error("--jit needs Linux on x86-64")
+        return
+    target = JitTarget() if args.jit else TARGETS[host_target()]()
+    runtime = args.runtime or target.default_runtime
+    if not check_runtime(target, runtime):
         return
-    print(tree)
 
-    #  nasm -f macho64 test.asm
-    #  ld -macosx_version_min 10.13 test.o -o test -lSystem
-    
-    context = GlobalContext()
+    stmts = StatementStream(args.input, not args.no_cache)
+
+    if args.jit:
+        code = Assembler()
+        if compile_program(args, stmts, target, runtime, None, code) is None:
+            return
+        program = JitProgram(code, target.entry)
+        program.run()
+        program.close()
+        return
+
+    with tempfile.TemporaryDirectory(prefix="oasis") as directory:
+        outfn = os.path.join(directory, "program")
+        asmfn = outfn + '.asm'
+        objfn = outfn + '.o'
+
+        assembler = target.default_assembler
+        code = Assembler() if assembler == "builtin" else None
+        codegen = compile_program(args, stmts, target, runtime,
+                                  asmfn if assembler == "nasm" else None, code)
+        if codegen is None:
+            return
+        if code is not None:
+            built = build_builtin(code, target, objfn, outfn, False)
+        else:
+            built = build(target.build_commands(asmfn, objfn, outfn))
 
-    compiler = Compiler(asmfn)
-    compiler.visit(tree, context)
+        if built:
+            result = subprocess.run([outfn])
+            if result.returncode:
+                Log.log_error("{} exited with {}".format(args.input, result.returncode))
 
-    if compiler.error:
+
+def run_vm(args):
+    stmts = StatementStream(args.input, not args.no_cache)
+    program = BytecodeCompiler().compile(stmts)
+    if program is None or stmts.error:
         return
-    
-    compiler.close_output_file()
-    
-    subprocess.Popen([f'nasm -f macho64 {asmfn}'], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    subprocess.Popen([f'ld -macosx_version_min 10.13 {objfn} -o {outfn} -lSystem'], shell=True, stderr=subprocess.PIPE)
+    if args.dump_ir:
+        print(program)
+
+    sys.stdout.flush()
+    try:
+        VM(program).run()
+    except VMError as e:
+        Log.log_error("{}: {}".format(args.input, e))
@@ -5,14 +5,11 @@ class Error:
         self.pos_end = pos_end
 
     def as_string(self):
+        source = self.pos_start.source
+        line, col = source.linecol(self.pos_start.idx)
+
         text = "Error: " + self.msg + "\n"
-        idx_beg = 0
-        lines = self.pos_start.filetext.split('\n')
-        for i in range(self.pos_start.line):
-            idx_beg += len(lines[i]) + 1
-        line = lines[self.pos_start.line]
-        line = line.replace('\t', ' ') # to align the arrows
-        text += "-> " + line + "\n"
-        text += "   " + (" " * (self.pos_start.idx - idx_beg)) + "^" * (self.pos_end.idx - self.pos_start.idx)
+        text += "-> " + source.line_text(line).replace('\t', ' ') + "\n" # replace tabs to align the arrows
+        text += "   " + (" " * col) + "^" * (self.pos_end.idx - self.pos_start.idx)
 
         return text
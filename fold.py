@@ -0,0 +1,215 @@
+from nodetypes import *
+from tokentypes import *
+from sym import *
+from visitor import Visitor, iter_children
+
+# value range of each data type, arithmetic wraps around like the machine does
+TYPE_BITS = {
+    D_INT: 32,
+    D_CHAR: 8
+}
+
+
+def wrap(value, data_type):
+    bits = TYPE_BITS[data_type]
+    half = 1 << (bits - 1)
+    return ((value + half) & ((1 << bits) - 1)) - half
+
+
+def div_trunc(a, b):
+    # idiv rounds towards zero, python's // rounds down
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+BINARY_OPERATIONS = {
+    T_PLUS: lambda a, b: a + b,
+    T_MINUS: lambda a, b: a - b,
+    T_ASTERISK: lambda a, b: a * b,
+    T_SLASH: div_trunc,
+    T_DEQ: lambda a, b: int(a == b),
+    T_NEQ: lambda a, b: int(a != b),
+    T_LT: lambda a, b: int(a < b),
+    T_LTE: lambda a, b: int(a <= b),
+    T_GT: lambda a, b: int(a > b),
+    T_GTE: lambda a, b: int(a >= b)
+}
+
+COMPARISONS = (T_DEQ, T_NEQ, T_LT, T_LTE, T_GT, T_GTE)
+
+LITERAL_NODES = {
+    IntLitNode: D_INT,
+    CharLitNode: D_CHAR
+}
+
+
+def make_literal(value, data_type, pos_start, pos_end):
+    if data_type == D_CHAR:
+        return CharLitNode(value, pos_start, pos_end)
+    return IntLitNode(value, pos_start, pos_end)
+
+
+def is_pure(node):
+    """
+    True when evaluating node has no side effects, i.e. it assigns nothing.
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if type(node).__name__ == "VarAssignNode":
+            return False
+        stack.extend(iter_children(node))
+    return True
+
+
+class ConstantFolder(Visitor):
+    """
+    Rewrites the tree before it reaches the Compiler: constant expressions
+    are evaluated with the wraparound of their data type and x + 0, x * 1,
+    x * 0 and friends are simplified away. Typing follows the Compiler, a
+    binary operation has the type of its left operand.
+
+    Every visit returns (node, data type); the result is a new tree of node
+    objects, so arena views can be folded too.
+    """
+    def __init__(self):
+        super().__init__()
+
+    def fold_statement(self, stmt, scope):
+        """
+        Folds one global statement, scope keeps the global symbols
+        declared by the ones before it.
+        """
+        node, _ = self.visit(stmt, scope)
+        return node
+
+    def visit_NoneType(self, node, scope):
+        return None, D_NULL
+
+    def visit_GlobalStatements(self, stmts, scope):
+        return GlobalStatements(self.visit(stmt, scope)[0] for stmt in stmts), D_NULL
+
+    def visit_FunctionStatements(self, stmts, scope):
+        return FunctionStatements(self.visit(stmt, scope)[0] for stmt in stmts), D_NULL
+
+    def visit_FunctionDeclarationNode(self, node, scope):
+        scope.bind(Symbol(node.name.value, A_FUNCTION, get_data_type(node.type.value)))
+
+        stmts = None
+        if node.stmts is not None:
+            function_scope = Scope(scope)
+            stmts, _ = self.visit(node.stmts, function_scope)
+            function_scope.close_context()
+
+        return FunctionDeclarationNode(node.type, node.name, node.args, stmts, node.pos_start, node.pos_end), D_NULL
+
+    def visit_GlobalVarDeclarationNode(self, node, scope):
+        scope.bind(Symbol(node.name.value, A_VARIABLE, get_data_type(node.type.value)))
+        return GlobalVarDeclarationNode(node.type, node.name, node.pos_start, node.pos_end), D_NULL
+
+    def visit_LocalVarDeclarationNode(self, node, scope):
+        # declared before the initializer is evaluated, same as in the Compiler
+        scope.bind(Symbol(node.name.value, A_VARIABLE, get_data_type(node.type.value)))
+
+        initial, _ = self.visit(node.initial, scope)
+        return LocalVarDeclarationNode(node.type, node.name, initial, node.pos_start, node.pos_end), D_NULL
+
+    def visit_PrintNode(self, node, scope):
+        expr, _ = self.visit(node.expr, scope)
+        return PrintNode(expr, node.pos_start, node.pos_end), D_NULL
+
+    def visit_IfNode(self, node, scope):
+        expr, _ = self.visit(node.expr, scope)
+        if_stmts = self.visit_block(node.if_stmts, scope)
+        else_stmts = self.visit_block(node.else_stmts, scope)
+        return IfNode(expr, if_stmts, else_stmts, node.pos_start, node.pos_end), D_NULL
+
+    def visit_block(self, stmts, scope):
+        block_scope = Scope(scope)
+        stmts, _ = self.visit(stmts, block_scope)
+        block_scope.close_context()
+        return stmts
+
+    # operations are folded once their operands are, see visit_expression
+    def visit_VarAssignNode(self, node, scope):
+        return self.visit_expression(node, scope)
+
+    def visit_UnaryOperationNode(self, node, scope):
+        return self.visit_expression(node, scope)
+
+    def visit_BinaryOperationNode(self, node, scope):
+        return self.visit_expression(node, scope)
+
+    def exit_VarAssignNode(self, node, scope, folded):
+        s = scope.get_symbol(node.name.value.value)
+        expr, _ = folded
+        name = IdentifierNode(node.name.value, node.name.pos_start, node.name.pos_end)
+        return VarAssignNode(name, expr, node.pos_start, node.pos_end), s.data_type if s else D_NULL
+
+    def visit_IntLitNode(self, node, scope):
+        return IntLitNode(node.value, node.pos_start, node.pos_end), D_INT
+
+    def visit_CharLitNode(self, node, scope):
+        return CharLitNode(node.value, node.pos_start, node.pos_end), D_CHAR
+
+    def visit_IdentifierNode(self, node, scope):
+        s = scope.get_symbol(node.value.value)
+        return IdentifierNode(node.value, node.pos_start, node.pos_end), s.data_type if s else D_NULL
+
+    def exit_UnaryOperationNode(self, node, scope, folded):
+        right, t = folded
+
+        if node.sign == T_MINUS:
+            if type(right) in LITERAL_NODES:
+                return make_literal(wrap(-right.value, t), t, node.pos_start, node.pos_end), t
+            # -(-x)
+            if type(right) is UnaryOperationNode and right.sign == T_MINUS:
+                return right.right_node, t
+
+        return UnaryOperationNode(node.sign, right, node.pos_start, node.pos_end), t
+
+    def exit_BinaryOperationNode(self, node, scope, left_folded, right_folded):
+        left, t1 = left_folded
+        right, t2 = right_folded
+        sign = node.sign
+
+        if t1 in TYPE_BITS and type(left) in LITERAL_NODES and type(right) in LITERAL_NODES:
+            a = wrap(left.value, t1)
+            b = wrap(right.value, t2)
+            if sign in COMPARISONS:
+                # the right operand is compared in the type of the left one, chars by their low bytes
+                b = wrap(b, t1)
+            # leave division by zero and the INT_MIN / -1 trap to run time
+            if sign != T_SLASH or (b != 0 and wrap(div_trunc(a, b), t1) == div_trunc(a, b)):
+                return make_literal(wrap(BINARY_OPERATIONS[sign](a, b), t1), t1, node.pos_start, node.pos_end), t1
+
+        simplified = self.simplify(sign, left, t1, right, t2, node)
+        if simplified is not None:
+            return simplified, t1
+
+        return BinaryOperationNode(left, sign, right, node.pos_start, node.pos_end), t1
+
+    def simplify(self, sign, left, t1, right, t2, node):
+        """
+        Algebraic identities with one literal operand. The operand that is
+        kept must already have the type of the result (t1).
+        """
+        lval = left.value if type(left) in LITERAL_NODES else None
+        rval = right.value if type(right) in LITERAL_NODES else None
+
+        if rval == 0 and sign in (T_PLUS, T_MINUS):
+            return left
+        if rval == 1 and sign in (T_ASTERISK, T_SLASH):
+            return left
+        if t2 == t1:
+            if lval == 0 and sign == T_PLUS:
+                return right
+            if lval == 1 and sign == T_ASTERISK:
+                return right
+            if lval == 0 and sign == T_MINUS:
+                return UnaryOperationNode(T_MINUS, right, node.pos_start, node.pos_end)
+        if sign == T_ASTERISK and t1 in TYPE_BITS:
+            if rval == 0 and is_pure(left) or lval == 0 and is_pure(right):
+                return make_literal(0, t1, node.pos_start, node.pos_end)
+
+        return None
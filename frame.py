@@ -0,0 +1,53 @@
+SLOT_SIZE = 4
+STACK_ALIGNMENT = 16
+
+
+def align_up(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+
+def layout_locals(frame):
+    """
+    Gives every Local in the FrameScope tree its offset and returns the
+    size of the locals area. Locals are placed largest first, so ints and
+    chars pack without padding, and every address is aligned to the size
+    of its variable. A nested scope starts where its parent's locals end;
+    sibling scopes start at the same place and share the space.
+    """
+    size = 0
+    stack = [(frame, 0)]
+    while stack:
+        scope, offset = stack.pop()
+        for local in sorted(scope.locals, key=lambda local: -local.size):
+            offset = align_up(offset + local.size, local.size)
+            local.offset = offset
+        size = max(size, offset)
+        for child in scope.children:
+            stack.append((child, offset))
+    return size
+
+
+class FrameLayout(object):
+    """
+    The stack frame of one function, from rbp down:
+
+        saved callee-saved registers    pushed in the prologue
+        locals                          layout_locals
+        spill slots                     SLOT_SIZE bytes each
+
+    The prologue allocates everything below the pushes with a single
+    sub rsp, alloc_size, which keeps rsp 16 byte aligned for calls.
+    """
+    def __init__(self, function, allocation):
+        self.saved_size = len(allocation.saved) * 8
+        self.locals_size = layout_locals(function.frame)
+        self.slots_base = self.saved_size + align_up(self.locals_size, SLOT_SIZE)
+
+        end = self.slots_base + allocation.slot_count * SLOT_SIZE
+        self.alloc_size = align_up(end, STACK_ALIGNMENT) - self.saved_size
+
+    def local_offset(self, local):
+        return self.saved_size + local.offset
+
+    def slot_offset(self, slot):
+        return self.slots_base + (slot + 1) * SLOT_SIZE
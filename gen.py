@@ -1,134 +1,365 @@
 from sym import D_CHAR, D_NULL, D_INT
 from tokentypes import *
+from ir import *
+
+from regalloc import LinearScanAllocator, SCRATCH
+from isel import InstructionSelector
+from asm import AsmInstr, Label, Directive, Reserve, AsmWriter
+from peephole import PeepholeOptimizer
+from frame import FrameLayout
+from runtime import PrintfRuntime, PRINTINT, PRINTCHAR
+from target import MacOSTarget
+from strength import log2_exact, signed_magic, LEA_MULTIPLIERS
+from fold import wrap
+
+# 32 and 8 bit names of every general purpose register
+DREG_NAMES = {
+    "rax": "eax", "rcx": "ecx", "rdx": "edx", "rbx": "ebx",
+    "rsi": "esi", "rdi": "edi",
+    "r8": "r8d", "r9": "r9d", "r10": "r10d", "r11": "r11d",
+    "r12": "r12d", "r13": "r13d", "r14": "r14d", "r15": "r15d"
+}
+
+BREG_NAMES = {
+    "rax": "al", "rcx": "cl", "rdx": "dl", "rbx": "bl",
+    "rsi": "sil", "rdi": "dil",
+    "r8": "r8b", "r9": "r9b", "r10": "r10b", "r11": "r11b",
+    "r12": "r12b", "r13": "r13b", "r14": "r14b", "r15": "r15b"
+}
+
+# spilled results are computed in the first scratch register, spilled
+# operands that have to be in a register are loaded into the second
+DST_SCRATCH, SRC_SCRATCH = SCRATCH
 
-NO_REG = -1
 
 class CodeGenerator(object):
-    reg_status = [0, 0, 0, 0, 0, 0, 0, 0]
-    reg_names = ["r8", "r9", "r10", "r11", "r12", "r13", "r14", "r15"]
-    breg_names = ["br8", "br9", "br10", "br11", "br12", "br13", "br14", "br15"]
-    dreg_names = ["r8d", "r9d", "r10d", "r11d", "r12d", "r13d", "r14d", "r15d"]
-
+    """
+    x86-64 NASM backend: turns an IRModule into assembly text. Virtual
+    registers are assigned by the LinearScanAllocator; spilled ones live
+    in stack slots of the FrameLayout, chars sign extended like in
+    registers.
+
+    .text is handed on one function at a time: peephole optimized, then
+    written to out (a file name or text file object, if any) and added
+    to assembler (an x86.Assembler, if any). .bss follows in close().
+    After begin(), gen_module() can be called for every piece of the
+    program as it is compiled.
+    """
     nasm_type_names = {
         D_INT: "dword",
         D_CHAR: "byte"
     }
 
-    def __init__(self, fn):
-        self.fn = fn
-        self.file_content = ""
-        self.bss_section = "section .bss\n"
-
-        self.last_label_num = 0
-
-    def close_file(self):
-        with open(self.fn, "w+") as f:
-            f.write(self.file_content + '\n' + self.bss_section)
-
-    def free_register(self, reg):
-        self.reg_status[reg] = 0
-    
-    def gen_next_label(self):
-        self.last_label_num += 1
-        return ".L" + str(self.last_label_num)
-
-    def alloc_register(self):
-        reg = NO_REG
-        for i in range(len(self.reg_status)):
-            if not self.reg_status[i]:
-                reg = i
-                self.reg_status[i] = 1
-                break
-
-        return reg
-
-    def get_reg(self, name, type_):
+    def __init__(self, out=None, target=None, runtime=None, assembler=None):
+        self.writer = AsmWriter(out) if out is not None else None
+        self.assembler = assembler
+        self.target = target or MacOSTarget()
+        self.runtime = runtime or PrintfRuntime()
+        self.text = []
+        self.bss = [Directive("section .bss")]
+
+        self.peephole = PeepholeOptimizer()
+        self.selector = InstructionSelector()
+        self.allocator = LinearScanAllocator()
+        self.function = None
+        self.allocation = None
+        self.frame = None
+
+        self.instr_handlers = {
+            I_CONST: self.gen_const,
+            I_LOAD: self.gen_load,
+            I_STORE: self.gen_store,
+            I_ADD: self.gen_arith,
+            I_SUB: self.gen_arith,
+            I_MUL: self.gen_arith,
+            I_DIV: self.gen_div,
+            I_NEG: self.gen_neg,
+            I_SEXT: self.gen_sext,
+            I_CMP: self.gen_cmp,
+            I_PRINT: self.gen_print,
+            I_JMP: self.gen_jmp,
+            I_BR: self.gen_br,
+            I_CBR: self.gen_cbr,
+            I_RET: self.gen_ret
+        }
+
+    def flush_text(self):
+        # the peephole rules never look past a ret, so optimizing one
+        # function at a time gives the same code as the whole module
+        items = self.peephole.optimize(self.text)
+        self.text = []
+        if self.writer:
+            self.writer.write(items)
+        if self.assembler:
+            self.assembler.add_items(items)
+
+    def begin(self):
+        self.generate_beginning()
+        self.flush_text()
+
+    def close(self):
+        self.flush_text()
+        if self.writer:
+            self.writer.write([Directive()])
+            self.writer.write(self.bss)
+            self.writer.close()
+        if self.assembler:
+            self.assembler.add_items(self.bss)
+            self.assembler.finish()
+
+    def discard(self):
+        """
+        Drops the output after an error, a half written file is removed.
+        """
+        if self.writer:
+            self.writer.discard()
+
+    @staticmethod
+    def reg_name(reg, type_=D_INT):
+        """
+        chars are kept sign extended in the full 32 bits, only stores,
+        compares and prints use the low byte.
+        """
         if type_ == D_CHAR:
-            return name + "b"
-        elif type_ == D_INT:
-            return name + "d"
+            return BREG_NAMES[reg]
+        return DREG_NAMES[reg]
+
+    def loc(self, vreg, type_=D_INT):
+        """
+        Where vreg lives: a register or its stack slot.
+        """
+        reg = self.allocation.regs.get(vreg)
+        if reg is not None:
+            return self.reg_name(reg, type_)
+        slot = self.allocation.slots[vreg]
+        return "{} [rbp - {}]".format(self.nasm_type_names[type_], self.frame.slot_offset(slot))
+
+    def reg(self, op, type_=D_INT):
+        """
+        The register holding op. Spilled vregs, immediates and variables
+        are loaded into a scratch register first.
+        """
+        reg = self.allocation.regs.get(op)
+        if reg is not None:
+            return self.reg_name(reg, type_)
+        if type(op) in (Local, Global) and type_ == D_CHAR:
+            self.emit("movsx", self.reg_name(SRC_SCRATCH), self.operand(op, D_CHAR))
+        else:
+            self.emit("mov", self.reg_name(SRC_SCRATCH), self.operand(op, D_INT))
+        return self.reg_name(SRC_SCRATCH, type_)
+
+    def in_reg(self, op):
+        return op in self.allocation.regs
+
+    def dst_reg(self, instr):
+        """
+        The register to compute the result of instr in, finish() stores it
+        if the result is spilled.
+        """
+        reg = self.allocation.regs.get(instr.dst)
+        return reg if reg is not None else DST_SCRATCH
+
+    def finish(self, instr):
+        if instr.dst not in self.allocation.regs:
+            self.emit("mov", self.loc(instr.dst), self.reg_name(DST_SCRATCH))
+
+    def operand(self, op, type_):
+        if type(op) is Local:
+            return f"{self.nasm_type_names[type_]} [rbp - {self.frame.local_offset(op)}]"
+        elif type(op) is Global:
+            return f"{self.nasm_type_names[type_]} [rel {self.target.symbol(op.name)}]"
+        elif type(op) is Imm:
+            return str(op.value)
+        return self.loc(op, type_)
+
+    def gen_module(self, module):
+        for name, type_ in module.globals:
+            self.gen_decl_global_var(type_, name)
+
+        for function in module.functions:
+            self.gen_function(function)
+            self.flush_text()
+
+    def gen_function(self, function):
+        self.function = function
+        self.selector.select(function)
+        self.allocation = self.allocator.allocate(function)
+        self.frame = FrameLayout(function, self.allocation)
+
+        self.gen_function_beginning(function.name)
+
+        for i, block in enumerate(function.blocks):
+            self.next_block = function.blocks[i + 1] if i + 1 < len(function.blocks) else None
+            if i:
+                self.gen_label(block.label)
+
+            for instr in block.instrs:
+                self.instr_handlers[instr.op](instr)
+
+    def gen_const(self, instr):
+        value = instr.args[0].value
+        if value == 0 and self.in_reg(instr.dst):
+            d = self.loc(instr.dst)
+            self.emit("xor", d, d)
+        else:
+            self.emit("mov", self.loc(instr.dst), value)
+
+    def gen_load(self, instr):
+        d = self.reg_name(self.dst_reg(instr))
+        if instr.type == D_CHAR:
+            self.emit("movsx", d, self.operand(instr.args[0], D_CHAR))
+        else:
+            self.emit("mov", d, self.operand(instr.args[0], D_INT))
+        self.finish(instr)
+
+    def gen_store(self, instr):
+        var, src = instr.args
+        src = self.operand(src, instr.type) if type(src) is Imm else self.reg(src, instr.type)
+        self.emit("mov", self.operand(var, instr.type), src)
+
+    nasm_arith_instructions = {
+        I_ADD: "add",
+        I_SUB: "sub",
+        I_MUL: "imul"
+    }
+
+    def gen_arith(self, instr):
+        a, b = instr.args
+        d = self.dst_reg(instr)
+        if instr.op in COMMUTATIVE and (type(a) is Imm or self.regs_of(b) == d):
+            a, b = b, a
+
+        if instr.op == I_MUL and type(b) is Imm and type(a) is not Imm:
+            self.gen_mul_const(d, a, b.value)
+        elif instr.op != I_MUL and self.in_reg(a) and self.regs_of(a) != d and self.lea_operand(instr.op, b):
+            # three operand add through the address unit
+            if type(b) is Imm:
+                value = b.value if instr.op == I_ADD else -b.value
+                address = "{} {} {}".format(self.regs_of(a), "-" if value < 0 else "+", abs(value))
+            else:
+                address = "{} + {}".format(self.regs_of(a), self.regs_of(b))
+            self.emit("lea", self.reg_name(d), "[{}]".format(address))
+        else:
+            self.gen_move(d, a)
+            self.emit(self.nasm_arith_instructions[instr.op], self.reg_name(d), self.operand(b, D_INT))
+        self.finish(instr)
+
+    def lea_operand(self, op, b):
+        if type(b) is Imm:
+            # -b has to fit the 32 bit displacement too
+            return -2 ** 31 < b.value < 2 ** 31
+        return op == I_ADD and self.in_reg(b)
+
+    def regs_of(self, op):
+        return self.allocation.regs.get(op)
+
+    def gen_mul_const(self, d, a, value):
+        """
+        d = a * value, with shifts or lea where they do instead of imul.
+        """
+        # only the low 32 bits of the multiplier matter
+        value = wrap(value, D_INT)
+        magnitude = abs(value)
+        k = log2_exact(magnitude)
+        if value == 0:
+            self.emit("xor", self.reg_name(d), self.reg_name(d))
+            return
+        elif magnitude == 1:
+            self.gen_move(d, a)
+        elif k is not None:
+            self.gen_move(d, a)
+            self.emit("shl", self.reg_name(d), k)
+        elif magnitude in LEA_MULTIPLIERS:
+            src = self.regs_of(a)
+            if src is None:
+                self.gen_move(d, a)
+                src = d
+            self.emit("lea", self.reg_name(d), "[{} + {} * {}]".format(src, src, magnitude - 1))
+        else:
+            self.emit("imul", self.reg_name(d), self.operand(a, D_INT), value)
+            return
+
+        if value < 0:
+            self.emit("neg", self.reg_name(d))
+
+    def gen_div(self, instr):
+        a, b = instr.args
+        # idiv only sees the low 32 bits of the divisor
+        if type(b) is Imm and wrap(b.value, D_INT) not in (0, -1):
+            d = self.dst_reg(instr)
+            self.gen_div_const(d, a, wrap(b.value, D_INT))
+            self.finish(instr)
+            return
+
+        # the allocator keeps everything live across a division out of eax and edx
+        self.emit("mov", "eax", self.operand(a, D_INT))
+        self.emit("cdq")
+        self.emit("idiv", self.reg(b) if type(b) is Imm else self.operand(b, D_INT))
+        self.emit("mov", self.loc(instr.dst), "eax")
+
+    def gen_div_const(self, d, a, value):
+        """
+        d = a / value rounded towards zero like idiv, without dividing.
+        Division by -1 and 0 is left to idiv, which traps where it should.
+        """
+        self.gen_move(d, a)
+        n = self.reg_name(d)
+        t = self.reg_name(SRC_SCRATCH)
+        k = log2_exact(abs(value))
+
+        if abs(value) == 1:
+            pass
+        elif k is not None:
+            # add 2 ** k - 1 to negative dividends, then shift
+            self.emit("mov", t, n)
+            self.emit("sar", t, "31")
+            self.emit("shr", t, 32 - k)
+            self.emit("add", n, t)
+            self.emit("sar", n, k)
+        else:
+            m, s = signed_magic(value)
+            self.emit("movsxd", SRC_SCRATCH, n)
+            self.emit("imul", SRC_SCRATCH, SRC_SCRATCH, m)
+            self.emit("sar", SRC_SCRATCH, "32")
+            if value > 0 and m < 0:
+                self.emit("add", t, n)
+            elif value < 0 and m > 0:
+                self.emit("sub", t, n)
+            if s:
+                self.emit("sar", t, s)
+            # add one to negative quotients
+            self.emit("mov", n, t)
+            self.emit("shr", n, "31")
+            self.emit("add", n, t)
+            return
+
+        if value < 0:
+            self.emit("neg", n)
+
+    def gen_neg(self, instr):
+        d = self.dst_reg(instr)
+        self.gen_move(d, instr.args[0])
+        self.emit("neg", self.reg_name(d))
+        self.finish(instr)
+
+    def gen_sext(self, instr):
+        a = instr.args[0]
+        if type(a) is Imm:
+            self.emit("mov", self.loc(instr.dst), a.value)
+            return
+        d = self.reg_name(self.dst_reg(instr))
+        self.emit("movsx", d, self.operand(a, D_CHAR))
+        self.finish(instr)
+
+    def gen_move(self, reg, src):
+        if self.regs_of(src) != reg:
+            self.emit("mov", self.reg_name(reg), self.operand(src, D_INT))
 
     def generate_beginning(self):
         self.write_line('section .text')
-        self.write_line('extern _printf, _malloc, _free')
-        self.write_line()
-        self.write_line('PRINTF_INT: db "%d", 10, 0')
-        self.write_line('PRINTF_CHAR: db "%c", 0')
-        self.write_line()
-        self.write_line('printint:')
-        self.write_line('\tpush\trbp')
-        self.write_line('\tmov\trbp, rsp')
-        self.write_line('\tsub\trsp, 16')
-        self.write_line('\tmov\t[rbp-4], edi')
-        self.write_line('\tmov\teax, [rbp-4]')
-        self.write_line('\tmov\tesi, eax')
-        self.write_line('\tmov\trdi, PRINTF_INT')
-        self.write_line('\tmov\teax, 0')
-        self.write_line('\tcall\t_printf')
-        self.write_line('\tmov\trsp, rbp')
-        self.write_line('\tpop\trbp')
-        self.write_line('\tret')
-        self.write_line()
-        self.write_line('printchar:')
-        self.write_line('\tpush\trbp')
-        self.write_line('\tmov\trbp, rsp')
-        self.write_line('\tsub\trsp, 16')
-        self.write_line('\tmov\t[rbp-1], dl')
-        self.write_line('\tmov\tax, [rbp-1]')
-        self.write_line('\tmov\tsi, ax')
-        self.write_line('\tmov\trdi, PRINTF_CHAR')
-        self.write_line('\tmov\teax, 0')
-        self.write_line('\tcall\t_printf')
-        self.write_line('\tmov\trsp, rbp')
-        self.write_line('\tpop\trbp')
-        self.write_line('\tret')
-        self.write_line()
-        self.write_line()
-
-    def load_int(self, val):
-        reg = self.alloc_register()
-
-        self.write_line("\tmov\t{}, {}".format(self.get_reg(self.reg_names[reg], D_INT), val))
-
-        return reg
-    
-    def load_char(self, val):
-        reg = self.alloc_register()
-
-        self.write_line("\tmov\t{}, {}".format(self.get_reg(self.reg_names[reg], D_CHAR), val))
-
-        return reg
-
-    def add_int(self, r1, r2):
-        self.write_line("\tadd\t{}, {}".format(self.get_reg(self.reg_names[r1], D_INT), self.get_reg(self.reg_names[r2], D_INT)))
-
-        self.free_register(r2)
+        self.runtime.gen(self)
+        self.target.gen_entry(self)
 
-        return r1
-
-    def sub_int(self, r1, r2):
-        self.write_line("\tsub\t{}, {}".format(self.get_reg(self.reg_names[r1], D_INT), self.get_reg(self.reg_names[r2], D_INT)))
-
-        self.free_register(r2)
-
-        return r1
-
-    def mul_int(self, r1, r2):
-        self.write_line("\tmul\t{}, {}".format(self.get_reg(self.reg_names[r1], D_INT), self.get_reg(self.reg_names[r2], D_INT)))
-
-        self.free_register(r2)
-
-        return r1
-
-    def div_int(self, r1, r2):
-        self.write_line("\tmov\teax, {}".format(self.get_reg(self.reg_names[r1], D_INT)))
-        self.write_line("\tidiv\t{}".format(self.get_reg(self.reg_names[r2], D_INT)))
-        self.write_line("\tmov\t{}, eax".format(self.get_reg(self.reg_names[r1], D_INT)))
-
-        self.free_register(r2)
-
-        return r1
-    
     nasm_set_instructions = {
         T_DEQ: "sete",
         T_NEQ: "setne",
@@ -138,6 +369,15 @@ class CodeGenerator(object):
         T_GTE: "setge"
     }
 
+    nasm_jmp_instructions = {
+        T_DEQ: "je",
+        T_NEQ: "jne",
+        T_LT: "jl",
+        T_LTE: "jle",
+        T_GT: "jg",
+        T_GTE: "jge"
+    }
+
     nasm_jmp_instructions_if = {
         T_DEQ: "jne",
         T_NEQ: "je",
@@ -147,125 +387,125 @@ class CodeGenerator(object):
         T_GTE: "jl"
     }
 
-    def cmp_int(self, r1, r2, op):
-        self.write_line("\tcmp\t{}, {}".format(self.get_reg(self.reg_names[r1], D_INT), self.get_reg(self.reg_names[r2], D_INT)))
-        self.write_line("\t{}\t{}".format(self.nasm_set_instructions[op], self.get_reg(self.reg_names[r1], D_CHAR)))
-
-        self.free_register(r2)
-        
-        return r1
-    
-    def cmp_char(self, r1, r2, op):
-        self.write_line("\tcmp\t{}, {}".format(self.get_reg(self.reg_names[r1], D_CHAR), self.get_reg(self.reg_names[r2], D_CHAR)))
-        self.write_line("\t{}\t{}".format(self.nasm_set_instructions[op], self.get_reg(self.reg_names[r1], D_CHAR)))
-
-        self.free_register(r2)
-        
-        return r1
-    
-    def gen_jmp_if_false(self, r, t, label):
-        self.write_line("\tcmp\t{}, {}".format(self.get_reg(self.reg_names[r], t), 0))
-        self.write_line("\tje\t{}".format(label))
-
-        self.free_register(r)
-
-    def add_char(self, r1, r2):
-        self.write_line("\tadd\t{}, {}".format(self.get_reg(self.reg_names[r1], D_CHAR), self.get_reg(self.reg_names[r2], D_CHAR)))
-
-        self.free_register(r2)
-
-        return r1
-
-    def sub_char(self, r1, r2):
-        self.write_line("\tsub\t{}, {}".format(self.get_reg(self.reg_names[r1], D_CHAR), self.get_reg(self.reg_names[r2], D_CHAR)))
-
-        self.free_register(r2)
-
-        return r1
-
-    def mul_char(self, r1, r2):
-        self.write_line("\tmul\t{}, {}".format(self.get_reg(self.reg_names[r1], D_CHAR), self.get_reg(self.reg_names[r2], D_CHAR)))
-
-        self.free_register(r2)
-
-        return r1
-
-    def div_char(self, r1, r2):
-        self.write_line("\tmov\tax, {}".format(self.get_reg(self.reg_names[r1], D_CHAR)))
-        self.write_line("\tidiv\t{}".format(self.get_reg(self.reg_names[r2], D_CHAR)))
-        self.write_line("\tmov\t{}, ax".format(self.get_reg(self.reg_names[r1], D_CHAR)))
-
-        self.free_register(r2)
+    def gen_cmp(self, instr):
+        cond = self.gen_compare(instr)
+        d = self.dst_reg(instr)
+        self.emit(self.nasm_set_instructions[cond], self.reg_name(d, D_CHAR))
+        self.emit("movzx", self.reg_name(d), self.reg_name(d, D_CHAR))
+        self.finish(instr)
+
+    # the condition that holds for b ? a when it holds for a ? b
+    reversed_conditions = {
+        T_DEQ: T_DEQ,
+        T_NEQ: T_NEQ,
+        T_LT: T_GT,
+        T_LTE: T_GTE,
+        T_GT: T_LT,
+        T_GTE: T_LTE
+    }
 
-        return r1
-
-    def print_int(self, r):
-        self.write_line("\tmov\tedi, {}".format(self.get_reg(self.reg_names[r], D_INT)))
-        self.write_line("\tcall printint")
-    
-    def print_char(self, r):
-        self.write_line("\tmov\tdl, {}".format(self.get_reg(self.reg_names[r], D_CHAR)))
-        self.write_line("\tcall printchar")
+    def gen_compare(self, instr):
+        """
+        Emits the cmp of instr and returns the condition to test, which is
+        reversed when the operands had to be swapped.
+        """
+        a, b = instr.args
+        cond = instr.cond
+        if type(a) is Imm or not self.in_reg(a) and self.in_reg(b):
+            a, b = b, a
+            cond = self.reversed_conditions[cond]
+
+        # at most one side of a cmp can be in memory, an immediate has to
+        # be the second one
+        if not self.in_reg(a) and (type(b) is not Imm or type(a) is Imm):
+            a = self.reg(a, instr.type)
+        else:
+            a = self.operand(a, instr.type)
+        self.emit("cmp", a, self.operand(b, instr.type))
+        return cond
+
+    def gen_print(self, instr):
+        r = instr.args[0]
+        if instr.type == D_INT:
+            self.emit("mov", "edi", self.operand(r, D_INT))
+            self.emit("call", PRINTINT)
+        else:
+            self.emit("mov", "dl", self.operand(r, D_CHAR))
+            self.emit("call", PRINTCHAR)
+
+    def gen_jmp(self, instr):
+        self.gen_jmp_to_label(instr.targets[0].label)
+
+    def gen_br(self, instr):
+        r = instr.args[0]
+        if r in self.allocation.regs:
+            self.emit("test", self.loc(r, instr.type), self.loc(r, instr.type))
+        else:
+            self.emit("cmp", self.loc(r, instr.type), "0")
+        self.gen_cond_jmp("jnz", "jz", instr.targets)
+
+    def gen_cbr(self, instr):
+        cond = self.gen_compare(instr)
+        self.gen_cond_jmp(self.nasm_jmp_instructions[cond], self.nasm_jmp_instructions_if[cond], instr.targets)
+
+    def gen_cond_jmp(self, jmp_if, jmp_if_not, targets):
+        """
+        Jumps to whichever target doesn't directly follow, using the
+        inverted condition when the then block falls through.
+        """
+        then_block, else_block = targets
+        if then_block is self.next_block:
+            self.emit(jmp_if_not, else_block.label)
+        elif else_block is self.next_block:
+            self.emit(jmp_if, then_block.label)
+        else:
+            self.emit(jmp_if_not, else_block.label)
+            self.gen_jmp_to_label(then_block.label)
+
+    def gen_ret(self, instr):
+        if self.function.name == "main":
+            self.runtime.gen_exit(self)
+        self.gen_function_end()
 
     def gen_function_beginning(self, func_name):
-        self.write_line("global _{}".format(func_name))
-        self.write_line("_{}:".format(func_name))
-        self.write_line("\tpush\trbp")
-        self.write_line("\tmov\trbp, rsp")
+        self.write_line("global {}".format(self.target.symbol(func_name)))
+        self.gen_label(self.target.symbol(func_name))
+        self.emit("push", "rbp")
+        self.emit("mov", "rbp", "rsp")
+        for reg in self.allocation.saved:
+            self.emit("push", reg)
+        if self.frame.alloc_size:
+            self.emit("sub", "rsp", self.frame.alloc_size)
 
     def gen_function_end(self):
-        self.write_line("\tmov\trsp, rbp")
-        self.write_line("\tpop\trbp")
-        self.write_line("\tret")
+        if self.allocation.saved:
+            self.emit("lea", "rsp", "[rbp - {}]".format(self.frame.saved_size))
+            for reg in reversed(self.allocation.saved):
+                self.emit("pop", reg)
+        else:
+            self.emit("mov", "rsp", "rbp")
+        self.emit("pop", "rbp")
+        self.emit("ret")
 
     def gen_decl_global_var(self, type_, name):
-        self.write_line_bss(f"global _{name}")
-        self.write_line_bss(f"_{name}:")
-
-        self.write_line_bss(f"\tresb\t{type_}") # type_ has the value of its size
-    
-    def gen_load_global_var(self, type_, name):
-        r = self.alloc_register()
-        r_addr = self.alloc_register()
-        
-        self.write_line(f"\tmov\t{self.reg_names[r_addr]}, _{name}")
-        self.write_line(f"\tmov\t{self.get_reg(self.reg_names[r], type_)}, {self.nasm_type_names[type_]} [{self.reg_names[r_addr]}]")
-        
-        self.free_register(r_addr)
-
-        return r
-
-    def gen_load_local_var(self, type_, offset):
-        r = self.alloc_register()
-
-        self.write_line(f"\tmov\t{self.get_reg(self.reg_names[r], type_)}, {self.nasm_type_names[type_]} [rbp - {offset}]")
-
-        return r
-    
-    def gen_assign_global_var(self, type_, name, r):
-        r_addr = self.alloc_register()
-
-        self.write_line(f"\tmov\t{self.reg_names[r_addr]}, _{name}")
-        self.write_line(f"\tmov\t{self.nasm_type_names[type_]} [{self.reg_names[r_addr]}], {self.get_reg(self.reg_names[r], type_)}")
-
-        self.free_register(r)
-    
-    def gen_assign_local_var(self, type_, offset, r):
-        self.write_line(f"\tmov\t{self.nasm_type_names[type_]} [rbp - {offset}], {self.get_reg(self.reg_names[r], type_)}")
-
-        self.free_register(r)
-        
-    def gen_align_stack(self):
-        self.write_line("\tsub\trsp, 16")
+        self.write_line_bss(f"global {self.target.symbol(name)}")
+        self.reserve(self.target.symbol(name), type_) # type_ has the value of its size
 
     def gen_label(self, name):
-        self.write_line(name + ":")
+        self.text.append(Label(name))
     
     def gen_jmp_to_label(self, name):
-        self.write_line("\tjmp\t{}".format(name))
+        self.emit("jmp", name)
+
+    def emit(self, op, *operands):
+        self.text.append(AsmInstr(op, *operands))
 
     def write_line(self, ln=""):
-        self.file_content += ln + "\n"
+        self.text.append(Directive(ln))
     
     def write_line_bss(self, ln=""):
-        self.bss_section += ln + "\n"
+        self.bss.append(Directive(ln))
+
+    def reserve(self, name, size):
+        self.bss.append(Label(name))
+        self.bss.append(Reserve(size))
@@ -0,0 +1,207 @@
+from sym import D_NULL, D_CHAR, D_INT, v_names
+
+# Three-address instructions. Every instruction has an opcode, at most one
+# destination virtual register, a tuple of operands and the data type the
+# operation works on. Terminators end a basic block and name its successors.
+I_CONST = "const" # dst = imm
+I_LOAD = "load" # dst = var
+I_STORE = "store" # var = a
+I_ADD = "add" # dst = a + b
+I_SUB = "sub" # dst = a - b
+I_MUL = "mul" # dst = a * b
+I_DIV = "div" # dst = a / b
+I_NEG = "neg" # dst = -a
+I_SEXT = "sext" # dst = a, sign extended from char to int
+I_CMP = "cmp" # dst = a <cond> b
+I_PRINT = "print" # print a
+
+I_JMP = "jmp" # goto targets[0]
+I_BR = "br" # if a goto targets[0] else targets[1]
+I_CBR = "cbr" # if a <cond> b goto targets[0] else targets[1]
+I_RET = "ret"
+
+TERMINATORS = {I_JMP, I_BR, I_CBR, I_RET}
+COMMUTATIVE = {I_ADD, I_MUL}
+
+
+class VReg(object):
+    """
+    A virtual register, defined once and used any number of times.
+    """
+    __slots__ = ("n",)
+
+    def __init__(self, n):
+        self.n = n
+
+    def __repr__(self):
+        return "%{}".format(self.n)
+
+
+class Imm(object):
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return str(self.value)
+
+
+class Local(object):
+    """
+    A local variable of size bytes. The frame layout places it offset
+    bytes below the locals area.
+    """
+    __slots__ = ("name", "size", "offset")
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.offset = None
+
+    def __repr__(self):
+        if self.offset is None:
+            return "[{}]".format(self.name)
+        return "[{}@{}]".format(self.name, self.offset)
+
+
+class FrameScope(object):
+    """
+    The locals declared directly in a function body or block, and the
+    scopes of the blocks nested in it. Sibling scopes are never live at
+    the same time, so their locals can share stack space.
+    """
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.locals = []
+        self.children = []
+        if parent:
+            parent.children.append(self)
+
+
+class Global(object):
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return "[{}]".format(self.name)
+
+
+class Instr(object):
+    __slots__ = ("op", "dst", "args", "type", "cond", "targets")
+
+    def __init__(self, op, dst, args, type_, cond=None, targets=()):
+        self.op = op
+        self.dst = dst
+        self.args = args
+        self.type = type_
+        self.cond = cond
+        self.targets = targets
+
+    def uses(self):
+        return [a for a in self.args if type(a) is VReg]
+
+    def __repr__(self):
+        text = self.op
+        if self.cond:
+            text += "." + self.cond.lower()
+        if self.type in v_names:
+            text += "." + v_names[self.type]
+        if self.dst is not None:
+            text = "{} = {}".format(self.dst, text)
+        if self.args:
+            text += " " + ", ".join(map(repr, self.args))
+        if self.targets:
+            text += " -> " + ", ".join(b.label for b in self.targets)
+        return text
+
+
+class BasicBlock(object):
+    def __init__(self, label):
+        self.label = label
+        self.instrs = []
+
+    @property
+    def terminator(self):
+        if self.instrs and self.instrs[-1].op in TERMINATORS:
+            return self.instrs[-1]
+        return None
+
+    @property
+    def succs(self):
+        term = self.terminator
+        return list(term.targets) if term else []
+
+    def __repr__(self):
+        return self.label + ":\n" + "".join("\t{}\n".format(i) for i in self.instrs)
+
+
+class IRFunction(object):
+    def __init__(self, name):
+        self.name = name
+        self.blocks = []
+        self.frame = FrameScope()
+
+        self.vreg_count = 0
+
+    def new_vreg(self):
+        self.vreg_count += 1
+        return VReg(self.vreg_count)
+
+    def __repr__(self):
+        return "function {}:\n".format(self.name) + "".join(map(repr, self.blocks))
+
+
+class IRModule(object):
+    def __init__(self, label_count=0):
+        self.functions = []
+        # (name, data type) of every global variable
+        self.globals = []
+
+        # labels stay unique when a program is compiled in several modules
+        self.label_count = label_count
+
+    def new_label(self):
+        self.label_count += 1
+        return ".L{}".format(self.label_count)
+
+    def __repr__(self):
+        lines = ["global {} {}".format(v_names.get(t, t), name) for name, t in self.globals]
+        return "\n".join(lines + list(map(repr, self.functions)))
+
+
+class IRBuilder(object):
+    """
+    Appends instructions to the current block of a function. Blocks are
+    laid out in the order they are started, so the layout follows the
+    source even though branch targets are created before their code.
+    """
+    def __init__(self, module, function):
+        self.module = module
+        self.function = function
+        self.block = None
+
+        self.set_block(self.new_block())
+
+    def new_block(self):
+        return BasicBlock(self.module.new_label())
+
+    def set_block(self, block):
+        self.function.blocks.append(block)
+        self.block = block
+
+    def emit_value(self, op, args, type_, cond=None):
+        """
+        Appends an instruction producing a value, returns its new vreg.
+        """
+        dst = self.function.new_vreg()
+        self.block.instrs.append(Instr(op, dst, tuple(args), type_, cond))
+        return dst
+
+    def emit_effect(self, op, args=(), type_=D_NULL, targets=()):
+        self.block.instrs.append(Instr(op, None, tuple(args), type_, targets=tuple(targets)))
+
+    def emit_branch(self, op, args, type_, targets, cond=None):
+        self.block.instrs.append(Instr(op, None, tuple(args), type_, cond, tuple(targets)))
@@ -0,0 +1,86 @@
+from ir import *
+
+# what each operand of an instruction may be instead of a register
+IMM = 1
+MEM = 2
+
+OPERAND_FORMS = {
+    I_STORE: (0, IMM),
+    I_ADD: (IMM | MEM, IMM | MEM),
+    I_SUB: (IMM | MEM, IMM | MEM),
+    I_MUL: (IMM | MEM, IMM | MEM),
+    I_DIV: (IMM | MEM, IMM | MEM),
+    I_NEG: (IMM | MEM,),
+    I_SEXT: (IMM | MEM,),
+    I_CMP: (IMM | MEM, IMM | MEM),
+    I_CBR: (IMM | MEM, IMM | MEM),
+    I_PRINT: (IMM | MEM,)
+}
+
+# arithmetic always works on the full 32 bits, a char variable can't be
+# read from memory there
+INT_OPERANDS = {I_ADD, I_SUB, I_MUL, I_DIV, I_NEG}
+
+
+class InstructionSelector(object):
+    """
+    Maximal munch over the IR of a function, run right before register
+    allocation. A const or load whose only use follows in the same block is
+    merged into that use as an immediate or a memory operand, as far as
+    OPERAND_FORMS allows, and disappears together with its vreg. Loads are
+    not moved past a store.
+
+    The CodeGenerator picks the final instruction forms (lea, xor, three
+    operand imul, swapped cmp) from the operands left.
+    """
+    def select(self, function):
+        use_counts = {}
+        for block in function.blocks:
+            for instr in block.instrs:
+                for v in instr.uses():
+                    use_counts[v] = use_counts.get(v, 0) + 1
+
+        for block in function.blocks:
+            self.select_block(block, use_counts)
+
+    def select_block(self, block, use_counts):
+        defs = {}
+        merged = set()
+        last_store = -1
+
+        for i, instr in enumerate(block.instrs):
+            forms = OPERAND_FORMS.get(instr.op)
+            if forms:
+                args = list(instr.args)
+                for n, arg in enumerate(args):
+                    if type(arg) is not VReg or use_counts.get(arg) != 1 or arg not in defs:
+                        continue
+                    at, definition = defs[arg]
+                    if definition.op == I_CONST and forms[n] & IMM:
+                        args[n] = definition.args[0]
+                    elif definition.op == I_LOAD and forms[n] & MEM and at > last_store \
+                            and definition.type == self.read_type(instr):
+                        args[n] = definition.args[0]
+                    else:
+                        continue
+                    merged.add(definition)
+                instr.args = tuple(args)
+
+            if instr.dst is not None:
+                defs[instr.dst] = (i, instr)
+            if instr.op == I_STORE:
+                last_store = i
+
+        if merged:
+            block.instrs = [instr for instr in block.instrs if instr not in merged]
+
+    @staticmethod
+    def read_type(instr):
+        """
+        The type instr reads its operands as.
+        """
+        if instr.op == I_SEXT:
+            return D_CHAR
+        if instr.op in INT_OPERANDS:
+            return D_INT
+        return instr.type
@@ -0,0 +1,51 @@
+import ctypes, mmap, os, platform, sys
+
+from frame import align_up
+
+PROT_READ, PROT_WRITE, PROT_EXEC = mmap.PROT_READ, mmap.PROT_WRITE, mmap.PROT_EXEC
+
+
+def jit_supported():
+    return sys.platform.startswith("linux") and platform.machine() in ("x86_64", "AMD64")
+
+
+class JitProgram(object):
+    """
+    An assembled program (x86.Assembler) mapped into this process, .text
+    read and execute only with .bss behind it. run() calls the entry, so
+    a fault in the program, like a division by zero, ends the process
+    just like it would end the executable.
+    """
+    libc = None
+
+    def __init__(self, code, entry):
+        if JitProgram.libc is None:
+            JitProgram.libc = ctypes.CDLL(None, use_errno=True)
+            JitProgram.libc.mprotect.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int)
+
+        text_size = align_up(len(code.text), mmap.PAGESIZE)
+        size = text_size + align_up(code.bss_size, mmap.PAGESIZE)
+        self.memory = mmap.mmap(-1, size, prot=PROT_READ | PROT_WRITE)
+
+        view = ctypes.c_char.from_buffer(self.memory)
+        base = ctypes.addressof(view)
+        del view # the mapping can't be closed while it is exported
+
+        text = code.link({".text": base, ".bss": base + text_size})
+        self.memory[:len(text)] = text
+        if JitProgram.libc.mprotect(base, text_size, PROT_READ | PROT_EXEC):
+            errno = ctypes.get_errno()
+            self.memory.close()
+            raise OSError(errno, "mprotect: " + os.strerror(errno))
+
+        _, offset = code.symbols[entry]
+        self.function = ctypes.CFUNCTYPE(None)(base + offset)
+
+    def run(self):
+        # the program writes to fd 1 itself
+        sys.stdout.flush()
+        self.function()
+
+    def close(self):
+        self.function = None
+        self.memory.close()
@@ -1,217 +1,116 @@
+import re
+
 from tokentypes import *
 from error import Error
-from string import ascii_letters
-
-DIGITS = "01231456789"
-LETTERS = ascii_letters
-
-
-class Position(object):
-    def __init__(self, col, idx, line, filename, filetext):
-        self.col = col
-        self.idx = idx
-        self.line = line
-        self.filename = filename
-        self.filetext = filetext
-    
-    def advance(self, current_char):
-        self.idx += 1
-        self.col += 1
-        if current_char == '\n':
-            self.line += 1
-            self.col = 0
-    
-    def copy(self):
-        return Position(self.col, self.idx, self.line, self.filename, self.filetext)
+from source import SourceFile, Position
+
+# Single-pass scanner: one alternation, tried at each offset. Order matters,
+# two-character operators have to come before their one-character prefixes.
+TOKEN_REGEX = re.compile(r"""
+    (?P<ws>[ \t\n]+)
+  | (?P<ident>[A-Za-z_]+)
+  | (?P<num>[0-9]+)
+  | (?P<op>==|!=|<=|>=|[-+*/(){}=<>;])
+  | (?P<char>'(?:.'?)?)
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+# same scanner for memory mapped files, which only support bytes patterns
+BYTES_TOKEN_REGEX = re.compile(TOKEN_REGEX.pattern.encode(), re.VERBOSE | re.DOTALL)
+
+OPERATORS = {
+    "+": T_PLUS,
+    "-": T_MINUS,
+    "*": T_ASTERISK,
+    "/": T_SLASH,
+    "(": T_LPAREN,
+    ")": T_RPAREN,
+    "{": T_LCURLY,
+    "}": T_RCURLY,
+    "=": T_EQ,
+    "==": T_DEQ,
+    "!=": T_NEQ,
+    "<": T_LT,
+    "<=": T_LTE,
+    ">": T_GT,
+    ">=": T_GTE,
+    ";": T_SEMICOLON,
+}
+
+IDENTIFIER_TYPES = dict.fromkeys(keywords, T_KEYWORD)
+IDENTIFIER_TYPES.update(dict.fromkeys(types, T_TYPE))
 
 
 class Lexer:
-    def __init__(self, filename):
+    def __init__(self, filename, use_mmap=False, source=None):
         self.filename = filename
-        with open(filename, 'r') as f:
-            self.filetext = f.read()
-        
-        self.position = Position(-1, -1, 0, self.filename, self.filetext)
-        self.current_char = None
-        self.putback = None
+        self.source = source or SourceFile.open(filename, use_mmap)
+        self.filetext = self.source.text
 
         self.error: bool = False
 
-        self.advance()
-    
-    def advance(self):
-        if self.putback:
-            c = self.putback
-            self.putback = None
-            return c
-        self.position.advance(self.current_char)
-        self.current_char = self.filetext[self.position.idx] if self.position.idx < len(self.filetext) else None
-    
     def make_tokens(self):
-        tokens = []
-        
-        while self.current_char:
-            if self.current_char in ' \t\n':
-                self.advance()
+        return list(self.iter_tokens())
+
+    def make_token_buffer(self):
+        """
+        Lexes the whole file into a compact TokenBuffer.
+        """
+        buf = TokenBuffer(self.source)
+        append = buf.append
+        for tok in self.scan():
+            append(*tok)
+        return buf
+
+    def iter_tokens(self):
+        """
+        Yields the tokens of the file one at a time, ending with T_EOF,
+        which comes early when the file has an error.
+        Nothing but the current match is kept alive, so the parser can
+        consume the file without a full token list ever existing.
+        """
+        source = self.source
+        for _type, value, start, end in self.scan():
+            yield Token(_type, value, start, end, source)
+
+    def scan(self):
+        """
+        The scanner itself, yields (type, value, start, end) tuples.
+        """
+        text = self.filetext
+        is_str = isinstance(text, str)
+        regex = TOKEN_REGEX if is_str else BYTES_TOKEN_REGEX
+
+        # every character is matched by some alternative, so the matches
+        # returned by finditer cover the whole file back to back
+        for m in regex.finditer(text):
+            kind = m.lastgroup
+            if kind == "ws":
                 continue
-            elif self.current_char in DIGITS:
-                tokens.append(self.make_number())
-            elif self.current_char in LETTERS + '_':
-                tokens.append(self.make_identifier())
-            elif self.current_char == '\'':
-                tokens.append(self.make_char())
-            elif self.current_char == '+':
-                tokens.append(Token(T_PLUS, None, self.position.copy()))
-            elif self.current_char == '-':
-                tokens.append(Token(T_MINUS, None, self.position.copy()))
-            elif self.current_char == '*':
-                tokens.append(Token(T_ASTERISK, None, self.position.copy()))
-            elif self.current_char == '/':
-                tokens.append(Token(T_SLASH, None, self.position.copy()))
-            elif self.current_char == '(':
-                tokens.append(Token(T_LPAREN, None, self.position.copy()))
-            elif self.current_char == ')':
-                tokens.append(Token(T_RPAREN, None, self.position.copy()))
-            elif self.current_char == '{':
-                tokens.append(Token(T_LCURLY, None, self.position.copy()))
-            elif self.current_char == '}':
-                tokens.append(Token(T_RCURLY, None, self.position.copy()))
-            elif self.current_char == '=':
-                tokens.append(self.make_eq())
-            elif self.current_char == '!':
-                tokens.append(self.make_neq())
-            elif self.current_char == '<':
-                tokens.append(self.make_lt())
-            elif self.current_char == '>':
-                tokens.append(self.make_gt())
-            elif self.current_char == ';':
-                tokens.append(Token(T_SEMICOLON, None, self.position.copy()))
+
+            idx, end = m.span()
+            if kind == "ident":
+                ident = m.group() if is_str else m.group().decode()
+                yield IDENTIFIER_TYPES.get(ident, T_IDENTIFIER), ident, idx, end
+            elif kind == "op":
+                yield OPERATORS[m.group() if is_str else m.group().decode()], None, idx, end
+            elif kind == "num":
+                yield T_INTLIT, int(m.group()), idx, end
+            elif kind == "char":
+                if end - idx != 3:
+                    self.show_error("You forgot an apostroph :))", end)
+                    break
+                else:
+                    char = m.group()[1]
+                    yield T_CHARLIT, ord(char) if is_str else char, idx, end
             else:
-                self.show_error("You forgot an apostroph :))")
-            
-            self.advance()
-
-        tokens.append(Token(T_EOF, None, self.position))
-        
-        return tokens
-    
-    def make_number(self):
-        pos_start = self.position.copy()
-        number = 0
-        while self.is_number(self.current_char):
-            number = number * 10 + int(self.current_char)
-            self.advance()
-        
-        self.putback = self.current_char
-        
-        return Token(T_INTLIT, number, pos_start, self.position.copy())
-
-    def make_identifier(self):
-        pos_start = self.position.copy()
-        ident = ""
-        while self.is_letter(self.current_char):
-            ident += self.current_char
-            self.advance()
-
-        self.putback = self.current_char
-
-        if self.is_keyword(ident):
-            return Token(T_KEYWORD, ident, pos_start, self.position.copy())
-        elif self.is_type(ident):
-            return Token(T_TYPE, ident, pos_start, self.position.copy())
-        else:
-            return Token(T_IDENTIFIER, ident, pos_start, self.position.copy())
-    
-    def make_char(self):
-        pos_start = self.position.copy()
-        self.advance()
-        char = self.current_char
-        self.advance()
-
-        if self.current_char != '\'':
-            self.show_error("You forgot an apostroph :))")
-        else:
-            pos_end = self.position.copy()
-            pos_end.advance('')
-
-            return Token(T_CHARLIT, ord(char), pos_start, pos_end)
-
-    def make_eq(self):
-        pos_start = self.position.copy()
-        self.advance()
-
-        if self.current_char == '=':
-            pos_end = self.position.copy()
-            pos_end.advance('')
-
-            return Token(T_DEQ, None, pos_start, pos_end)
-        return Token(T_EQ, None, pos_start)
-    
-    def make_neq(self):
-        pos_start = self.position.copy()
-        self.advance()
-
-        if self.current_char == '=':
-            pos_end = self.position.copy()
-            pos_end.advance('')
-
-            return Token(T_NEQ, None, pos_start, pos_end)
-        
-        self.show_error("Unexpected character")
-    
-    def make_lt(self):
-        pos_start = self.position.copy()
-        self.advance()
-
-        if self.current_char == '=':
-            pos_end = self.position.copy()
-            pos_end.advance('')
-
-            return Token(T_LTE, None, pos_start, pos_end)
-        return Token(T_LT, None, pos_start)
-    
-    def make_gt(self):
-        pos_start = self.position.copy()
-        self.advance()
-
-        if self.current_char == '=':
-            pos_end = self.position.copy()
-            pos_end.advance('')
-
-            return Token(T_GTE, None, pos_start, pos_end)
-        return Token(T_GT, None, pos_start)
-
-    def show_error(self, msg):
+                self.show_error("Unexpected character", idx)
+                break
+
+        # the stream ends with EOF, right after the first error if there is one
+        yield T_EOF, None, len(text), len(text) + 1
+
+    def show_error(self, msg, idx):
         self.error = True
-        pos_end = self.position.copy()
-        pos_end.advance('')
-        err = Error(msg, self.position.copy(), pos_end)
+        err = Error(msg, self.source.position(idx), self.source.position(idx + 1))
         print(err.as_string())
-
-    @staticmethod
-    def is_number(num):
-        if not num:
-            return 0
-        if num in DIGITS:
-            return 1
-        return 0
-
-    @staticmethod
-    def is_letter(c):
-        if not c:
-            return 0
-        if c in LETTERS + '_':
-            return 1
-        return 0
-
-    @staticmethod
-    def is_keyword(ident):
-        if ident in keywords:
-            return True
-        return False
-
-    @staticmethod
-    def is_type(ident):
-        if ident in types:
-            return True
-        return False
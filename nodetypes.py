@@ -1,12 +1,18 @@
+# Every node class lists the fields holding child nodes in _children,
+# generic passes (visitor.Visitor.generic_visit) walk the tree through them.
+
 class GlobalStatements(list):
-    pass
+    __slots__ = ()
 
 
 class FunctionStatements(list):
-    pass
+    __slots__ = ()
 
 
 class IntLitNode(object):
+    __slots__ = ("value", "pos_start", "pos_end")
+    _children = ()
+
     def __init__(self, value, pos_start, pos_end):
         self.value = value
 
@@ -18,6 +24,9 @@ class IntLitNode(object):
 
 
 class CharLitNode(object):
+    __slots__ = ("value", "pos_start", "pos_end")
+    _children = ()
+
     def __init__(self, value, pos_start, pos_end):
         self.value = value
         self.pos_start = pos_start
@@ -28,6 +37,9 @@ class CharLitNode(object):
 
 
 class IdentifierNode(object):
+    __slots__ = ("value", "pos_start", "pos_end")
+    _children = ()
+
     def __init__(self, value, pos_start, pos_end):
         self.value = value
 
@@ -39,6 +51,9 @@ class IdentifierNode(object):
 
 
 class UnaryOperationNode(object):
+    __slots__ = ("sign", "right_node", "pos_start", "pos_end")
+    _children = ("right_node",)
+
     def __init__(self, sign, right_node, pos_start, pos_end):
         self.sign = sign
         self.right_node = right_node
@@ -51,6 +66,9 @@ class UnaryOperationNode(object):
 
 
 class BinaryOperationNode(object):
+    __slots__ = ("left_node", "sign", "right_node", "pos_start", "pos_end")
+    _children = ("left_node", "right_node")
+
     def __init__(self, left_node, sign, right_node, pos_start, pos_end):
         self.left_node = left_node
         self.sign = sign
@@ -64,6 +82,9 @@ class BinaryOperationNode(object):
 
 
 class PrintNode(object):
+    __slots__ = ("expr", "pos_start", "pos_end")
+    _children = ("expr",)
+
     def __init__(self, expr, pos_start, pos_end):
         self.expr = expr
 
@@ -75,6 +96,9 @@ class PrintNode(object):
 
 
 class GlobalVarDeclarationNode(object):
+    __slots__ = ("type", "name", "pos_start", "pos_end")
+    _children = ()
+
     def __init__(self, type_, name, pos_start, pos_end):
         self.type = type_
         self.name = name
@@ -86,6 +110,9 @@ class GlobalVarDeclarationNode(object):
         return f"VAR {repr(self.name)} TYPE {self.type}"
 
 class LocalVarDeclarationNode(object):
+    __slots__ = ("type", "name", "initial", "pos_start", "pos_end")
+    _children = ("initial",)
+
     def __init__(self, type_, name, initial, pos_start, pos_end):
         self.type = type_
         self.name = name
@@ -98,6 +125,9 @@ class LocalVarDeclarationNode(object):
         return f"VAR {self.name} = {self.initial}"
 
 class VarAssignNode(object):
+    __slots__ = ("name", "expr", "pos_start", "pos_end")
+    _children = ("name", "expr")
+
     def __init__(self, name, expr, pos_start, pos_end):
         self.name = name
         self.expr = expr
@@ -109,6 +139,9 @@ class VarAssignNode(object):
         return f"{self.name} = {self.expr}"
 
 class IfNode(object):
+    __slots__ = ("expr", "if_stmts", "else_stmts", "pos_start", "pos_end")
+    _children = ("expr", "if_stmts", "else_stmts")
+
     def __init__(self, expr, if_stmts, else_stmts, pos_start, pos_end):
         self.expr = expr
         self.if_stmts = if_stmts
@@ -121,6 +154,9 @@ class IfNode(object):
         return f"(IF ({self.expr}) {self.if_stmts} ELSE {self.else_stmts})"
 
 class FunctionDeclarationNode(object):
+    __slots__ = ("type", "name", "args", "stmts", "pos_start", "pos_end")
+    _children = ("stmts",)
+
     def __init__(self, type_, name, args, stmts, pos_start, pos_end):
         self.type = type_
         self.name = name
@@ -0,0 +1,52 @@
+def label(root, labels):
+    """
+    Sethi-Ullman labelling of the expression root. Stores (registers
+    needed, pure) in labels for root and every expression below it. A
+    leaf needs one register; an operation needs the larger of its
+    operands' needs, or one more than that when both need the same. Pure
+    means that no assignment happens while evaluating the expression.
+
+    Nodes are the keys, so views of an arena work as well as node objects.
+    """
+    stack = [(root, False)]
+    while stack:
+        node, operands_done = stack.pop()
+        if node in labels:
+            continue
+
+        kind = type(node).__name__
+        if kind == "BinaryOperationNode":
+            if not operands_done:
+                stack.append((node, True))
+                stack.append((node.right_node, False))
+                stack.append((node.left_node, False))
+                continue
+            left_need, left_pure = labels[node.left_node]
+            right_need, right_pure = labels[node.right_node]
+            need = left_need + 1 if left_need == right_need else max(left_need, right_need)
+            labels[node] = (need, left_pure and right_pure)
+        elif kind in ("UnaryOperationNode", "VarAssignNode"):
+            child = node.right_node if kind == "UnaryOperationNode" else node.expr
+            if not operands_done:
+                stack.append((node, True))
+                stack.append((child, False))
+                continue
+            need, pure = labels[child]
+            labels[node] = (need, pure and kind == "UnaryOperationNode")
+        else:
+            labels[node] = (1, True)
+
+    return labels[root]
+
+
+def right_first(node, labels):
+    """
+    True when the right operand of the binary operation node should be
+    evaluated first: it needs more registers than the left one and
+    neither side assigns anything, so the order can't be observed.
+    """
+    if node not in labels:
+        label(node, labels)
+    left_need, left_pure = labels[node.left_node]
+    right_need, right_pure = labels[node.right_node]
+    return right_need > left_need and left_pure and right_pure
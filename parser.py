@@ -2,51 +2,87 @@ from tokentypes import *
 from nodetypes import *
 from error import Error
 
-PREC_EOF = 0
+PREC_NONE = -1
 PREC_ASSIGN = 10
 PREC_COMPARISON = 20
-PREC_UNARY = 30
 PREC_PLUSMINUS = 40
 PREC_MULDIV = 50
 
+INFIX_PRECEDENCE = {
+    T_EQ: PREC_ASSIGN,
+    T_DEQ: PREC_COMPARISON,
+    T_NEQ: PREC_COMPARISON,
+    T_LT: PREC_COMPARISON,
+    T_LTE: PREC_COMPARISON,
+    T_GT: PREC_COMPARISON,
+    T_GTE: PREC_COMPARISON,
+    T_PLUS: PREC_PLUSMINUS,
+    T_MINUS: PREC_PLUSMINUS,
+    T_ASTERISK: PREC_MULDIV,
+    T_SLASH: PREC_MULDIV
+}
+
+# a = b = c assigns right to left, everything else groups to the left
+RIGHT_ASSOCIATIVE = {T_EQ}
+
+# unary minus binds tighter than any binary operator
+PREFIX_OPERATORS = {T_MINUS, T_LPAREN}
+
+EXPR_TERMINATORS = {T_SEMICOLON, T_RPAREN, T_EOF}
+
 
 class Parser(object):
-    def __init__(self, toks):
-        self.toks = toks
-        
+    def __init__(self, toks, lexer=None):
+        # toks can be a list or a lazy stream such as Lexer.iter_tokens();
+        # tokens are pulled on demand, one at a time. Given the lexer of a
+        # stream, parsing stops as soon as the lexer reports an error.
+        self.toks = iter(toks)
+        self.lexer = lexer
+
         self.current_tok = None
-        self.idx = -1
 
         self.error: bool = False
 
+        self.prefix_handlers = {
+            T_INTLIT: self.make_int_lit,
+            T_CHARLIT: self.make_char_lit,
+            T_IDENTIFIER: self.make_identifier
+        }
+        self.infix_handlers = {
+            T_EQ: self.make_var_assign
+        }
+
         self.advance()
 
     def advance(self):
-        self.idx += 1
-        self.current_tok = self.toks[self.idx] if self.idx < len(self.toks) else None
+        # once the stream is exhausted we keep sitting on its last (EOF) token
+        self.current_tok = next(self.toks, self.current_tok)
+        if self.lexer is not None and self.lexer.error:
+            self.error = True
 
     """
     Global context
     """
     def parse_file(self):
-        stmts = GlobalStatements()
+        return GlobalStatements(self.iter_global_statements())
 
+    def iter_global_statements(self):
+        """
+        Yields the global statements one at a time as they are parsed,
+        stopping at the end of the file or the first error.
+        """
         while self.current_tok.type is not T_EOF and not self.error:
-            if self.check_eof():
-                return
             stmt = self.parse_global_statement()
-            stmts.append(stmt)
-
-        return stmts
+            if self.error:
+                return
+            yield stmt
 
     def parse_global_statement(self):
         if self.current_tok.type == T_TYPE:
             node = self.parse_global_symbol()
             return node
         else:
-            self.error = True
-            err = Error("Expected symbol declaration", self.current_tok.pos_start, self.current_tok.pos_end)
-            print(err.as_string())
+            self.show_error("Expected symbol declaration")
             return
 
     def parse_global_symbol(self):
@@ -59,18 +95,14 @@ class Parser(object):
 
         var_type = self.current_tok
         if var_type.type != T_TYPE:
-            self.error = True
-            err = Error("Expected type of variable", self.current_tok.pos_start, self.current_tok.pos_end)
-            print(err.as_string())
+            self.show_error("Expected type of variable")
             return
 
         self.advance()
 
         ident = self.current_tok
         if ident.type != T_IDENTIFIER:
-            self.error = True
-            err = Error("Expected identifier", self.current_tok.pos_start, self.current_tok.pos_end)
-            print(err.as_string())
+            self.show_error("Expected identifier")
             return
 
         self.advance()
@@ -79,18 +111,14 @@ class Parser(object):
             args = ()
             self.advance()
             if self.current_tok.type != T_RPAREN:
-                self.error = True
-                err = Error("Expected ')'", self.current_tok.pos_start, self.current_tok.pos_end)
-                print(err.as_string())
+                self.show_error("Expected ')'")
                 return
 
             self.advance()
 
             if self.current_tok.type != T_LCURLY:
                 if self.current_tok.type != T_SEMICOLON:
-                    self.error = True
-                    err = Error("Expected ';'", self.current_tok.pos_start, self.current_tok.pos_end)
-                    print(err.as_string())
+                    self.show_error("Expected ';'")
                     return
                 self.advance()
                 return FunctionDeclarationNode(var_type, ident, args, None,
@@ -103,9 +131,7 @@ class Parser(object):
                                               self.current_tok.pos_end)
         else:
             if self.current_tok.type != T_SEMICOLON:
-                self.error = True
-                err = Error("Expected ';'", self.current_tok.pos_start, self.current_tok.pos_end)
-                print(err.as_string())
+                self.show_error("Expected ';'")
                 return
 
             self.advance()
@@ -163,18 +189,14 @@ class Parser(object):
 
         var_type = self.current_tok
         if var_type.type != T_TYPE:
-            self.error = True
-            err = Error("Expected type of variable", self.current_tok.pos_start, self.current_tok.pos_end)
-            print(err.as_string())
+            self.show_error("Expected type of variable")
             return
 
         self.advance()
 
         ident = self.current_tok
         if ident.type != T_IDENTIFIER:
-            self.error = True
-            err = Error("Expected identifier", self.current_tok.pos_start, self.current_tok.pos_end)
-            print(err.as_string())
+            self.show_error("Expected identifier")
             return
 
         self.advance()
@@ -182,7 +204,7 @@ class Parser(object):
         if self.current_tok.type == T_EQ:
             self.advance()
 
-            expr = self.parse_expr(20)
+            expr = self.parse_expr(PREC_COMPARISON)
             if self.check_semi():
                 return
             
@@ -190,9 +212,7 @@ class Parser(object):
             return LocalVarDeclarationNode(var_type, ident, expr, pos_start, self.current_tok.pos_end)
         else:
             if self.current_tok.type != T_SEMICOLON:
-                self.error = True
-                err = Error("Expected ';'", self.current_tok.pos_start, self.current_tok.pos_end)
-                print(err.as_string())
+                self.show_error("Expected ';'")
                 return
 
             self.advance()
@@ -206,9 +226,7 @@ class Parser(object):
 
         # condition
         if self.current_tok.type != T_LPAREN:
-            self.error = True
-            err = Error("Expected '('", self.current_tok.pos_start, self.current_tok.pos_end)
-            print(err.as_string())
+            self.show_error("Expected '('")
             return
 
         self.advance()
@@ -216,9 +234,7 @@ class Parser(object):
         expr = self.parse_expr(0)
         
         if self.current_tok.type != T_RPAREN:
-            self.error = True
-            err = Error("Expected ')'", self.current_tok.pos_start, self.current_tok.pos_end)
-            print(err.as_string())
+            self.show_error("Expected ')'")
             return
         self.advance()
 
@@ -246,119 +262,140 @@ class Parser(object):
     Math expressions
     """
     def parse_expr(self, prec):
-        left = self.parse_primary()
-
-        tokentype = self.current_tok.type
-        if tokentype == T_SEMICOLON or tokentype == T_RPAREN or tokentype == T_EOF:
-            return left
+        """
+        Operator precedence (Pratt) parser driven by the handler tables.
+        Instead of recursing once per nesting level it keeps explicit
+        operand and operator stacks, so how deep an expression can nest is
+        bounded by memory only. Operators binding looser than `prec` end the
+        expression, unless they are inside parentheses.
+        """
+        operands = []
+        operators = [] # (tokentype, precedence, token), PREC_NONE marks '(' and unary '-'
+        depth = 0 # open parentheses
+
+        while True:
+            # prefix operators, then the operand itself
+            tok = self.current_tok
+            while tok.type in PREFIX_OPERATORS:
+                operators.append((tok.type, PREC_NONE, tok))
+                if tok.type == T_LPAREN:
+                    depth += 1
+                self.advance()
+                tok = self.current_tok
 
-        while self.get_precedence(tokentype) >= prec:
+            handler = self.prefix_handlers.get(tok.type)
+            if handler is None:
+                self.show_error("Expected int")
+                return
+            operands.append(handler(tok))
             self.advance()
-            right = self.parse_expr(self.get_precedence(tokentype))
-
-            if tokentype == T_EQ:
-                if type(left) == IdentifierNode:
-                    left = VarAssignNode(left, right, left.pos_start, right.pos_end)
-                else:
-                    self.error = True
-                    err = Error("Expected identifier", left.pos_start, left.pos_end)
-                    print(err.as_string())
-                    return
-            else:
-                left = BinaryOperationNode(left, tokentype, right, left.pos_start, right.pos_end)
 
-            tokentype = self.current_tok.type
-            if tokentype == T_SEMICOLON or tokentype == T_RPAREN or tokentype == T_EOF:
-                return left
+            # the operand is complete: apply unary minuses and close parentheses
+            while True:
+                while operators and operators[-1][0] == T_MINUS and operators[-1][1] == PREC_NONE:
+                    _, _, sign = operators.pop()
+                    right = operands.pop()
+                    operands.append(UnaryOperationNode(T_MINUS, right, sign.pos_start, right.pos_end))
+
+                if not depth or self.current_tok.type != T_RPAREN:
+                    break
+
+                while operators[-1][1] != PREC_NONE:
+                    if not self.reduce(operands, operators):
+                        return
+                operators.pop()
+                depth -= 1
+                self.advance()
 
-        return left
+            tok = self.current_tok
+            if tok.type in EXPR_TERMINATORS:
+                break
 
-    def parse_primary(self):
-        if self.current_tok.type == T_INTLIT:
-            node = IntLitNode(self.current_tok.value, self.current_tok.pos_start, self.current_tok.pos_end)
-            self.advance()
-            return node
-        elif self.current_tok.type == T_CHARLIT:
-            node = CharLitNode(self.current_tok.value, self.current_tok.pos_start, self.current_tok.pos_end)
-            self.advance()
-            return node
-        elif self.current_tok.type == T_IDENTIFIER:
-            node = IdentifierNode(self.current_tok, self.current_tok.pos_start, self.current_tok.pos_end)
-            self.advance()
-            return node
-        elif self.current_tok.type == T_MINUS:
-            pos_start = self.current_tok.pos_start
+            tok_prec = INFIX_PRECEDENCE.get(tok.type)
+            if tok_prec is None:
+                self.show_error("Syntax error")
+                return
+            if not depth and tok_prec < prec:
+                break
 
-            sign = self.current_tok.type
-            self.advance()
-            val = self.parse_primary()
-            node = UnaryOperationNode(sign, val, pos_start, self.current_tok.pos_end)
-            return node
-        elif self.current_tok.type == T_LPAREN:
+            right_assoc = tok.type in RIGHT_ASSOCIATIVE
+            while operators and (operators[-1][1] > tok_prec or (operators[-1][1] == tok_prec and not right_assoc)):
+                if not self.reduce(operands, operators):
+                    return
+
+            operators.append((tok.type, tok_prec, tok))
             self.advance()
-            expr = self.parse_expr(0)
-            if self.current_tok.type != T_RPAREN:
-                self.error = True
-                err = Error("Expected ')'", self.current_tok.pos_start, self.current_tok.pos_end)
-                print(err.as_string())
+
+        if depth:
+            self.show_error("Expected ')'")
+            return
+
+        while operators:
+            if not self.reduce(operands, operators):
                 return
 
-            self.advance()
+        return operands[0]
 
-            return expr
+    def reduce(self, operands, operators):
+        """
+        Pops the topmost binary operator and its two operands and pushes the
+        combined node, returns False on error.
+        """
+        tokentype, _, _ = operators.pop()
+        right = operands.pop()
+        left = operands.pop()
 
-        self.error = True
-        err = Error("Expected int", self.current_tok.pos_start, self.current_tok.pos_end)
-        print(err.as_string())
+        node = self.infix_handlers.get(tokentype, self.make_binary_operation)(tokentype, left, right)
+        if node is None:
+            return False
+
+        operands.append(node)
+        return True
+
+    def make_int_lit(self, tok):
+        return IntLitNode(tok.value, tok.pos_start, tok.pos_end)
+
+    def make_char_lit(self, tok):
+        return CharLitNode(tok.value, tok.pos_start, tok.pos_end)
+
+    def make_identifier(self, tok):
+        return IdentifierNode(tok, tok.pos_start, tok.pos_end)
+
+    def make_binary_operation(self, tokentype, left, right):
+        return BinaryOperationNode(left, tokentype, right, left.pos_start, right.pos_end)
+
+    def make_var_assign(self, tokentype, left, right):
+        if type(left) != IdentifierNode:
+            self.show_error("Expected identifier", left)
+            return
+        return VarAssignNode(left, right, left.pos_start, right.pos_end)
 
     """
     Utils
     """
-    def get_precedence(self, tokentype):
-        if tokentype == T_EOF:
-            return PREC_EOF
-        elif tokentype == T_EQ:
-            return PREC_ASSIGN
-        elif tokentype == T_DEQ:
-            return PREC_COMPARISON
-        elif tokentype == T_NEQ:
-            return PREC_COMPARISON
-        elif tokentype == T_LT:
-            return PREC_COMPARISON
-        elif tokentype == T_LTE:
-            return PREC_COMPARISON
-        elif tokentype == T_GT:
-            return PREC_COMPARISON
-        elif tokentype == T_GTE:
-            return PREC_COMPARISON
-        elif tokentype == T_INTLIT:
-            return PREC_UNARY
-        elif tokentype == T_PLUS:
-            return PREC_PLUSMINUS
-        elif tokentype == T_MINUS:
-            return PREC_PLUSMINUS
-        elif tokentype == T_ASTERISK:
-            return PREC_MULDIV
-        elif tokentype == T_SLASH:
-            return PREC_MULDIV
-        else:
-            self.error = True
-            err = Error("Syntax error", self.current_tok.pos_start, self.current_tok.pos_end)
-            print(err.as_string())
-            return -1
+    def show_error(self, msg, at=None):
+        """
+        Reports an error spanning `at` (a token or node), by default the current token.
+        """
+        self.error = True
+        if self.lexer is not None and self.lexer.error:
+            # the lexer has already reported what is wrong here
+            return
+
+        if at is None:
+            at = self.current_tok
+
+        err = Error(msg, at.pos_start, at.pos_end)
+        print(err.as_string())
 
     def check_semi(self):
         if self.current_tok.type != T_SEMICOLON:
-            self.error = True
-            err = Error("Expected ';'", self.current_tok.pos_start, self.current_tok.pos_end)
-            print(err.as_string())
+            self.show_error("Expected ';'")
             return 1
         return 0
 
     def check_eof(self):
         if self.current_tok.type == T_EOF:
-            self.error = True
-            err = Error("EOF Error", self.current_tok.pos_start, self.current_tok.pos_end)
-            print(err.as_string())
+            self.show_error("EOF Error")
             return 1
         return 0
@@ -0,0 +1,110 @@
+from asm import AsmInstr, Label, is_memory
+
+# (name, function) of every rule, in the order they are tried. A rule is
+# called with the item list and a position and either returns None or
+# (number of items it replaces, replacement items).
+RULES = []
+
+
+def rule(function):
+    RULES.append((function.__name__, function))
+    return function
+
+
+def instr_at(items, i, *ops):
+    if i < len(items) and type(items[i]) is AsmInstr and items[i].op in ops:
+        return items[i]
+    return None
+
+
+@rule
+def store_reload(items, i):
+    """
+    mov [m], s / mov r, [m]  ->  mov [m], s / mov r, s
+    """
+    store = instr_at(items, i, "mov")
+    if not store:
+        return None
+    m, s = store.operands
+    # without a size the reload could read a different width
+    if not is_memory(m) or is_memory(s) or not m.startswith(("dword ", "byte ")):
+        return None
+
+    load = instr_at(items, i + 1, "mov", "movsx")
+    if not load or load.operands[1] != m:
+        return None
+
+    r = load.operands[0]
+    if s[0].isalpha():
+        return 2, [store, AsmInstr(load.op, r, s)]
+
+    # an immediate only keeps its low byte through a byte store
+    if load.op == "movsx" or m.startswith("byte "):
+        try:
+            value = int(s, 0)
+        except ValueError:
+            return None
+        s = str(((value + 128) & 255) - 128)
+    return 2, [store, AsmInstr("mov", r, s)]
+
+
+@rule
+def self_move(items, i):
+    """
+    mov r, r  ->  nothing
+    """
+    instr = instr_at(items, i, "mov")
+    if instr and instr.operands[0] == instr.operands[1] and not is_memory(instr.operands[0]):
+        return 1, []
+    return None
+
+
+@rule
+def jump_to_next(items, i):
+    """
+    jmp l / l:  ->  l:
+    """
+    instr = items[i]
+    if type(instr) is not AsmInstr or instr.op[0] != "j":
+        return None
+
+    j = i + 1
+    while j < len(items) and type(items[j]) is Label:
+        if items[j].name == instr.operands[0]:
+            return 1, []
+        j += 1
+    return None
+
+
+class PeepholeOptimizer(object):
+    """
+    Applies the rules to a list of asm items until none of them matches
+    anymore. hits counts how often each rule fired.
+    """
+    def __init__(self, rules=None):
+        self.rules = RULES if rules is None else rules
+        self.hits = {name: 0 for name, _ in self.rules}
+
+    def optimize(self, items):
+        changed = True
+        while changed:
+            changed = False
+            out = []
+            i = 0
+            while i < len(items):
+                for name, function in self.rules:
+                    result = function(items, i)
+                    if result is not None:
+                        break
+                else:
+                    out.append(items[i])
+                    i += 1
+                    continue
+
+                count, replacement = result
+                out.extend(replacement)
+                i += count
+                self.hits[name] += 1
+                changed = True
+            items = out
+        return items
@@ -0,0 +1,160 @@
+from bisect import bisect_right
+
+from ir import *
+
+# Registers handed out to virtual registers, in order of preference.
+# Caller-saved ones cost nothing to use as long as nothing live sits in them
+# across a call; callee-saved ones have to be saved by the function.
+CALLER_SAVED = ["rcx", "rsi", "rdi", "r8", "r9", "rax", "rdx"]
+CALLEE_SAVED = ["rbx", "r12", "r13", "r14", "r15"]
+ALLOCATABLE = CALLER_SAVED + CALLEE_SAVED
+
+# never allocated, the code generator uses them to reach spilled values
+SCRATCH = ["r10", "r11"]
+
+# registers an instruction destroys besides its destination
+CALL_CLOBBERS = set(CALLER_SAVED) | set(SCRATCH)
+DIV_CLOBBERS = {"rax", "rdx"}
+
+
+class Interval(object):
+    """
+    The range of instruction positions a vreg is live in, from its
+    definition to its last use.
+    """
+    __slots__ = ("vreg", "start", "end", "forbidden", "reg", "slot")
+
+    def __init__(self, vreg, start):
+        self.vreg = vreg
+        self.start = start
+        self.end = start
+        self.forbidden = set()
+        self.reg = None
+        self.slot = None
+
+    def __repr__(self):
+        return "{} [{}, {}] -> {}".format(self.vreg, self.start, self.end, self.reg or "slot {}".format(self.slot))
+
+
+class Allocation(object):
+    def __init__(self):
+        # vreg -> register name, or stack slot number for spilled vregs
+        self.regs = {}
+        self.slots = {}
+        self.slot_count = 0
+        # callee-saved registers the function writes to
+        self.saved = []
+
+
+class LinearScanAllocator(object):
+    """
+    Linear scan register allocation (Poletto & Sarkar) over the vregs of
+    one IRFunction. Temporaries never live across blocks, so intervals
+    come from the linear block order. When every usable register is taken
+    the interval ending last is spilled to a stack slot for its whole
+    lifetime; slots are reused once their interval is over.
+
+    Intervals live across a print call only get callee-saved registers,
+    intervals live across a division stay out of rax and rdx.
+    """
+    def allocate(self, function):
+        intervals, hints = self.build_intervals(function)
+
+        allocation = Allocation()
+        active = []
+        slot_ends = []
+
+        for iv in intervals:
+            # expire intervals that ended before this one starts
+            still_active = []
+            for other in active:
+                if other.end >= iv.start:
+                    still_active.append(other)
+            active = still_active
+
+            allowed = [r for r in ALLOCATABLE if r not in iv.forbidden]
+
+            # take over the register of an operand dying here, so the
+            # result can be computed in place
+            hint = hints.get(iv.vreg)
+            if hint is not None and hint.end == iv.start and hint.reg in allowed and hint in active:
+                active.remove(hint)
+                iv.reg = hint.reg
+            else:
+                taken = {other.reg for other in active}
+                for r in allowed:
+                    if r not in taken:
+                        iv.reg = r
+                        break
+
+            if iv.reg is None:
+                candidates = [other for other in active if other.reg in allowed]
+                victim = max(candidates, key=lambda other: other.end, default=None)
+                if victim is not None and victim.end > iv.end:
+                    iv.reg = victim.reg
+                    victim.reg = None
+                    active.remove(victim)
+                    self.spill(victim, slot_ends)
+                else:
+                    self.spill(iv, slot_ends)
+
+            if iv.reg is not None:
+                active.append(iv)
+
+        for iv in intervals:
+            if iv.reg is not None:
+                allocation.regs[iv.vreg] = iv.reg
+            else:
+                allocation.slots[iv.vreg] = iv.slot
+        allocation.slot_count = len(slot_ends)
+        used = set(allocation.regs.values())
+        allocation.saved = [r for r in CALLEE_SAVED if r in used]
+        return allocation
+
+    @staticmethod
+    def spill(iv, slot_ends):
+        for i, end in enumerate(slot_ends):
+            if end < iv.start:
+                iv.slot = i
+                slot_ends[i] = iv.end
+                return
+        iv.slot = len(slot_ends)
+        slot_ends.append(iv.end)
+
+    @staticmethod
+    def build_intervals(function):
+        """
+        Returns the intervals sorted by start and, for every vreg computed
+        from another one, the interval of its first operand.
+        """
+        intervals = {}
+        hints = {}
+        calls = []
+        divs = []
+
+        pos = 0
+        for block in function.blocks:
+            for instr in block.instrs:
+                for v in instr.uses():
+                    intervals[v].end = pos
+                if instr.dst is not None:
+                    intervals[instr.dst] = Interval(instr.dst, pos)
+                    if instr.args and type(instr.args[0]) is VReg:
+                        hints[instr.dst] = intervals[instr.args[0]]
+                if instr.op == I_PRINT:
+                    calls.append(pos)
+                elif instr.op == I_DIV:
+                    divs.append(pos)
+                pos += 1
+
+        intervals = sorted(intervals.values(), key=lambda iv: iv.start)
+        for iv in intervals:
+            # the operands of a call are read before it, its result (none
+            # yet) would be written after it
+            i = bisect_right(calls, iv.start)
+            if i < len(calls) and calls[i] < iv.end:
+                iv.forbidden |= CALL_CLOBBERS
+            i = bisect_right(divs, iv.start)
+            if i < len(divs) and divs[i] <= iv.end:
+                iv.forbidden |= DIV_CLOBBERS
+        return intervals, hints
@@ -0,0 +1,155 @@
+# The print helpers compiled programs call. Both runtimes provide
+#   oasis.printint    prints edi and a newline
+#   oasis.printchar   prints dl
+# and may clobber every caller-saved register. The dot keeps their names
+# apart from the program's own symbols. They are written into the
+# output by the CodeGenerator as structured instructions.
+PRINTINT = "oasis.printint"
+PRINTCHAR = "oasis.printchar"
+
+OUTPUT_BUFFER_SIZE = 4096
+# longest printint output: "-2147483648\n"
+INT_TEXT_SIZE = 12
+
+STDOUT = 1
+
+
+class PrintfRuntime(object):
+    """
+    Formats every print with the C library's printf.
+    """
+    def gen(self, gen):
+        gen.write_line('extern {}'.format(gen.target.symbol("printf")))
+        gen.write_line()
+        gen.write_line('oasis.PRINTF_INT: db "%d", 10, 0')
+        gen.write_line('oasis.PRINTF_CHAR: db "%c", 0')
+        gen.write_line()
+        gen.gen_label(PRINTINT)
+        gen.emit("push", "rbp")
+        gen.emit("mov", "rbp", "rsp")
+        gen.emit("sub", "rsp", "16")
+        gen.emit("mov", "[rbp-4]", "edi")
+        gen.emit("mov", "eax", "[rbp-4]")
+        gen.emit("mov", "esi", "eax")
+        gen.emit("mov", "rdi", "oasis.PRINTF_INT")
+        gen.emit("mov", "eax", "0")
+        gen.emit("call", gen.target.symbol("printf"))
+        gen.emit("mov", "rsp", "rbp")
+        gen.emit("pop", "rbp")
+        gen.emit("ret")
+        gen.write_line()
+        gen.gen_label(PRINTCHAR)
+        gen.emit("push", "rbp")
+        gen.emit("mov", "rbp", "rsp")
+        gen.emit("sub", "rsp", "16")
+        gen.emit("mov", "[rbp-1]", "dl")
+        gen.emit("mov", "ax", "[rbp-1]")
+        gen.emit("mov", "si", "ax")
+        gen.emit("mov", "rdi", "oasis.PRINTF_CHAR")
+        gen.emit("mov", "eax", "0")
+        gen.emit("call", gen.target.symbol("printf"))
+        gen.emit("mov", "rsp", "rbp")
+        gen.emit("pop", "rbp")
+        gen.emit("ret")
+        gen.write_line()
+        gen.write_line()
+
+    def gen_exit(self, gen):
+        # stdio flushes its own buffers at exit
+        pass
+
+
+class BufferedRuntime(object):
+    """
+    Converts numbers itself and collects all output in a buffer in .bss,
+    written with a single write syscall when it is full and when main
+    returns. No C library calls.
+    """
+    def gen(self, gen):
+        gen.reserve("oasis.output_buffer", OUTPUT_BUFFER_SIZE)
+        gen.reserve("oasis.output_length", 4)
+
+        self.gen_printint(gen)
+        self.gen_printchar(gen)
+        self.gen_flush(gen)
+        gen.write_line()
+
+    def gen_printint(self, gen):
+        gen.gen_label(PRINTINT)
+        gen.emit("cmp", "dword [rel oasis.output_length]", OUTPUT_BUFFER_SIZE - INT_TEXT_SIZE)
+        gen.emit("jbe", "oasis.printint_convert")
+        gen.emit("push", "rdi")
+        gen.emit("call", "oasis.flush")
+        gen.emit("pop", "rdi")
+        gen.gen_label("oasis.printint_convert")
+        # the digits are written backwards into the red zone below rsp,
+        # from rsi down
+        gen.emit("lea", "rsi", "[rsp - 1]")
+        gen.emit("mov", "byte [rsi]", 10)
+        gen.emit("mov", "eax", "edi")
+        gen.emit("test", "edi", "edi")
+        gen.emit("jns", "oasis.printint_digit")
+        # as unsigned, -(-2147483648) is still right
+        gen.emit("neg", "eax")
+        gen.gen_label("oasis.printint_digit")
+        gen.emit("mov", "ecx", 10)
+        gen.emit("xor", "edx", "edx")
+        gen.emit("div", "ecx")
+        gen.emit("add", "dl", ord("0"))
+        gen.emit("dec", "rsi")
+        gen.emit("mov", "byte [rsi]", "dl")
+        gen.emit("test", "eax", "eax")
+        gen.emit("jnz", "oasis.printint_digit")
+        gen.emit("test", "edi", "edi")
+        gen.emit("jns", "oasis.printint_copy")
+        gen.emit("dec", "rsi")
+        gen.emit("mov", "byte [rsi]", ord("-"))
+        gen.gen_label("oasis.printint_copy")
+        # rcx = length, rdi = end of the buffered output
+        gen.emit("mov", "rcx", "rsp")
+        gen.emit("sub", "rcx", "rsi")
+        gen.emit("mov", "eax", "dword [rel oasis.output_length]")
+        gen.emit("lea", "rdi", "[rel oasis.output_buffer]")
+        gen.emit("add", "rdi", "rax")
+        gen.emit("add", "dword [rel oasis.output_length]", "ecx")
+        gen.emit("rep movsb")
+        gen.emit("ret")
+        gen.write_line()
+
+    def gen_printchar(self, gen):
+        gen.gen_label(PRINTCHAR)
+        gen.emit("cmp", "dword [rel oasis.output_length]", OUTPUT_BUFFER_SIZE)
+        gen.emit("jb", "oasis.printchar_store")
+        gen.emit("push", "rdx")
+        gen.emit("call", "oasis.flush")
+        gen.emit("pop", "rdx")
+        gen.gen_label("oasis.printchar_store")
+        gen.emit("mov", "eax", "dword [rel oasis.output_length]")
+        gen.emit("lea", "rcx", "[rel oasis.output_buffer]")
+        gen.emit("mov", "byte [rcx + rax]", "dl")
+        gen.emit("inc", "eax")
+        gen.emit("mov", "dword [rel oasis.output_length]", "eax")
+        gen.emit("ret")
+        gen.write_line()
+
+    def gen_flush(self, gen):
+        gen.gen_label("oasis.flush")
+        gen.emit("mov", "edx", "dword [rel oasis.output_length]")
+        gen.emit("test", "edx", "edx")
+        gen.emit("jz", "oasis.flush_done")
+        gen.emit("mov", "eax", gen.target.sys_write)
+        gen.emit("mov", "edi", STDOUT)
+        gen.emit("lea", "rsi", "[rel oasis.output_buffer]")
+        gen.emit("syscall")
+        gen.emit("mov", "dword [rel oasis.output_length]", 0)
+        gen.gen_label("oasis.flush_done")
+        gen.emit("ret")
+
+    def gen_exit(self, gen):
+        gen.emit("call", "oasis.flush")
+
+
+RUNTIMES = {
+    "printf": PrintfRuntime,
+    "buffered": BufferedRuntime
+}
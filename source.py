@@ -0,0 +1,97 @@
+import mmap
+from array import array
+from bisect import bisect_right
+
+
+class SourceFile(object):
+    """
+    The text of one input file plus a table of line start offsets, so
+    offsets can be mapped to (line, col) by bisection. The text can be a
+    str, bytes or a read-only mmap; it is never copied.
+    """
+    def __init__(self, filename, text):
+        self.filename = filename
+        self.text = text
+        self.newline = '\n' if isinstance(text, str) else b'\n'
+
+        self._line_starts = None
+
+    @property
+    def line_starts(self):
+        # built on first use, most compilations never print a diagnostic
+        if self._line_starts is None:
+            text = self.text
+            nl = self.newline
+            starts = array('I', [0])
+            idx = text.find(nl)
+            while idx != -1:
+                starts.append(idx + 1)
+                idx = text.find(nl, idx + 1)
+            self._line_starts = starts
+        return self._line_starts
+
+    def __len__(self):
+        return len(self.text)
+
+    def linecol(self, idx):
+        line = bisect_right(self.line_starts, idx) - 1
+        return line, idx - self.line_starts[line]
+
+    def line_text(self, line):
+        starts = self.line_starts
+        beg = starts[line]
+        end = starts[line + 1] - 1 if line + 1 < len(starts) else len(self.text)
+
+        text = self.text[beg:end]
+        if not isinstance(text, str):
+            text = text.decode(errors='replace')
+        return text
+
+    def position(self, idx):
+        return Position(idx, self)
+
+    @classmethod
+    def open(cls, filename, use_mmap=False):
+        if use_mmap:
+            with open(filename, 'rb') as f:
+                # mmap refuses empty files
+                try:
+                    text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    text = b""
+        else:
+            with open(filename, 'r') as f:
+                text = f.read()
+
+        return cls(filename, text)
+
+
+class Position(object):
+    """
+    An offset into a SourceFile. Line and column are only looked up when
+    somebody asks for them (usually an Error being printed).
+    """
+    __slots__ = ("idx", "source")
+
+    def __init__(self, idx, source):
+        self.idx = idx
+        self.source = source
+
+    @property
+    def line(self):
+        return self.source.linecol(self.idx)[0]
+
+    @property
+    def col(self):
+        return self.source.linecol(self.idx)[1]
+
+    @property
+    def filename(self):
+        return self.source.filename
+
+    @property
+    def filetext(self):
+        return self.source.text
+
+    def copy(self):
+        return Position(self.idx, self.source)
@@ -0,0 +1,56 @@
+# Constants for replacing multiplication and division by constants with
+# shifts, lea and multiply-high sequences. All arithmetic is 32 bit signed.
+
+# multipliers lea can do in one instruction, [a + a * (m - 1)]
+LEA_MULTIPLIERS = (3, 5, 9)
+
+
+def log2_exact(value):
+    """
+    k when value is 2 ** k with k > 0, otherwise None.
+    """
+    if value > 1 and value & (value - 1) == 0:
+        return value.bit_length() - 1
+    return None
+
+
+def signed_magic(d):
+    """
+    The magic multiplier and shift for signed division by d, for
+    2 <= |d| < 2 ** 31 and |d| not a power of two (Hacker's Delight 10-1):
+
+        q = mulhi(n, M)             high 32 bits of the 64 bit product
+        q += n  if d > 0 and M < 0
+        q -= n  if d < 0 and M > 0
+        q >>= s                     arithmetic
+        q += q >>> 31               rounds towards zero
+
+    M is returned as a signed 32 bit value.
+    """
+    two31 = 1 << 31
+    if not 2 <= abs(d) < two31:
+        raise ValueError("no magic number for division by {}".format(d))
+    ad = abs(d)
+    t = two31 + (1 if d < 0 else 0)
+    anc = t - 1 - t % ad
+    p = 31
+    q1, r1 = divmod(two31, anc)
+    q2, r2 = divmod(two31, ad)
+    while True:
+        p += 1
+        q1, r1 = 2 * q1, 2 * r1
+        if r1 >= anc:
+            q1, r1 = q1 + 1, r1 - anc
+        q2, r2 = 2 * q2, 2 * r2
+        if r2 >= ad:
+            q2, r2 = q2 + 1, r2 - ad
+        delta = ad - r2
+        if not (q1 < delta or q1 == delta and r1 == 0):
+            break
+
+    m = (q2 + 1) & 0xffffffff
+    if d < 0:
+        m = -m & 0xffffffff
+    if m >= two31:
+        m -= 1 << 32
+    return m, p - 32
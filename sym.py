@@ -10,57 +10,122 @@ v_names = {
     D_INT: "int"
 }
 
+data_types = {
+    "int": D_INT,
+    "char": D_CHAR
+}
 
-class GlobalContext:
-    def __init__(self):
-        self.parent = None
-        self.symbols = {}
 
-    def add_symbol(self, s):
-        self.symbols[s.name] = s
-        self.symbols[s.name].is_global = True
+def get_data_type(n):
+    return data_types.get(n, -1)
 
-    def __repr__(self):
-        return self.symbols.__repr__()
 
+# Symbol names are interned to small integers, scopes are keyed by those
+NAME_IDS = {}
 
-class FunctionContext:
-    def __init__(self, name, parent):
-        self.name = name
-        self.parent = parent
 
-        self.symbols = {}
+def intern_name(name):
+    key = NAME_IDS.get(name)
+    if key is None:
+        key = NAME_IDS[name] = len(NAME_IDS)
+    return key
 
-        self.align_count = 0
-        self.last_symbol_offset = 0
 
-        if parent:
-            self.symbols.update(self.parent.symbols)
+class SymbolTable:
+    """
+    The symbols visible at the current point of the compilation: for every
+    name id a stack of the symbols bound to it, innermost scope last. Scopes
+    push their symbols on creation and pop them when closed, so a lookup is
+    one dict access however deep the scopes are nested.
+    """
+    def __init__(self):
+        self.bindings = {}
 
-    def add_symbol(self, s):
-        self.last_symbol_offset += s.data_type
+    def bind(self, key, s):
+        stack = self.bindings.get(key)
+        if stack is None:
+            self.bindings[key] = [s]
+        else:
+            stack.append(s)
 
-        self.symbols[s.name] = s
-        self.symbols[s.name].offset = self.last_symbol_offset
+    def rebind(self, key, s):
+        self.bindings[key][-1] = s
 
-        if self.last_symbol_offset - self.align_count * 16 >= 0:
-            self.align_count += 1
-            return True
-        return False
+    def unbind(self, key):
+        stack = self.bindings[key]
+        stack.pop()
+        if not stack:
+            del self.bindings[key]
 
-    def get_symbol(self, name):
-        if name in self.symbols.keys():
-            s = self.symbols[name]
+    def lookup(self, key):
+        stack = self.bindings.get(key)
+        return stack[-1] if stack else None
+
+
+class Scope:
+    def __init__(self, parent):
+        self.parent = parent
+        self.table = parent.table if parent else SymbolTable()
+
+        # name id -> symbol, for the symbols declared in this very scope
+        self.symbols = {}
+
+    def bind(self, s):
+        key = intern_name(s.name)
+        if key in self.symbols:
+            self.table.rebind(key, s)
         else:
-            s = None
+            self.table.bind(key, s)
+        self.symbols[key] = s
 
-        return s
+    def get_symbol(self, name):
+        key = NAME_IDS.get(name)
+        if key is None:
+            return None
+        return self.table.lookup(key)
 
     def close_context(self):
+        for key in self.symbols:
+            self.table.unbind(key)
+        self.symbols = {}
         return self.parent
 
     def __repr__(self):
-        return f"(STATIC {self.static_members} NONSTATIC {self.nonstatic_members})"
+        return repr(list(self.symbols.values()))
+
+
+class GlobalContext(Scope):
+    def __init__(self):
+        super().__init__(None)
+
+    def add_symbol(self, s):
+        s.is_global = True
+        self.bind(s)
+
+
+class FunctionContext(Scope):
+    """
+    The scope of a function body. Stack space for its locals is laid out
+    after compilation (frame.py), not while symbols are declared.
+    """
+    def __init__(self, name, parent):
+        super().__init__(parent)
+        self.name = name
+
+    def add_symbol(self, s):
+        self.bind(s)
+
+
+class BlockContext(Scope):
+    """
+    A nested scope inside a function, e.g. the body of an if. Its locals
+    live in the function's frame but are only visible inside the block.
+    """
+    def __init__(self, parent):
+        super().__init__(parent)
+
+    def add_symbol(self, s):
+        self.bind(s)
 
 
 class Symbol:
@@ -70,10 +135,10 @@ class Symbol:
         self.data_type = data_type
 
         self.is_global = False
-        self.offset = 0
-
-    def set_offset(self, offset):
-        self.offset = offset
+        # the ir.Local of a local variable
+        self.local = None
+        # the frame or global slot of a variable in bytecode
+        self.slot = None
 
     def __repr__(self):
         return f"NAME {self.name}, TYPE {self.data_type}"
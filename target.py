@@ -0,0 +1,95 @@
+import sys
+
+
+class MacOSTarget(object):
+    """
+    Mach-O executables linked against libSystem, whose start code calls
+    _main.
+    """
+    name = "macos"
+    object_format = "macho64"
+    has_libc = True
+    default_runtime = "printf"
+    default_assembler = "nasm"
+
+    sys_write = 0x2000004 # BSD syscall class
+    sys_exit = 0x2000001
+
+    @staticmethod
+    def symbol(name):
+        return "_" + name
+
+    def gen_entry(self, gen):
+        pass
+
+    @staticmethod
+    def build_commands(asmfn, objfn, outfn):
+        return [
+            ["nasm", "-f", MacOSTarget.object_format, asmfn],
+            ["ld", "-macosx_version_min", "10.13", objfn, "-o", outfn, "-lSystem"]
+        ]
+
+
+class LinuxTarget(object):
+    """
+    Static ELF64 executables without libc or a dynamic loader. _start
+    calls main and exits with a syscall.
+    """
+    name = "linux"
+    object_format = "elf64"
+    has_libc = False
+    default_runtime = "buffered"
+    default_assembler = "builtin"
+    entry = "_start"
+
+    sys_write = 1
+    sys_exit = 60
+
+    @staticmethod
+    def symbol(name):
+        return name
+
+    def gen_entry(self, gen):
+        gen.write_line("global " + self.entry)
+        gen.gen_label(self.entry)
+        gen.emit("call", self.symbol("main"))
+        gen.emit("mov", "eax", self.sys_exit)
+        gen.emit("xor", "edi", "edi")
+        gen.emit("syscall")
+        gen.write_line()
+
+    @staticmethod
+    def build_commands(asmfn, objfn, outfn):
+        return [
+            ["nasm", "-f", LinuxTarget.object_format, asmfn],
+            ["ld", "-static", objfn, "-o", outfn]
+        ]
+
+
+class JitTarget(LinuxTarget):
+    """
+    Code loaded into the compiler's own process by jit.py. The entry is
+    called through ctypes like a C function and returns after main
+    instead of exiting.
+    """
+    name = "jit"
+    entry = "oasis.jit_entry"
+
+    def gen_entry(self, gen):
+        gen.gen_label(self.entry)
+        # aligns the stack for main like _start's call does
+        gen.emit("push", "rbp")
+        gen.emit("call", self.symbol("main"))
+        gen.emit("pop", "rbp")
+        gen.emit("ret")
+        gen.write_line()
+
+
+TARGETS = {
+    "macos": MacOSTarget,
+    "linux": LinuxTarget
+}
+
+
+def host_target():
+    return "macos" if sys.platform == "darwin" else "linux"
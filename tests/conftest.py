@@ -0,0 +1,37 @@
+import os, sys, signal, subprocess
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from jit import jit_supported
+
+# the ways oasis run executes machine code, checked against the VM
+NATIVE_MODES = [
+    pytest.param([], id="native"),
+    pytest.param(["--jit"], id="jit",
+                 marks=pytest.mark.skipif(not jit_supported(), reason="--jit needs Linux on x86-64")),
+]
+
+
+@pytest.fixture
+def oasis(tmp_path):
+    """
+    oasis(source, *options) writes source to a file, runs oasis run on it
+    with the AST cache in tmp_path and returns the finished process.
+    """
+    env = dict(os.environ, OASIS_CACHE_DIR=str(tmp_path / "cache"))
+
+    def run(source, *options):
+        path = tmp_path / "program.oa"
+        path.write_text(source)
+        return subprocess.run([sys.executable, os.path.join(ROOT, "oasis.py"), "run", str(path)] + list(options),
+                              capture_output=True, text=True, cwd=tmp_path, env=env, timeout=60)
+    return run
+
+
+def trapped(result):
+    """
+    Whether a native or JIT run died of a division trap (SIGFPE).
+    """
+    return result.returncode == -signal.SIGFPE or "exited with -{}".format(int(signal.SIGFPE)) in result.stdout
@@ -0,0 +1,125 @@
+import os
+import pytest
+
+from arena import NodeArena
+from astcache import AstCache
+from lexer import Lexer
+from nodetypes import GlobalStatements
+from parser import Parser
+from source import SourceFile
+
+PROGRAM = """int g;
+int main() {
+    int x = 1 + 2 * (3 - g);
+    if (x < 10) print x; else { print -x; }
+}
+"""
+
+
+def source_of(text):
+    return SourceFile("test.oa", text)
+
+
+def parse(source):
+    arena = NodeArena(source)
+    stmts = Parser(Lexer("test.oa", source=source).iter_tokens()).iter_global_statements()
+    arena.root = arena.add_sequence(GlobalStatements, [arena.add_tree(stmt) for stmt in stmts])
+    return arena
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("OASIS_CACHE_DIR", str(tmp_path / "cache"))
+    return AstCache()
+
+
+def stored(cache, text):
+    source = source_of(text)
+    cache.store(source, parse(source))
+    return source, cache.path(cache.key(source))
+
+
+def test_cache_directory_comes_from_the_environment(cache, tmp_path):
+    assert cache.directory == str(tmp_path / "cache")
+
+
+def test_hit_returns_the_stored_tree(cache):
+    source, path = stored(cache, PROGRAM)
+    os.utime(path, (1000, 1000))
+
+    arena = cache.load(source_of(PROGRAM))
+    assert arena is not None
+    assert repr(arena.tree) == repr(parse(source).tree)
+    # hits count as a use for the eviction order
+    assert os.stat(path).st_mtime > 1000
+
+
+def test_miss(cache):
+    stored(cache, PROGRAM)
+    assert cache.load(source_of(PROGRAM + "int h;\n")) is None
+
+
+@pytest.mark.parametrize("length", [0, 3, 10, -200, -1])
+def test_truncated_entry_is_a_miss_and_deleted(cache, length):
+    source, path = stored(cache, PROGRAM)
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:length])
+
+    assert cache.load(source) is None
+    assert not os.path.exists(path)
+
+
+@pytest.mark.parametrize("offset", [0, 30, -1])
+def test_damaged_entry_is_a_miss_and_deleted(cache, offset):
+    # offset 0 breaks the magic, the others the checksummed body
+    source, path = stored(cache, PROGRAM)
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    data[offset] ^= 0xff
+    with open(path, "wb") as f:
+        f.write(data)
+
+    assert cache.load(source) is None
+    assert not os.path.exists(path)
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    cache.max_entries = 2
+    first, first_path = stored(cache, "int a;\n")
+    second, second_path = stored(cache, "int b;\n")
+    os.utime(first_path, (1000, 1000))
+    os.utime(second_path, (2000, 2000))
+
+    # using the older entry makes the other one the least recently used
+    assert cache.load(first) is not None
+    third, third_path = stored(cache, "int c;\n")
+
+    assert os.path.exists(first_path)
+    assert not os.path.exists(second_path)
+    assert os.path.exists(third_path)
+
+
+def test_entries_are_evicted_past_max_bytes(cache):
+    first, first_path = stored(cache, "int a;\n")
+    cache.max_bytes = os.stat(first_path).st_size + 1
+    os.utime(first_path, (1000, 1000))
+    second, second_path = stored(cache, "int b;\n")
+
+    assert not os.path.exists(first_path)
+    assert os.path.exists(second_path)
+
+
+def test_compiling_twice_uses_the_cache(oasis, tmp_path):
+    program = "int main() {\n    int x = 6;\n    print x * 7;\n}\n"
+    first = oasis(program, "--vm")
+    entries = os.listdir(tmp_path / "cache")
+    assert len(entries) == 1
+    path = tmp_path / "cache" / entries[0]
+    os.utime(path, (1000, 1000))
+
+    second = oasis(program, "--vm")
+    assert first.stdout == second.stdout == "42\n"
+    assert os.listdir(tmp_path / "cache") == entries
+    assert os.stat(path).st_mtime > 1000
@@ -0,0 +1,28 @@
+import pytest
+
+from conftest import NATIVE_MODES
+
+SIGNS = ["==", "!=", "<", "<=", ">", ">="]
+RIGHT = ["97", "353", "-159", "200", "128", "-128", "0", "255", "'a'", "'z'"]
+
+
+def comparison_program():
+    # every comparison of a char with a literal is printed twice, once
+    # compared at run time and once folded, as a byte of 0 or 1
+    lines = ["int main() {", "    char c = 'a';"]
+    for sign in SIGNS:
+        for right in RIGHT:
+            lines.append("    print c {} {};".format(sign, right))
+            lines.append("    print 'a' {} {};".format(sign, right))
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+@pytest.mark.parametrize("mode", [pytest.param(["--vm"], id="vm")] + NATIVE_MODES)
+def test_char_comparison_matches_folding(oasis, mode):
+    result = oasis(comparison_program(), "--no-cache", *mode)
+    out = result.stdout
+    assert len(out) == 2 * len(SIGNS) * len(RIGHT), out
+    assert out[0::2] == out[1::2]
+    # 'a' is compared by its low byte, so 353 and -159 are equal to it
+    assert out[2:4] == out[4:6] == "\x01\x01"
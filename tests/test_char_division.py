@@ -0,0 +1,36 @@
+import pytest
+
+from conftest import NATIVE_MODES
+
+# every quotient is printed twice, once computed at run time and once
+# folded from literals, and the two must agree
+PROGRAM = """
+int main() {
+    char a = 'd';
+    char b = 'd';
+    int n = 2;
+    int r = (a + b) / 2;
+    print r;
+    r = ('d' + 'd') / 2;
+    print r;
+    r = (a + b) / n;
+    print r;
+    r = ('d' + 'd') / 2;
+    print r;
+    r = (a + b) / (a - 'b');
+    print r;
+    r = ('d' + 'd') / ('d' - 'b');
+    print r;
+    r = 0 + (a + b) / 3;
+    print r;
+    r = 0 + ('d' + 'd') / 3;
+    print r;
+}
+"""
+
+
+@pytest.mark.parametrize("mode", [pytest.param(["--vm"], id="vm")] + NATIVE_MODES)
+def test_char_division_matches_folding(oasis, mode):
+    result = oasis(PROGRAM, "--no-cache", *mode)
+    lines = result.stdout.split()
+    assert lines == ["-28", "-28", "-28", "-28", "-28", "-28", "-18", "-18"], result.stdout + result.stderr
@@ -0,0 +1,60 @@
+from lexer import Lexer
+from parser import Parser
+from source import SourceFile
+
+PROGRAM = """int g;
+int main() {
+    int x = 1 + 2 * (3 - g);
+    if (x < 10) print x; else { print -x; }
+}
+char last;
+"""
+
+
+def lexer_for(text):
+    return Lexer("test.oa", source=SourceFile("test.oa", text))
+
+
+def test_streamed_tokens_parse_like_a_token_list():
+    streamed = Parser(lexer_for(PROGRAM).iter_tokens())
+    listed = Parser(lexer_for(PROGRAM).make_tokens())
+    assert [repr(stmt) for stmt in streamed.iter_global_statements()] == \
+           [repr(stmt) for stmt in listed.iter_global_statements()]
+    assert not streamed.error
+
+
+def test_tokens_are_pulled_one_statement_at_a_time():
+    pulled = []
+
+    def tokens():
+        for tok in lexer_for(PROGRAM).iter_tokens():
+            pulled.append(tok)
+            yield tok
+
+    stmts = Parser(tokens()).iter_global_statements()
+    next(stmts)
+    # int g ; and the token after it, which the parser is sitting on
+    assert len(pulled) == 4
+    next(stmts)
+    assert pulled[-1].value == "char"
+
+
+def test_parsing_stops_at_the_first_lexer_error(capsys):
+    lexer = lexer_for("int main() {\n    int x = 1 $ 2;\n    print x;\n}\n")
+    parser = Parser(lexer.iter_tokens(), lexer)
+    assert list(parser.iter_global_statements()) == []
+    assert lexer.error and parser.error
+
+    out = capsys.readouterr().out
+    assert out.count("Error:") == 1
+    assert "Unexpected character" in out
+
+
+def test_parsing_stops_at_an_unterminated_char(capsys):
+    lexer = lexer_for("int main() {\n    char c = 'a;\n}\n")
+    parser = Parser(lexer.iter_tokens(), lexer)
+    assert list(parser.iter_global_statements()) == []
+
+    out = capsys.readouterr().out
+    assert out.count("Error:") == 1
+    assert "apostroph" in out
@@ -0,0 +1,142 @@
+import pytest
+
+from conftest import NATIVE_MODES
+from compiler import Compiler
+from entrypoint import StatementStream
+from ir import *
+from regalloc import LinearScanAllocator, ALLOCATABLE, CALLEE_SAVED, DIV_CLOBBERS
+from sym import D_INT, GlobalContext
+
+
+def overlapping(intervals):
+    # a result may take over the register of an operand it is computed from
+    for i, a in enumerate(intervals):
+        for b in intervals[i + 1:]:
+            if a.start < b.end and b.start < a.end:
+                yield a, b
+
+
+def allocate(function):
+    allocator = LinearScanAllocator()
+    allocation = allocator.allocate(function)
+    intervals, _ = allocator.build_intervals(function)
+    # every vreg gets a register or a slot, never both, and values live
+    # at the same time never share either
+    for iv in intervals:
+        assert (iv.vreg in allocation.regs) != (iv.vreg in allocation.slots)
+    for a, b in overlapping(intervals):
+        if a.vreg in allocation.regs and b.vreg in allocation.regs:
+            assert allocation.regs[a.vreg] != allocation.regs[b.vreg], (a, b)
+        if a.vreg in allocation.slots and b.vreg in allocation.slots:
+            assert allocation.slots[a.vreg] != allocation.slots[b.vreg], (a, b)
+    return allocation
+
+
+def new_function():
+    function = IRFunction("f")
+    return function, IRBuilder(IRModule(), function)
+
+
+def test_more_live_values_than_registers_spill():
+    function, builder = new_function()
+    values = [builder.emit_value(I_CONST, (Imm(i),), D_INT) for i in range(len(ALLOCATABLE) + 4)]
+    total = values[0]
+    for v in values[1:]:
+        total = builder.emit_value(I_ADD, (total, v), D_INT)
+    builder.emit_effect(I_PRINT, (total,), D_INT)
+    builder.emit_effect(I_RET)
+
+    allocation = allocate(function)
+    assert allocation.slots
+    assert set(allocation.regs.values()) <= set(ALLOCATABLE)
+
+
+def test_values_live_across_print_get_callee_saved_registers():
+    function, builder = new_function()
+    kept = [builder.emit_value(I_CONST, (Imm(i),), D_INT) for i in range(3)]
+    printed = builder.emit_value(I_CONST, (Imm(7),), D_INT)
+    builder.emit_effect(I_PRINT, (printed,), D_INT)
+    total = kept[0]
+    for v in kept[1:]:
+        total = builder.emit_value(I_ADD, (total, v), D_INT)
+    builder.emit_effect(I_PRINT, (total,), D_INT)
+    builder.emit_effect(I_RET)
+
+    allocation = allocate(function)
+    for v in kept:
+        assert v in allocation.slots or allocation.regs[v] in CALLEE_SAVED
+        assert v in allocation.slots or allocation.regs[v] in allocation.saved
+
+
+def test_values_live_across_division_stay_out_of_rax_and_rdx():
+    function, builder = new_function()
+    kept = [builder.emit_value(I_CONST, (Imm(i),), D_INT) for i in range(8)]
+    quotient = builder.emit_value(I_DIV, (kept[0], kept[1]), D_INT)
+    total = quotient
+    for v in kept:
+        total = builder.emit_value(I_ADD, (total, v), D_INT)
+    builder.emit_effect(I_PRINT, (total,), D_INT)
+    builder.emit_effect(I_RET)
+
+    allocation = allocate(function)
+    for v in kept:
+        assert allocation.regs.get(v) not in DIV_CLOBBERS
+
+
+def chain(depth, ops):
+    """
+    (x = x + 1) op ((x = x + 2) op (...)), every left operand assigns so it
+    is evaluated first and stays live until the end of the expression.
+    """
+    expr = "(x = x + {})".format(depth)
+    for i in range(depth - 1, 0, -1):
+        op = ops[i % len(ops)]
+        if op == "/":
+            expr = "(x = x + {}) + (({}) / w)".format(i, expr)
+        else:
+            expr = "(x = x + {}) {} ({})".format(i, op, expr)
+    return expr
+
+
+PROGRAMS = {
+    "spills": ["+", "-", "*"],
+    "divisions": ["+", "/", "-", "/", "*"],
+}
+
+
+def program(ops):
+    lines = ["int main() {", "    int x = 5;", "    int w = -3;", "    int r = 0;"]
+    for depth in (3, 12, 16, 24):
+        lines.append("    r = {};".format(chain(depth, ops)))
+        lines.append("    print r;")
+        lines.append("    print x;")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def codegen_of(path):
+    compiler = Compiler(None)
+    context = GlobalContext()
+    for stmt in StatementStream(str(path), False):
+        compiler.visit(stmt, context)
+        assert not compiler.error
+        compiler.flush()
+    return compiler.codegen
+
+
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+def test_chains_spill(tmp_path, name):
+    path = tmp_path / "program.oa"
+    path.write_text(program(PROGRAMS[name]))
+    assert codegen_of(path).allocation.slots
+
+
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+@pytest.mark.parametrize("mode", NATIVE_MODES)
+def test_chains_match_vm(oasis, mode, name):
+    source = program(PROGRAMS[name])
+    expected = oasis(source, "--no-cache", "--vm")
+    assert "ERROR" not in expected.stdout and len(expected.stdout.split()) == 8, expected.stdout
+
+    result = oasis(source, "--no-cache", *mode)
+    assert result.stdout == expected.stdout, result.stderr
@@ -0,0 +1,102 @@
+import pytest
+
+from conftest import NATIVE_MODES, trapped
+from fold import wrap, div_trunc
+from sym import D_INT
+from strength import log2_exact, signed_magic
+
+INT_MIN = -2 ** 31
+INT_MAX = 2 ** 31 - 1
+
+DIVIDENDS = [0, 1, -1, 2, -2, 3, -3, 6, -6, 7, -7, 100, -100, 65535, -65536,
+             INT_MAX, INT_MAX - 1, INT_MIN, INT_MIN + 1]
+MAGIC_DIVISORS = [3, -3, 5, -5, 6, 7, -7, 10, -10, 641, 1000, 65537, INT_MAX, -INT_MAX, INT_MAX - 1]
+
+
+def magic_divide(n, d):
+    """
+    n / d the way gen_div_const computes it with signed_magic.
+    """
+    m, s = signed_magic(d)
+    q = (n * m) >> 32
+    if d > 0 and m < 0:
+        q += n
+    elif d < 0 and m > 0:
+        q -= n
+    q = wrap(q, D_INT) >> s
+    return q + (q < 0)
+
+
+@pytest.mark.parametrize("value, k", [(2, 1), (4, 2), (2 ** 30, 30), (2 ** 31, 31), (2 ** 32, 32),
+                                      (0, None), (1, None), (3, None), (6, None), (-2, None), (INT_MAX, None)])
+def test_log2_exact(value, k):
+    assert log2_exact(value) == k
+
+
+@pytest.mark.parametrize("d", MAGIC_DIVISORS)
+def test_signed_magic_divides_like_idiv(d):
+    for n in DIVIDENDS:
+        assert magic_divide(n, d) == div_trunc(n, d), (n, d)
+
+
+@pytest.mark.parametrize("d", [0, 1, -1, INT_MIN, 2 ** 31, 2 ** 32 + 2, -2 ** 32 - 1])
+def test_signed_magic_rejects_divisors_out_of_range(d):
+    with pytest.raises(ValueError):
+        signed_magic(d)
+
+
+# divisors and multipliers around the edges of each sequence, including
+# ones that only make sense once they are cut to 32 bits
+DIVISORS = ["2", "-2", "3", "-3", "7", "-7", "1", "8", "-8", "1000", "1073741824", "2147483647",
+            "-2147483648", "2147483648", "4294967297", "4294967298", "4294967293"]
+MULTIPLIERS = ["0", "1", "-1", "2", "-2", "3", "-3", "5", "9", "-9", "7", "-7", "10", "65536",
+               "2147483647", "-2147483648", "2147483648", "4294967296", "4294967297", "4294967299"]
+
+
+def arithmetic_program():
+    lines = ["int main() {", "    int x = 0;"]
+    for n in DIVIDENDS:
+        lines.append("    x = {};".format(n) if n >= 0 else "    x = 0 - {};".format(-n))
+        lines.extend("    print x / {};".format(d) for d in DIVISORS)
+        lines.extend("    print x * {};".format(m) for m in MULTIPLIERS)
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+@pytest.mark.parametrize("mode", NATIVE_MODES)
+def test_constant_operands_match_vm(oasis, mode):
+    program = arithmetic_program()
+    expected = oasis(program, "--no-cache", "--vm")
+    assert expected.returncode == 0 and "ERROR" not in expected.stdout, expected.stdout
+    assert len(expected.stdout.split()) == len(DIVIDENDS) * (len(DIVISORS) + len(MULTIPLIERS))
+
+    result = oasis(program, "--no-cache", *mode)
+    assert result.stdout == expected.stdout, result.stderr
+
+
+TRAPS = [
+    ("int x = 3;", "x / 0", "division by zero"),
+    ("int x = 3;", "x / 4294967296", "division by zero"),
+    ("int x = 0 - 2147483647 - 1;", "x / -1", "division overflow"),
+    ("int x = 0 - 2147483647 - 1;", "x / 4294967295", "division overflow"),
+]
+
+
+@pytest.mark.parametrize("setup, quotient, message", TRAPS)
+@pytest.mark.parametrize("mode", NATIVE_MODES)
+def test_division_by_constant_still_traps(oasis, mode, setup, quotient, message):
+    # enough values live across the division to want eax and edx
+    program = """
+int main() {{
+    {}
+    int a = x + 1;
+    int b = x + 2;
+    int c = x + 3;
+    print {};
+    print a + b + c;
+}}
+""".format(setup, quotient)
+    expected = oasis(program, "--no-cache", "--vm")
+    assert message in expected.stdout
+
+    assert trapped(oasis(program, "--no-cache", *mode))
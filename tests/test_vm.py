@@ -0,0 +1,126 @@
+import pytest
+
+from conftest import NATIVE_MODES, trapped
+from bytecode import BytecodeCompiler, FUSIONS, OPCODE_NAMES, OPERAND_COUNTS
+from entrypoint import StatementStream
+
+# one statement or more for every sequence in FUSIONS
+FUSED = """int g;
+int main() {
+    int a = 7;
+    int b = a;
+    int d = 0;
+    d = a + b;
+    print d;
+    d = a + 2147483647;
+    print d;
+    d = d - 1;
+    print d;
+    print a + 5 - 3;
+    print a * b;
+    if (a == b) print 1; else print 0;
+    if (a != b) print 1; else print 0;
+    if (a < d) print 1; else print 0;
+    if (a <= b) print 1; else print 0;
+    if (a > d) print 1; else print 0;
+    if (a >= b) print 1; else print 0;
+    d = 0 - 2147483647 - 1;
+    d = d - 2147483647;
+    print d;
+    g = a;
+    g = g + a;
+    print g;
+}
+"""
+
+# wraparound, rounding of divisions and chars cut to their low byte
+SEMANTICS = """int main() {
+    int m = 0 - 2147483647 - 1;
+    int n = 0 - m;
+    print n;
+    print m - 1;
+    print m * 2;
+    int big = 65536;
+    print big * big;
+    print big * 32768;
+    int s = 7;
+    int t = 0 - 2;
+    print s / t;
+    print (0 - s) / 2;
+    print (0 - s) / t;
+    print m / 2;
+    print m / 3;
+    char c = 'a' + 200;
+    int i = c;
+    print i;
+    c = 300;
+    i = c;
+    print i;
+    if (c == 44) print 1; else print 0;
+    if (c < 'b') print 1; else print 0;
+    char e = 200;
+    i = e + 0;
+    print i;
+    i = e * 2;
+    print i;
+    if (e < 0) print 1; else print 0;
+}
+"""
+
+SEMANTICS_OUTPUT = [-2147483648, 2147483647, 0, 0, -2147483648,
+                    -3, -3, 3, -1073741824, -715827882,
+                    41, 44, 1, 1,
+                    -56, -112, 1]
+
+PROGRAMS = {"fused": FUSED, "semantics": SEMANTICS}
+
+
+def opcodes_of(program):
+    used = set()
+    for function in program.functions.values():
+        code = function.code
+        pc = 0
+        while pc < len(code):
+            used.add(code[pc])
+            pc += 1 + OPERAND_COUNTS[code[pc]]
+    return used
+
+
+def test_every_fusion_is_used(tmp_path):
+    path = tmp_path / "program.oa"
+    path.write_text(FUSED)
+    program = BytecodeCompiler().compile(StatementStream(str(path), False))
+    used = opcodes_of(program)
+    for _, fused, _ in FUSIONS:
+        assert fused in used, OPCODE_NAMES[fused]
+
+
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+@pytest.mark.parametrize("mode", NATIVE_MODES)
+def test_vm_matches_native(oasis, mode, name):
+    expected = oasis(PROGRAMS[name], "--no-cache", "--vm")
+    assert "ERROR" not in expected.stdout, expected.stdout
+
+    result = oasis(PROGRAMS[name], "--no-cache", *mode)
+    assert result.stdout == expected.stdout, result.stderr
+
+
+@pytest.mark.parametrize("mode", [pytest.param(["--vm"], id="vm")] + NATIVE_MODES)
+def test_semantics(oasis, mode):
+    result = oasis(SEMANTICS, "--no-cache", *mode)
+    assert [int(line) for line in result.stdout.split()] == SEMANTICS_OUTPUT
+
+
+@pytest.mark.parametrize("divisor", ["z", "z * 5", "(z = 0)"])
+@pytest.mark.parametrize("mode", NATIVE_MODES)
+def test_division_by_zero(oasis, mode, divisor):
+    program = """int main() {{
+    int x = 12;
+    int z = 0;
+    print x / {};
+}}
+""".format(divisor)
+    result = oasis(program, "--no-cache", "--vm")
+    assert "division by zero" in result.stdout
+
+    assert trapped(oasis(program, "--no-cache", *mode))
@@ -0,0 +1,52 @@
+import pytest
+
+from asm import AsmInstr, Directive
+from x86 import Assembler
+
+# instruction -> the bytes GNU as 2.40 encodes it as with .intel_syntax,
+# including the short forms it picks for al, ax, eax and rax
+GNU_AS = [
+    (("add", "eax", "1000"), "05 e8 03 00 00"),
+    (("add", "eax", "8"), "83 c0 08"),
+    (("add", "ecx", "1000"), "81 c1 e8 03 00 00"),
+    (("sub", "rax", "4096"), "48 2d 00 10 00 00"),
+    (("cmp", "al", "10"), "3c 0a"),
+    (("and", "ax", "255"), "66 25 ff 00"),
+    (("xor", "eax", "-100000"), "35 60 79 fe ff"),
+    (("cmp", "eax", "-1"), "83 f8 ff"),
+    (("or", "r8d", "1000"), "41 81 c8 e8 03 00 00"),
+    (("test", "al", "1"), "a8 01"),
+    (("test", "eax", "256"), "a9 00 01 00 00"),
+    (("test", "ecx", "256"), "f7 c1 00 01 00 00"),
+    (("test", "rax", "1"), "48 a9 01 00 00 00"),
+    (("test", "eax", "eax"), "85 c0"),
+    (("add", "dword [rbp - 4]", "1000"), "81 45 fc e8 03 00 00"),
+    (("cmp", "byte [rbp - 1]", "122"), "80 7d ff 7a"),
+    (("sub", "rsp", "16"), "48 83 ec 10"),
+    (("mov", "eax", "1000"), "b8 e8 03 00 00"),
+    (("mov", "al", "-56"), "b0 c8"),
+    (("mov", "byte [rbp - 1]", "200"), "c6 45 ff c8"),
+    (("mov", "qword [rsp + 8]", "r12"), "4c 89 64 24 08"),
+    (("mov", "ecx", "dword [r13]"), "41 8b 4d 00"),
+    (("movsx", "eax", "byte [rbp - 1]"), "0f be 45 ff"),
+    (("movsx", "ecx", "sil"), "40 0f be ce"),
+    (("lea", "rax", "[rax + rcx * 4]"), "48 8d 04 88"),
+    (("imul", "ecx", "eax", "10"), "6b c8 0a"),
+    (("imul", "eax", "ecx"), "0f af c1"),
+    (("idiv", "ecx"), "f7 f9"),
+    (("neg", "eax"), "f7 d8"),
+    (("sar", "eax", "31"), "c1 f8 1f"),
+    (("shl", "ecx", "1"), "d1 e1"),
+    (("sete", "al"), "0f 94 c0"),
+    (("setl", "dil"), "40 0f 9c c7"),
+    (("push", "rbp"), "55"),
+    (("pop", "r12"), "41 5c"),
+    (("cdq",), "99"),
+    (("ret",), "c3"),
+]
+
+
+@pytest.mark.parametrize("operands, expected", GNU_AS)
+def test_encoding_matches_gnu_as(operands, expected):
+    code = Assembler().assemble([Directive("section .text"), AsmInstr(*operands)])
+    assert bytes(code.text).hex(" ") == expected
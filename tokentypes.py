@@ -1,3 +1,7 @@
+from array import array
+import marshal
+import struct
+
 T_INTLIT = "INTLIT"
 T_CHARLIT = "CHARLIT"
 T_PLUS = "PLUS"
@@ -27,6 +31,14 @@ keywords = [
     "else"
 ]
 
+# small integer codes for the token types, used by TokenBuffer
+TOKEN_TYPES = [
+    T_INTLIT, T_CHARLIT, T_PLUS, T_MINUS, T_ASTERISK, T_SLASH, T_LPAREN,
+    T_RPAREN, T_LCURLY, T_RCURLY, T_EQ, T_DEQ, T_NEQ, T_LT, T_LTE, T_GT,
+    T_GTE, T_SEMICOLON, T_EOF, T_IDENTIFIER, T_KEYWORD, T_TYPE
+]
+TOKEN_CODES = {t: code for code, t in enumerate(TOKEN_TYPES)}
+
 types = [
     "int",
     "char",
@@ -35,14 +47,22 @@ types = [
 
 
 class Token(object):
-    def __init__(self, _type, value, pos_start, pos_end=None):
+    __slots__ = ("type", "value", "start", "end", "source")
+
+    def __init__(self, _type, value, start, end, source):
         self.type = _type
         self.value = value
-        self.pos_start = pos_start
-        self.pos_end = pos_end
-        if not self.pos_end:
-            self.pos_end = self.pos_start.copy()
-            self.pos_end.advance('')
+        self.start = start
+        self.end = end
+        self.source = source
+
+    @property
+    def pos_start(self):
+        return self.source.position(self.start)
+
+    @property
+    def pos_end(self):
+        return self.source.position(self.end)
 
     def match(self, _type, value):
         if self.type == _type and self.value == value:
@@ -52,3 +72,131 @@ class Token(object):
     
     def __repr__(self):
         return f"TYPE: {self.type} & VALUE: {self.value}"
+
+
+class TokenBuffer(object):
+    """
+    Compact token store: one parallel array per field instead of one
+    object per token. Values (identifiers, numbers, ...) are interned and
+    referenced by index, index 0 being None.
+    """
+    HEADER = struct.Struct("<4sII")
+    MAGIC = b"OTOK"
+
+    def __init__(self, source=None):
+        self.source = source
+
+        self.types = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+        self.value_ids = array('I')
+
+        self.values = [None]
+        self.value_index = {None: 0}
+
+    def append(self, _type, value, start, end):
+        idx = self.value_index.get(value)
+        if idx is None:
+            idx = self.value_index[value] = len(self.values)
+            self.values.append(value)
+
+        self.types.append(TOKEN_CODES[_type])
+        self.starts.append(start)
+        self.ends.append(end)
+        self.value_ids.append(idx)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.types)
+        if not 0 <= i < len(self.types):
+            raise IndexError("token index out of range")
+        return TokenView(self, i)
+
+    def __iter__(self):
+        for i in range(len(self.types)):
+            yield TokenView(self, i)
+
+    def to_bytes(self):
+        values = marshal.dumps(self.values)
+        return b"".join((
+            self.HEADER.pack(self.MAGIC, len(self.types), len(values)),
+            self.types.tobytes(),
+            self.starts.tobytes(),
+            self.ends.tobytes(),
+            self.value_ids.tobytes(),
+            values
+        ))
+
+    @classmethod
+    def from_bytes(cls, data, source=None):
+        magic, count, values_len = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError("Not a token buffer")
+
+        buf = cls(source)
+        offset = cls.HEADER.size
+        for column in (buf.types, buf.starts, buf.ends, buf.value_ids):
+            size = count * column.itemsize
+            column.frombytes(data[offset:offset + size])
+            offset += size
+
+        buf.values = marshal.loads(data[offset:offset + values_len])
+        buf.value_index = {v: i for i, v in enumerate(buf.values)}
+
+        return buf
+
+    def __getstate__(self):
+        # the source references the whole file text, don't ship it along
+        return self.to_bytes()
+
+    def __setstate__(self, state):
+        other = self.from_bytes(state)
+        self.__dict__.update(other.__dict__)
+
+
+class TokenView(object):
+    """
+    Read-only, Token-compatible window onto one entry of a TokenBuffer.
+    """
+    __slots__ = ("buf", "i")
+
+    def __init__(self, buf, i):
+        self.buf = buf
+        self.i = i
+
+    @property
+    def type(self):
+        return TOKEN_TYPES[self.buf.types[self.i]]
+
+    @property
+    def value(self):
+        return self.buf.values[self.buf.value_ids[self.i]]
+
+    @property
+    def start(self):
+        return self.buf.starts[self.i]
+
+    @property
+    def end(self):
+        return self.buf.ends[self.i]
+
+    @property
+    def source(self):
+        return self.buf.source
+
+    @property
+    def pos_start(self):
+        return self.buf.source.position(self.start)
+
+    @property
+    def pos_end(self):
+        return self.buf.source.position(self.end)
+
+    def match(self, _type, value):
+        return self.type == _type and self.value == value
+
+    def __repr__(self):
+        return f"TYPE: {self.type} & VALUE: {self.value}"
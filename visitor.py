@@ -0,0 +1,136 @@
+# the operands of the expression nodes, in source order
+EXPRESSION_OPERANDS = {
+    "BinaryOperationNode": ("left_node", "right_node"),
+    "UnaryOperationNode": ("right_node",),
+    "VarAssignNode": ("expr",)
+}
+
+
+def iter_children(node):
+    """
+    Yields the child nodes of node, statement lists yield their items.
+    Missing children (None) are skipped.
+    """
+    fields = getattr(node, "_children", None)
+    if fields is None:
+        children = node
+    else:
+        children = (getattr(node, name) for name in fields)
+
+    for child in children:
+        if child is not None:
+            yield child
+
+
+class Visitor(object):
+    """
+    Base class for passes over the syntax tree.
+
+    visit() dispatches to visit_<NodeClassName>(node, context). The method
+    for each node class is looked up only once per pass and kept in a
+    type -> bound method table, classes without a visit method get
+    generic_visit. Passes can override pre_visit/post_visit to run code
+    before and after every node; the hooks are only wrapped around the
+    dispatch when a subclass actually defines them.
+
+    Expressions can be walked with visit_expression() instead, which
+    needs no recursion.
+    """
+    # passes that report errors set this, visit_expression stops there
+    error = 0
+
+    def __init__(self):
+        self.dispatch = {}
+        self.exits = {}
+
+    def visit(self, node, context=None):
+        try:
+            method = self.dispatch[node.__class__]
+        except KeyError:
+            method = self.bind(node.__class__)
+        return method(node, context)
+
+    def bind(self, cls):
+        method = getattr(self, "visit_" + cls.__name__, self.generic_visit)
+
+        pre = self.pre_visit if type(self).pre_visit is not Visitor.pre_visit else None
+        post = self.post_visit if type(self).post_visit is not Visitor.post_visit else None
+        if pre or post:
+            method = self.with_hooks(method, pre, post)
+
+        self.dispatch[cls] = method
+        return method
+
+    @staticmethod
+    def with_hooks(method, pre, post):
+        def hooked(node, context):
+            if pre:
+                pre(node, context)
+            result = method(node, context)
+            if post:
+                result = post(node, context, result)
+            return result
+        return hooked
+
+    def visit_expression(self, root, context):
+        """
+        Visits the expression root bottom up with an explicit stack, so
+        long operator chains don't run into the recursion limit. A node
+        the pass has an exit_<NodeClassName>(node, context, *operands)
+        method for gets the results of its operands, visited first in
+        operand_order(); everything else goes through visit(). Returns
+        the result of root, or the first one that came with an error.
+        """
+        results = []
+        stack = [(root, None, None)]
+        while stack:
+            node, parent, order = stack.pop()
+            if order is None:
+                if self.exit_method(node) is not None:
+                    order = self.operand_order(node)
+                    stack.append((node, parent, order))
+                    stack.extend((getattr(node, name), (node, name), None) for name in reversed(order))
+                    continue
+                result = self.visit(node, context)
+            else:
+                operands = dict(zip(order, results[-len(order):]))
+                del results[-len(order):]
+                names = EXPRESSION_OPERANDS[type(node).__name__]
+                result = self.exit_method(node)(node, context, *(operands[name] for name in names))
+
+            if self.error:
+                return result
+            if parent is not None:
+                self.after_operand(parent[0], parent[1], result, context)
+            results.append(result)
+
+        return results[0]
+
+    def exit_method(self, node):
+        try:
+            return self.exits[node.__class__]
+        except KeyError:
+            name = node.__class__.__name__
+            method = getattr(self, "exit_" + name, None) if name in EXPRESSION_OPERANDS else None
+            self.exits[node.__class__] = method
+            return method
+
+    def operand_order(self, node):
+        return EXPRESSION_OPERANDS[type(node).__name__]
+
+    def after_operand(self, node, name, result, context):
+        pass
+
+    def pre_visit(self, node, context):
+        pass
+
+    def post_visit(self, node, context, result):
+        return result
+
+    def visit_NoneType(self, node, context):
+        # empty statements are stored as None
+        return None
+
+    def generic_visit(self, node, context):
+        for child in iter_children(node):
+            self.visit(child, context)
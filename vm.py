@@ -0,0 +1,235 @@
+import operator, sys
+
+from bytecode import *
+from runtime import OUTPUT_BUFFER_SIZE
+
+
+class VMError(Exception):
+    pass
+
+
+def wrap32(value):
+    return ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+# the comparison opcodes, their compare and jump superinstructions and
+# what they test
+COMPARISON_TESTS = [
+    (B_EQ, B_JNEQ, operator.eq),
+    (B_NE, B_JNNE, operator.ne),
+    (B_LT, B_JNLT, operator.lt),
+    (B_LE, B_JNLE, operator.le),
+    (B_GT, B_JNGT, operator.gt),
+    (B_GE, B_JNGE, operator.ge)
+]
+
+
+class VM(object):
+    """
+    Runs a BytecodeProgram. Each function call gets a fresh frame list
+    and operand stack; every instruction is a closure over them, looked
+    up in a table indexed by opcode, that returns the next pc (-1 to
+    return). Output is buffered like the native runtime and written to
+    out, a binary file.
+    """
+    def __init__(self, program, out=None):
+        self.program = program
+        self.globals = [0] * program.global_count
+        self.out = out if out is not None else sys.stdout.buffer
+        self.output = bytearray()
+
+    def run(self, name="main"):
+        function = self.program.functions.get(name)
+        if function is None:
+            raise VMError("no function {}".format(name))
+        try:
+            self.call(function)
+        finally:
+            self.flush()
+
+    def flush(self):
+        if self.output:
+            self.out.write(self.output)
+            self.out.flush()
+            self.output.clear()
+
+    def call(self, function):
+        # ints in a list index faster than in the compact array
+        code = function.code.tolist()
+        frame = [0] * function.frame_size
+        globals_ = self.globals
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        output = self.output
+        vm = self
+
+        def const(pc):
+            push(code[pc + 1])
+            return pc + 2
+
+        def load(pc):
+            push(frame[code[pc + 1]])
+            return pc + 2
+
+        def store(pc):
+            frame[code[pc + 1]] = pop()
+            return pc + 2
+
+        def gload(pc):
+            push(globals_[code[pc + 1]])
+            return pc + 2
+
+        def gstore(pc):
+            globals_[code[pc + 1]] = pop()
+            return pc + 2
+
+        def dup(pc):
+            push(stack[-1])
+            return pc + 1
+
+        def pop_(pc):
+            pop()
+            return pc + 1
+
+        def add(pc):
+            b = pop()
+            stack[-1] = ((stack[-1] + b + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+            return pc + 1
+
+        def sub(pc):
+            b = pop()
+            stack[-1] = ((stack[-1] - b + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+            return pc + 1
+
+        def mul(pc):
+            b = pop()
+            stack[-1] = ((stack[-1] * b + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+            return pc + 1
+
+        def div(pc):
+            b = pop()
+            a = stack[-1]
+            if b == 0:
+                raise VMError("division by zero")
+            if a == -0x80000000 and b == -1:
+                raise VMError("division overflow")
+            # rounded towards zero like idiv
+            q = abs(a) // abs(b)
+            stack[-1] = q if (a < 0) == (b < 0) else -q
+            return pc + 1
+
+        def neg(pc):
+            stack[-1] = wrap32(-stack[-1])
+            return pc + 1
+
+        def char(pc):
+            stack[-1] = ((stack[-1] + 0x80) & 0xFF) - 0x80
+            return pc + 1
+
+        def comparison(test):
+            def compare(pc):
+                b = pop()
+                stack[-1] = int(test(stack[-1], b))
+                return pc + 1
+            return compare
+
+        def jump_unless(test):
+            def jump(pc):
+                b = pop()
+                return pc + 2 if test(pop(), b) else code[pc + 1]
+            return jump
+
+        def jmp(pc):
+            return code[pc + 1]
+
+        def jz(pc):
+            return code[pc + 1] if pop() == 0 else pc + 2
+
+        def print_int(pc):
+            output.extend(b"%d\n" % pop())
+            if len(output) >= OUTPUT_BUFFER_SIZE:
+                vm.flush()
+            return pc + 1
+
+        def print_char(pc):
+            output.append(pop() & 0xFF)
+            if len(output) >= OUTPUT_BUFFER_SIZE:
+                vm.flush()
+            return pc + 1
+
+        def ret(pc):
+            return -1
+
+        def add_const(pc):
+            stack[-1] = ((stack[-1] + code[pc + 1] + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+            return pc + 2
+
+        def const_store(pc):
+            frame[code[pc + 2]] = code[pc + 1]
+            return pc + 3
+
+        def load_store(pc):
+            frame[code[pc + 2]] = frame[code[pc + 1]]
+            return pc + 3
+
+        def load_load(pc):
+            push(frame[code[pc + 1]])
+            push(frame[code[pc + 2]])
+            return pc + 3
+
+        def load_add_store(pc):
+            frame[code[pc + 3]] = ((frame[code[pc + 1]] + frame[code[pc + 2]] + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+            return pc + 4
+
+        def load_const_add_store(pc):
+            frame[code[pc + 3]] = ((frame[code[pc + 1]] + code[pc + 2] + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+            return pc + 4
+
+        def load_print_int(pc):
+            output.extend(b"%d\n" % frame[code[pc + 1]])
+            if len(output) >= OUTPUT_BUFFER_SIZE:
+                vm.flush()
+            return pc + 2
+
+        handlers = [None] * len(OPCODE_NAMES)
+        handlers[B_CONST] = const
+        handlers[B_LOAD] = load
+        handlers[B_STORE] = store
+        handlers[B_GLOAD] = gload
+        handlers[B_GSTORE] = gstore
+        handlers[B_DUP] = dup
+        handlers[B_POP] = pop_
+        handlers[B_ADD] = add
+        handlers[B_SUB] = sub
+        handlers[B_MUL] = mul
+        handlers[B_DIV] = div
+        handlers[B_NEG] = neg
+        handlers[B_CHAR] = char
+        handlers[B_JMP] = jmp
+        handlers[B_JZ] = jz
+        handlers[B_PRINT_INT] = print_int
+        handlers[B_PRINT_CHAR] = print_char
+        handlers[B_RET] = ret
+        handlers[B_ADD_CONST] = add_const
+        handlers[B_CONST_STORE] = const_store
+        handlers[B_LOAD_STORE] = load_store
+        handlers[B_LOAD_LOAD] = load_load
+        handlers[B_LOAD_ADD_STORE] = load_add_store
+        handlers[B_LOAD_CONST_ADD_STORE] = load_const_add_store
+        handlers[B_LOAD_PRINT_INT] = load_print_int
+        for compare_op, jump_op, test in COMPARISON_TESTS:
+            handlers[compare_op] = comparison(test)
+            handlers[jump_op] = jump_unless(test)
+
+        # the handler of every instruction is looked up once, so the loop
+        # is a single list index and call per instruction
+        dispatch = [None] * len(code)
+        pc = 0
+        while pc < len(code):
+            dispatch[pc] = handlers[code[pc]]
+            pc += 1 + OPERAND_COUNTS[code[pc]]
+
+        pc = 0
+        while pc >= 0:
+            pc = dispatch[pc](pc)
@@ -0,0 +1,545 @@
+import re
+
+from asm import AsmInstr, Label, Directive, Reserve
+
+# Encodes the structured assembly of the CodeGenerator (asm.py) into
+# x86-64 machine code, for the subset of NASM syntax the generator and
+# the runtimes emit. elf.py writes the result into object files and
+# executables.
+
+
+class AssemblerError(Exception):
+    pass
+
+
+class Register(object):
+    __slots__ = ("name", "number", "size")
+
+    def __init__(self, name, number, size):
+        self.name = name
+        self.number = number
+        self.size = size
+
+    @property
+    def needs_rex(self):
+        # spl, bpl, sil and dil are ah, ch, dh and bh without a REX prefix
+        return self.size == 1 and 4 <= self.number < 8
+
+
+class Memory(object):
+    """
+    [base + index * scale + disp], or [rel symbol + disp].
+    """
+    __slots__ = ("size", "base", "index", "scale", "disp", "symbol")
+
+    def __init__(self, size):
+        self.size = size
+        self.base = None
+        self.index = None
+        self.scale = 1
+        self.disp = 0
+        self.symbol = None
+
+
+class Immediate(object):
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+REGISTERS = {}
+for number, names in enumerate([
+        ("rax", "eax", "ax", "al"), ("rcx", "ecx", "cx", "cl"),
+        ("rdx", "edx", "dx", "dl"), ("rbx", "ebx", "bx", "bl"),
+        ("rsp", "esp", "sp", "spl"), ("rbp", "ebp", "bp", "bpl"),
+        ("rsi", "esi", "si", "sil"), ("rdi", "edi", "di", "dil")] +
+        [("r%d" % n, "r%dd" % n, "r%dw" % n, "r%db" % n) for n in range(8, 16)]):
+    for size, name in zip((8, 4, 2, 1), names):
+        REGISTERS[name] = Register(name, number, size)
+
+SIZE_NAMES = {
+    "byte": 1,
+    "word": 2,
+    "dword": 4,
+    "qword": 8
+}
+
+CONDITION_CODES = {
+    "o": 0x0, "no": 0x1, "b": 0x2, "c": 0x2, "nae": 0x2, "ae": 0x3, "nb": 0x3,
+    "nc": 0x3, "e": 0x4, "z": 0x4, "ne": 0x5, "nz": 0x5, "be": 0x6, "na": 0x6,
+    "a": 0x7, "nbe": 0x7, "s": 0x8, "ns": 0x9, "p": 0xA, "pe": 0xA, "np": 0xB,
+    "po": 0xB, "l": 0xC, "nge": 0xC, "ge": 0xD, "nl": 0xD, "le": 0xE, "ng": 0xE,
+    "g": 0xF, "nle": 0xF
+}
+
+# the /digit in the ModRM byte of each instruction group
+ALU_CODES = {"add": 0, "or": 1, "and": 4, "sub": 5, "xor": 6, "cmp": 7}
+SHIFT_CODES = {"shl": 4, "sal": 4, "shr": 5, "sar": 7}
+UNARY_CODES = {"not": 2, "neg": 3, "mul": 4, "div": 6, "idiv": 7}
+
+# instructions without operands
+FIXED_ENCODINGS = {
+    "ret": b"\xc3",
+    "cdq": b"\x99",
+    "cqo": b"\x48\x99",
+    "nop": b"\x90",
+    "syscall": b"\x0f\x05",
+    "rep movsb": b"\xf3\xa4"
+}
+
+TERM = re.compile(r"([+-]?)\s*([^+-]+)")
+
+
+def parse_operand(text):
+    if text.endswith("]"):
+        prefix, _, address = text[:-1].partition("[")
+        prefix = prefix.strip()
+        if prefix and prefix not in SIZE_NAMES:
+            raise AssemblerError("unknown operand size {}".format(prefix))
+        return parse_address(address.strip(), SIZE_NAMES.get(prefix))
+    if text in REGISTERS:
+        return REGISTERS[text]
+    try:
+        return Immediate(int(text, 0))
+    except ValueError:
+        return text # a symbol
+
+
+def parse_address(address, size):
+    mem = Memory(size)
+    if address.startswith("rel "):
+        address = address[4:]
+        mem.symbol = ""
+    for sign, term in TERM.findall(address):
+        term = term.strip()
+        if "*" in term:
+            reg, scale = term.split("*")
+            mem.index = REGISTERS[reg.strip()]
+            mem.scale = int(scale)
+        elif term in REGISTERS:
+            if mem.base is None:
+                mem.base = REGISTERS[term]
+            else:
+                mem.index = REGISTERS[term]
+        elif term[0].isdigit():
+            mem.disp += -int(term, 0) if sign == "-" else int(term, 0)
+        elif mem.symbol == "":
+            mem.symbol = term
+        else:
+            raise AssemblerError("absolute address {}, only [rel {}] is supported".format(address, term))
+    return mem
+
+
+def immediate(value, size):
+    """
+    value as an immediate of size bytes, cut to its low bytes like NASM
+    does, e.g. for a char variable set to an int. 64 bit operations take
+    32 bit immediates that are sign extended.
+    """
+    if size == 8:
+        if not -2 ** 31 <= value < 2 ** 31:
+            raise AssemblerError("immediate {} doesn't fit 32 bits".format(value))
+        size = 4
+    return (value & (2 ** (size * 8) - 1)).to_bytes(size, "little")
+
+
+def fits_byte(value):
+    return -128 <= value <= 127
+
+
+class Branch(object):
+    """
+    jmp or jcc to a label, short while the label is in reach of a
+    signed byte.
+    """
+    __slots__ = ("condition", "target", "short")
+
+    def __init__(self, condition, target):
+        self.condition = condition
+        self.target = target
+        self.short = True
+
+    def __len__(self):
+        if self.short:
+            return 2
+        return 5 if self.condition is None else 6
+
+    def encode(self, displacement):
+        if self.short:
+            opcode = b"\xeb" if self.condition is None else bytes([0x70 + self.condition])
+            return opcode + displacement.to_bytes(1, "little", signed=True)
+        opcode = b"\xe9" if self.condition is None else bytes([0x0f, 0x80 + self.condition])
+        return opcode + displacement.to_bytes(4, "little", signed=True)
+
+
+class Code(object):
+    """
+    Encoded instruction bytes. A symbol reference is a 32 bit field at
+    position, filled with symbol + addend - the address of the field.
+    """
+    __slots__ = ("data", "position", "symbol", "addend")
+
+    def __init__(self, data, position=None, symbol=None, addend=0):
+        self.data = data
+        self.position = position
+        self.symbol = symbol
+        self.addend = addend
+
+    def __len__(self):
+        return len(self.data)
+
+
+class Assembler(object):
+    """
+    Two section assembler: instructions go into .text, Reserves into
+    .bss. Items can be added as they are generated, finish() (or
+    assemble(), which does both) resolves every reference inside .text and leaves
+    the ones to .bss in relocations as (offset, symbol, addend):
+
+        text          the machine code
+        bss_size      size of .bss
+        symbols       name -> (section, offset) of every label
+        globals       names declared global
+        relocations   32 bit pc relative fields link() fills in
+    """
+    def __init__(self):
+        self.section = None
+        self.pieces = []
+        self.text_labels = {}
+        self.bss_size = 0
+        self.symbols = {}
+        self.globals = []
+        self.relocations = []
+        self.text = bytearray()
+
+        self.encoders = {
+            "mov": self.encode_mov,
+            "movsx": self.encode_movsx,
+            "movzx": self.encode_movzx,
+            "movsxd": self.encode_movsxd,
+            "lea": self.encode_lea,
+            "test": self.encode_test,
+            "imul": self.encode_imul,
+            "inc": self.encode_inc,
+            "dec": self.encode_inc,
+            "push": self.encode_push,
+            "pop": self.encode_push,
+            "call": self.encode_call
+        }
+        for op in ALU_CODES:
+            self.encoders[op] = self.encode_alu
+        for op in SHIFT_CODES:
+            self.encoders[op] = self.encode_shift
+        for op in UNARY_CODES:
+            self.encoders[op] = self.encode_unary
+
+    def assemble(self, *item_lists):
+        for items in item_lists:
+            self.add_items(items)
+        return self.finish()
+
+    def add_items(self, items):
+        for item in items:
+            self.add(item)
+
+    def finish(self):
+        """
+        Lays out .text once everything has been added.
+        """
+        self.relax_branches()
+        self.emit_text()
+        return self
+
+    def add(self, item):
+        item_type = type(item)
+        if item_type is AsmInstr:
+            if self.section != ".text":
+                raise AssemblerError("{} outside of .text".format(item.op))
+            self.pieces.append(self.encode(item))
+        elif item_type is Label:
+            if item.name in self.symbols:
+                raise AssemblerError("label {} is defined twice".format(item.name))
+            if self.section == ".text":
+                self.text_labels[item.name] = len(self.pieces)
+                self.symbols[item.name] = (".text", None)
+            else:
+                self.symbols[item.name] = (".bss", self.bss_size)
+        elif item_type is Reserve:
+            if self.section != ".bss":
+                raise AssemblerError("resb outside of .bss")
+            self.bss_size += item.size
+        elif item_type is Directive:
+            self.directive(item.text.strip())
+
+    def directive(self, text):
+        if not text:
+            return
+        keyword, _, argument = text.partition(" ")
+        if keyword == "section" and argument in (".text", ".bss"):
+            self.section = argument
+        elif keyword == "global":
+            self.globals.append(argument)
+        elif keyword == "extern":
+            raise AssemblerError("extern {} needs an external linker".format(argument))
+        else:
+            raise AssemblerError("unsupported directive: {}".format(text))
+
+    def encode(self, instr):
+        op = instr.op
+        operands = [parse_operand(operand) for operand in instr.operands]
+
+        if op in FIXED_ENCODINGS and not operands:
+            return Code(FIXED_ENCODINGS[op])
+        if op[0] == "j" and len(operands) == 1 and type(operands[0]) is str:
+            if op == "jmp":
+                return Branch(None, operands[0])
+            if op[1:] in CONDITION_CODES:
+                return Branch(CONDITION_CODES[op[1:]], operands[0])
+        if op.startswith("set") and op[3:] in CONDITION_CODES and len(operands) == 1:
+            return self.modrm(bytes([0x0f, 0x90 + CONDITION_CODES[op[3:]]]), 0, operands[0], 1)
+
+        encoder = self.encoders.get(op)
+        if encoder is None:
+            raise AssemblerError("unsupported instruction {}".format(op))
+        try:
+            return encoder(op, *operands)
+        except (TypeError, ValueError, AttributeError):
+            raise AssemblerError("unsupported operands: {}".format(instr)) from None
+
+    @staticmethod
+    def size_of(*operands):
+        sizes = {op.size for op in operands if type(op) in (Register, Memory) and op.size}
+        if len(sizes) != 1:
+            raise AssemblerError("operand sizes don't match or are missing")
+        return sizes.pop()
+
+    @staticmethod
+    def modrm(opcode, reg, rm, size, imm=b""):
+        """
+        prefixes, opcode, ModRM, SIB and displacement of an instruction
+        with a register (or /digit) reg and a register or memory rm.
+        """
+        prefix = b"\x66" if size == 2 else b""
+        rex = 0x48 if size == 8 else 0x40
+        force_rex = False
+        if type(reg) is Register:
+            force_rex = reg.needs_rex
+            rex |= (reg.number & 8) >> 1
+            reg = reg.number & 7
+
+        position = symbol = None
+        if type(rm) is Register:
+            force_rex |= rm.needs_rex
+            rex |= (rm.number & 8) >> 3
+            body = bytes([0xc0 | reg << 3 | rm.number & 7])
+        elif type(rm) is not Memory:
+            raise TypeError
+        elif rm.symbol is not None:
+            # rip relative, relative to the end of the instruction
+            body = bytes([reg << 3 | 0b101]) + bytes(4)
+            position = 1
+            symbol = rm.symbol
+        else:
+            base, index = rm.base, rm.index
+            if base is None:
+                raise AssemblerError("memory operands need a base register")
+            if rm.disp == 0 and base.number & 7 != 5:
+                mod, disp = 0b00, b""
+            elif fits_byte(rm.disp):
+                mod, disp = 0b01, rm.disp.to_bytes(1, "little", signed=True)
+            else:
+                mod, disp = 0b10, rm.disp.to_bytes(4, "little", signed=True)
+
+            rex |= (base.number & 8) >> 3
+            if index is not None:
+                if index.number == 4:
+                    raise AssemblerError("rsp can't be an index")
+                rex |= (index.number & 8) >> 2
+                sib = bytes([(rm.scale.bit_length() - 1) << 6 | (index.number & 7) << 3 | base.number & 7])
+                body = bytes([mod << 6 | reg << 3 | 0b100]) + sib + disp
+            elif base.number & 7 == 4:
+                # rsp and r12 as base always need a SIB byte
+                body = bytes([mod << 6 | reg << 3 | 0b100, 0x24]) + disp
+            else:
+                body = bytes([mod << 6 | reg << 3 | base.number & 7]) + disp
+
+        head = prefix + (bytes([rex]) if rex != 0x40 or force_rex else b"") + opcode
+        if symbol is None:
+            return Code(head + body + imm)
+        return Code(head + body + imm, len(head) + position, symbol, rm.disp - 4 - len(imm))
+
+    @staticmethod
+    def plus_register(opcode, reg, size, imm=b""):
+        """
+        Instructions with the register in the low bits of the opcode.
+        """
+        prefix = b"\x66" if size == 2 else b""
+        rex = 0x48 if size == 8 else 0x40
+        rex |= (reg.number & 8) >> 3
+        if rex != 0x40 or reg.needs_rex:
+            prefix += bytes([rex])
+        return Code(prefix + bytes([opcode + (reg.number & 7)]) + imm)
+
+    def encode_mov(self, op, dst, src):
+        if type(src) is Immediate:
+            size = self.size_of(dst)
+            if type(dst) is Register:
+                if size == 8 and not -2 ** 31 <= src.value < 2 ** 31:
+                    return self.plus_register(0xb8, dst, 8, src.value.to_bytes(8, "little", signed=src.value < 0))
+                if size != 8:
+                    return self.plus_register(0xb0 if size == 1 else 0xb8, dst, size, immediate(src.value, size))
+            return self.modrm(b"\xc6" if size == 1 else b"\xc7", 0, dst, size, immediate(src.value, size))
+
+        size = self.size_of(dst, src)
+        if type(src) is Register:
+            return self.modrm(b"\x88" if size == 1 else b"\x89", src, dst, size)
+        return self.modrm(b"\x8a" if size == 1 else b"\x8b", dst, src, size)
+
+    def encode_movsx(self, op, dst, src):
+        if src.size != 1:
+            raise AssemblerError("movsx only from bytes")
+        return self.modrm(b"\x0f\xbe", dst, src, dst.size)
+
+    def encode_movzx(self, op, dst, src):
+        if src.size != 1:
+            raise AssemblerError("movzx only from bytes")
+        return self.modrm(b"\x0f\xb6", dst, src, dst.size)
+
+    def encode_movsxd(self, op, dst, src):
+        return self.modrm(b"\x63", dst, src, 8)
+
+    def encode_lea(self, op, dst, src):
+        if type(src) is not Memory:
+            raise TypeError
+        return self.modrm(b"\x8d", dst, src, dst.size)
+
+    def encode_alu(self, op, dst, src):
+        code = ALU_CODES[op]
+        if type(src) is Immediate:
+            size = self.size_of(dst)
+            # al, ax, eax and rax have their own opcodes without a ModRM
+            accumulator = type(dst) is Register and dst.number == 0
+            if size == 1:
+                if accumulator:
+                    return self.plus_register(code << 3 | 4, dst, 1, immediate(src.value, 1))
+                return self.modrm(b"\x80", code, dst, 1, immediate(src.value, 1))
+            if fits_byte(src.value):
+                return self.modrm(b"\x83", code, dst, size, immediate(src.value, 1))
+            if accumulator:
+                return self.plus_register(code << 3 | 5, dst, size, immediate(src.value, size))
+            return self.modrm(b"\x81", code, dst, size, immediate(src.value, size))
+
+        size = self.size_of(dst, src)
+        if type(src) is Register:
+            return self.modrm(bytes([code << 3 | (0 if size == 1 else 1)]), src, dst, size)
+        return self.modrm(bytes([code << 3 | (2 if size == 1 else 3)]), dst, src, size)
+
+    def encode_test(self, op, dst, src):
+        if type(src) is Immediate:
+            size = self.size_of(dst)
+            if type(dst) is Register and dst.number == 0:
+                return self.plus_register(0xa8 if size == 1 else 0xa9, dst, size, immediate(src.value, size))
+            return self.modrm(b"\xf6" if size == 1 else b"\xf7", 0, dst, size, immediate(src.value, size))
+        size = self.size_of(dst, src)
+        return self.modrm(b"\x84" if size == 1 else b"\x85", src, dst, size)
+
+    def encode_imul(self, op, dst, src, factor=None):
+        size = self.size_of(dst, src)
+        if factor is None:
+            return self.modrm(b"\x0f\xaf", dst, src, size)
+        if fits_byte(factor.value):
+            return self.modrm(b"\x6b", dst, src, size, immediate(factor.value, 1))
+        return self.modrm(b"\x69", dst, src, size, immediate(factor.value, size))
+
+    def encode_shift(self, op, dst, count):
+        size = self.size_of(dst)
+        if count.value == 1:
+            return self.modrm(b"\xd0" if size == 1 else b"\xd1", SHIFT_CODES[op], dst, size)
+        return self.modrm(b"\xc0" if size == 1 else b"\xc1", SHIFT_CODES[op], dst, size, immediate(count.value, 1))
+
+    def encode_unary(self, op, operand):
+        size = self.size_of(operand)
+        return self.modrm(b"\xf6" if size == 1 else b"\xf7", UNARY_CODES[op], operand, size)
+
+    def encode_inc(self, op, operand):
+        size = self.size_of(operand)
+        return self.modrm(b"\xfe" if size == 1 else b"\xff", 0 if op == "inc" else 1, operand, size)
+
+    def encode_push(self, op, reg):
+        if reg.size != 8:
+            raise AssemblerError("{} takes a 64 bit register".format(op))
+        # 64 bit is the default size, no REX.W
+        return self.plus_register(0x50 if op == "push" else 0x58, reg, 4)
+
+    def encode_call(self, op, target):
+        if type(target) is not str:
+            raise TypeError
+        return Code(b"\xe8" + bytes(4), 1, target, -4)
+
+    def link(self, addresses):
+        """
+        The text with the relocations filled in, for the sections loaded
+        at addresses (section -> address).
+        """
+        text = bytearray(self.text)
+        for field, name, addend in self.relocations:
+            section, offset = self.symbols[name]
+            value = addresses[section] + offset + addend - (addresses[".text"] + field)
+            text[field:field + 4] = value.to_bytes(4, "little", signed=True)
+        return text
+
+    def layout(self):
+        offsets = [0]
+        for piece in self.pieces:
+            offsets.append(offsets[-1] + len(piece))
+        return offsets
+
+    def label_offset(self, name, offsets):
+        if name not in self.text_labels:
+            raise AssemblerError("undefined label {}".format(name))
+        return offsets[self.text_labels[name]]
+
+    def relax_branches(self):
+        """
+        Starts with every branch short and makes the ones long that don't
+        reach, until none has to grow anymore. Branches only grow, so this
+        terminates.
+        """
+        grew = True
+        while grew:
+            grew = False
+            offsets = self.layout()
+            for i, piece in enumerate(self.pieces):
+                if type(piece) is Branch and piece.short:
+                    displacement = self.label_offset(piece.target, offsets) - offsets[i + 1]
+                    if not fits_byte(displacement):
+                        piece.short = False
+                        grew = True
+
+    def emit_text(self):
+        offsets = self.layout()
+        for name, index in self.text_labels.items():
+            self.symbols[name] = (".text", offsets[index])
+
+        text = self.text
+        for i, piece in enumerate(self.pieces):
+            if type(piece) is Branch:
+                text += piece.encode(self.label_offset(piece.target, offsets) - offsets[i + 1])
+                continue
+
+            text += piece.data
+            if piece.symbol is None:
+                continue
+            field = offsets[i] + piece.position
+            if piece.symbol not in self.symbols:
+                raise AssemblerError("undefined symbol {}".format(piece.symbol))
+            section, offset = self.symbols[piece.symbol]
+            if section == ".text":
+                text[field:field + 4] = (offset + piece.addend - field).to_bytes(4, "little", signed=True)
+            else:
+                self.relocations.append((field, piece.symbol, piece.addend))
+
+        for name in self.globals:
+            if name not in self.symbols:
+                raise AssemblerError("undefined global {}".format(name))